@@ -0,0 +1,120 @@
+"""Векторная аналитика библиотеки на NumPy (Library.analytics)"""
+from datetime import datetime
+from typing import Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # NumPy необязателен: без него Library.analytics() недоступна
+    np = None
+
+from main import (BorrowRecordStore, Library, LibraryOperationError, MICROSECONDS_PER_DAY,
+                  to_epoch_micros)
+
+
+class LibraryAnalytics:
+    """
+    Снимок записей о заимствовании, штрафов и отзывов в массивах NumPy.
+    Данные выгружаются один раз при создании, все отчеты считаются векторно.
+    """
+
+    def __init__(self, library: Library, as_of: Optional[datetime] = None) -> None:
+        if np is None:
+            raise LibraryOperationError("Для аналитики требуется пакет numpy")
+        self._as_of = to_epoch_micros(as_of or datetime.now())
+
+        store = library.loan_store
+        self._isbns = list(store.isbns)
+        live = np.array(store.live, dtype=bool)
+        self._loan_book = np.array(store.book_idx, dtype=np.int64)[live]
+        self._loan_borrow = np.array(store.borrow_ts, dtype=np.int64)[live]
+        self._loan_due = np.array(store.due_ts, dtype=np.int64)[live]
+        returned = np.array(store.return_ts, dtype=np.int64)[live]
+        self._loan_returned = returned != BorrowRecordStore.NO_RETURN
+        self._loan_reference = np.where(self._loan_returned, returned, self._as_of)
+
+        self._genres: List[str] = []
+        genre_index: Dict[str, int] = {}
+        book_genres = []
+        for isbn in self._isbns:
+            book = library.books.get(isbn)
+            if book is None:
+                book_genres.append(-1)
+                continue
+            name = book.genre.name
+            if name not in genre_index:
+                genre_index[name] = len(self._genres)
+                self._genres.append(name)
+            book_genres.append(genre_index[name])
+        self._book_genre = np.array(book_genres, dtype=np.int64)
+
+        self._fine_users: List[str] = []
+        user_index: Dict[str, int] = {}
+        fine_user, fine_amount, fine_paid = [], [], []
+        for fine in library.fines.values():
+            user_id = fine.user.user_id
+            if user_id not in user_index:
+                user_index[user_id] = len(self._fine_users)
+                self._fine_users.append(user_id)
+            fine_user.append(user_index[user_id])
+            fine_amount.append(fine.amount)
+            fine_paid.append(fine.paid)
+        self._fine_user = np.array(fine_user, dtype=np.int64)
+        self._fine_amount = np.array(fine_amount, dtype=np.float64)
+        self._fine_paid = np.array(fine_paid, dtype=bool)
+
+        self._review_isbns: List[str] = []
+        isbn_index: Dict[str, int] = {}
+        review_book, review_rating = [], []
+        for review in library.reviews.values():
+            isbn = review.book.isbn
+            if isbn not in isbn_index:
+                isbn_index[isbn] = len(self._review_isbns)
+                self._review_isbns.append(isbn)
+            review_book.append(isbn_index[isbn])
+            review_rating.append(review.rating)
+        self._review_book = np.array(review_book, dtype=np.int64)
+        self._review_rating = np.array(review_rating, dtype=np.int64)
+
+    def overdue_mask(self) -> "np.ndarray":
+        """Маска просроченных выдач (возвращены позже срока или не возвращены к as_of)"""
+        return self._loan_reference > self._loan_due
+
+    def overdue_days_distribution(self) -> Dict[int, int]:
+        """Распределение просроченных выдач по числу дней просрочки: дни -> количество"""
+        overdue = self.overdue_mask()
+        days = (self._loan_reference[overdue] - self._loan_due[overdue]) // MICROSECONDS_PER_DAY
+        counts = np.bincount(days) if days.size else np.zeros(0, dtype=np.int64)
+        return {int(day): int(count) for day, count in enumerate(counts) if count}
+
+    def fine_totals_by_user(self, unpaid_only: bool = False) -> Dict[str, float]:
+        """Сумма штрафов по пользователям"""
+        mask = ~self._fine_paid if unpaid_only else np.ones(self._fine_user.size, dtype=bool)
+        totals = np.bincount(self._fine_user[mask], weights=self._fine_amount[mask],
+                             minlength=len(self._fine_users))
+        return {user_id: float(totals[i]) for i, user_id in enumerate(self._fine_users) if totals[i]}
+
+    def loans_per_genre_per_month(self) -> Dict[str, Dict[str, int]]:
+        """Количество выдач по жанрам и месяцам выдачи: жанр -> {"ГГГГ-ММ": количество}"""
+        genres = self._book_genre[self._loan_book] if self._loan_book.size else self._loan_book
+        known = genres >= 0
+        months = self._loan_borrow[known].astype("datetime64[us]").astype("datetime64[M]").astype(np.int64)
+        genres = genres[known]
+        if not months.size:
+            return {}
+        first_month = months.min()
+        span = int(months.max() - first_month) + 1
+        counts = np.bincount(genres * span + (months - first_month), minlength=len(self._genres) * span)
+        counts = counts.reshape(len(self._genres), span)
+
+        result: Dict[str, Dict[str, int]] = {}
+        for genre_i, month_i in zip(*np.nonzero(counts)):
+            month = str(np.datetime64(int(first_month + month_i), "M"))
+            result.setdefault(self._genres[genre_i], {})[month] = int(counts[genre_i, month_i])
+        return result
+
+    def rating_histograms(self) -> Dict[str, List[int]]:
+        """Гистограммы оценок по книгам: ISBN -> [число оценок 1, 2, 3, 4, 5]"""
+        books = len(self._review_isbns)
+        counts = np.bincount(self._review_book * 5 + (self._review_rating - 1), minlength=books * 5)
+        counts = counts.reshape(books, 5)
+        return {isbn: counts[i].tolist() for i, isbn in enumerate(self._review_isbns)}
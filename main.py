@@ -1,8 +1,37 @@
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Set, Tuple, Iterator, Iterable, Callable, Union
 from datetime import datetime,timedelta
+import abc
+import contextlib
+import dbm
+import functools
+import gc
 import json
+import mmap
+import os
+import random
+import re
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import heapq
+import itertools
+import unicodedata
+from bisect import bisect_left, bisect_right, insort
+from operator import itemgetter
+from array import array
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
 import xml.etree.ElementTree as ET
 
+try:
+    import numpy as np
+except ImportError:  # NumPy необязателен: без него агрегаты считаются обычными циклами
+    np = None
+
 current_year = datetime.now().year
 
 
@@ -231,15 +260,42 @@ class InvalidLibraryNameError(LibraryManagementError):
     pass
 
 
-class Author:
+class TrackedEntity:
+    """Базовый класс сущностей, состояние которых учитывают индексы библиотеки"""
+
+    __slots__ = ("_library",)
+
+    def _set_tracked(self, attr: str, value: Any) -> None:
+        """Изменяет поле, поддерживая индексы библиотеки в актуальном состоянии"""
+        library = self._library
+        if library is None:
+            setattr(self, attr, value)
+            return
+        library._untrack(self)
+        try:
+            setattr(self, attr, value)
+        finally:
+            library._track(self)
+        library._mark_dirty(self)
+
+    def _touch(self) -> None:
+        """Отмечает сущность измененной с последней контрольной точки библиотеки"""
+        if self._library is not None:
+            self._library._mark_dirty(self)
+
+
+class Author(TrackedEntity):
     """Класс автора книги"""
 
+    __slots__ = ("_author_id", "_name", "_birth_year", "_country")
+
     def __init__(self, author_id: str, name: str, birth_year: Optional[int] = None,
                  country: Optional[str] = None) -> None:
         if not name or not name.strip():
             raise InvalidAuthorNameError("Имя автора обязательно и не может быть пустым")
         if not author_id or not author_id.strip():
             raise InvalidAuthorNameError("ID автора обязательно и не может быть пустым")
+        self._library = None
         self._author_id = author_id.strip()
         self._name = name.strip()
         current_year = datetime.now().year
@@ -265,7 +321,7 @@ class Author:
     def name(self, value: str) -> None:
         if not value or not value.strip():
             raise InvalidAuthorNameError("Имя автора обязательно и не может быть пустым")
-        self._name = value.strip()
+        self._set_tracked("_name", value.strip())
 
     @property
     def birth_year(self) -> Optional[int]:
@@ -277,6 +333,7 @@ class Author:
         if value is not None and (value < 0 or value > current_year):
             raise InvalidBirthYearError("Год рождения некорректен")
         self._birth_year = value
+        self._touch()
 
     @property
     def country(self) -> Optional[str]:
@@ -285,6 +342,7 @@ class Author:
     @country.setter
     def country(self, value: Optional[str]) -> None:
         self._country = value
+        self._touch()
 
      
     def get_age(self) -> Optional[int]:
@@ -327,12 +385,15 @@ class Author:
         return "\n".join(lines)
 
 
-class Genre:
+class Genre(TrackedEntity):
     """Класс жанра книги"""
 
+    __slots__ = ("_name", "_description")
+
     def __init__(self, name: str, description: str = "") -> None:
         if not name.strip():
             raise InvalidGenreNameError("Название жанра не может быть пустым")
+        self._library = None
         self._name = name.strip()
         self._description = description.strip() if description else ""
 
@@ -344,7 +405,11 @@ class Genre:
     def name(self, value: str) -> None:
         if not value or not value.strip():
             raise InvalidGenreNameError("Название жанра не может быть пустым")
-        self._name = value.strip()
+        if self._library is None:
+            self._name = value.strip()
+        else:
+            # Название - ключ реестра жанров, поэтому переименование проводит библиотека
+            self._library.rename_genre(self._name, value)
 
     @property
     def description(self) -> str:
@@ -353,6 +418,7 @@ class Genre:
     @description.setter
     def description(self, value: str) -> None:
         self._description = value.strip() if value else ""
+        self._touch()
 
     def has_description(self) -> bool:
         """Проверяет, есть ли описание у жанра"""
@@ -376,14 +442,17 @@ class Genre:
         return f"{self._name} — {self._description or 'описание отсутствует'}"
 
 
-class Publisher:
+class Publisher(TrackedEntity):
     """Класс издателя книги"""
 
+    __slots__ = ("_publisher_id", "_name", "_location")
+
     def __init__(self, publisher_id: str, name: str, location: Optional[str] = None) -> None:
         if not name or not name.strip():
             raise InvalidPublisherNameError("Имя издателя обязательно и не может быть пустым")
         if not publisher_id or not publisher_id.strip():
             raise InvalidPublisherIDError("ID издателя обязательно и не может быть пустым")
+        self._library = None
         self._publisher_id = publisher_id.strip()
         self._name = name.strip()
         self._location = location
@@ -407,6 +476,7 @@ class Publisher:
         if not value or not value.strip():
             raise InvalidPublisherNameError("Имя издателя обязательно и не может быть пустым")
         self._name = value.strip()
+        self._touch()
 
     @property
     def location(self) -> Optional[str]:
@@ -415,6 +485,7 @@ class Publisher:
     @location.setter
     def location(self, value: Optional[str]) -> None:
         self._location = value
+        self._touch()
 
      
     def has_location(self) -> bool:
@@ -444,7 +515,11 @@ class Publisher:
         return "\n".join(lines)
 
 
-class Book:
+class Book(TrackedEntity):
+    """Класс книги"""
+
+    __slots__ = ("_isbn", "_title", "_authors", "_genre", "_publisher", "_year", "_pages")
+
     def __init__(self, isbn: str, title: str, authors: List[Author], genre: Genre,
                  publisher: Publisher, year: int, pages: Optional[int] = None) -> None:
         if not isbn or not isbn.strip():
@@ -462,6 +537,7 @@ class Book:
         if pages is not None and pages <= 0:
             raise InvalidBookPagesError("Количество страниц должно быть положетельным")
 
+        self._library = None
         self.isbn = isbn
         self.title = title
         self.authors = authors
@@ -488,7 +564,7 @@ class Book:
     def title(self, value: str) -> None:
         if not value or not value.strip():
             raise InvalidBookTitleError("Название книги обязательно")
-        self._title = value.strip()
+        self._set_tracked("_title", value.strip())
 
     @property
     def authors(self) -> List[Author]:
@@ -498,7 +574,7 @@ class Book:
     def authors(self, value: List[Author]) -> None:
         if not value or not all(isinstance(a, Author) for a in value):
             raise BookAuthorsListError("Список авторов должен содержать хотя бы одного автора и быть объектами Author")
-        self._authors = value
+        self._set_tracked("_authors", value)
 
     @property
     def genre(self) -> Genre:
@@ -508,7 +584,7 @@ class Book:
     def genre(self, value: Genre) -> None:
         if not isinstance(value, Genre):
             raise InvalidBookGenreError("Жанр должен быть объектом Genre")
-        self._genre = value
+        self._set_tracked("_genre", value)
 
     @property
     def publisher(self) -> Publisher:
@@ -518,7 +594,7 @@ class Book:
     def publisher(self, value: Publisher) -> None:
         if not isinstance(value, Publisher):
             raise InvalidBookPublisherError("Издатель должен быть объектом Publisher")
-        self._publisher = value
+        self._set_tracked("_publisher", value)
 
     @property
     def year(self) -> int:
@@ -528,7 +604,7 @@ class Book:
     def year(self, value: int) -> None:
         if value is None or value < 0 or value > datetime.now().year:
             raise InvalidBookYearError("Год издания некорректен")
-        self._year = value
+        self._set_tracked("_year", value)
 
     @property
     def pages(self) -> Optional[int]:
@@ -538,7 +614,7 @@ class Book:
     def pages(self, value: Optional[int]) -> None:
         if value is not None and value <= 0:
             raise InvalidBookPagesError("Количество страниц должно быть положительным числом")
-        self._pages = value
+        self._set_tracked("_pages", value)
 
      
     def add_author(self, author: Author) -> None:
@@ -546,12 +622,12 @@ class Book:
         if not isinstance(author, Author):
             raise InvalidAuthorNameError("Автор должен быть объектом Author")
         if author not in self._authors:
-            self._authors.append(author)
+            self._set_tracked("_authors", self._authors + [author])
 
     def remove_author(self, author: Author) -> None:
         """Удаляет автора из книги"""
         if author in self._authors:
-            self._authors.remove(author)
+            self._set_tracked("_authors", [a for a in self._authors if a is not author])
         if not self._authors:
             raise BookAuthorsListError("Книга должна иметь хотя бы одного автора")
 
@@ -568,10 +644,15 @@ class Book:
         }
 
     @classmethod
-    def from_dict(cls, data: Dict[str, Any]):
-        authors = [Author.from_dict(a) for a in data["authors"]]
-        genre = Genre.from_dict(data["genre"])
-        publisher = Publisher.from_dict(data["publisher"])
+    def from_dict(cls, data: Dict[str, Any], identity_map: Optional["IdentityMap"] = None):
+        """
+        identity_map: общий реестр авторов, жанров и издателей, чтобы книги ссылались
+        на одни и те же объекты вместо копий
+        """
+        identity_map = identity_map or IdentityMap()
+        authors = [identity_map.author_from_dict(a) for a in data["authors"]]
+        genre = identity_map.genre_from_dict(data["genre"])
+        publisher = identity_map.publisher_from_dict(data["publisher"])
         return cls(
             isbn=data["isbn"],
             title=data["title"],
@@ -597,14 +678,76 @@ class Book:
         return "\n".join(lines)
 
 
-class User:
+class IdentityMap:
+    """Реестр, выдающий один общий объект на каждого автора, жанр, издателя и книгу"""
+
+    def __init__(self,
+                 authors: Optional[Dict[str, Author]] = None,
+                 genres: Optional[Dict[str, Genre]] = None,
+                 publishers: Optional[Dict[str, Publisher]] = None,
+                 books: Optional[Dict[str, Book]] = None) -> None:
+        self._authors: Dict[str, Author] = dict(authors or {})
+        self._genres: Dict[str, Genre] = dict(genres or {})
+        self._publishers: Dict[str, Publisher] = dict(publishers or {})
+        self._books: Dict[str, Book] = dict(books or {})
+
+    def author(self, author_id: str, name: str, birth_year: Optional[int] = None,
+               country: Optional[str] = None) -> Author:
+        """Возвращает зарегистрированного автора с таким ID или создает нового"""
+        author = self._authors.get((author_id or "").strip())
+        if author is None:
+            author = Author(author_id, name, birth_year, country)
+            self._authors[author.author_id] = author
+        return author
+
+    def genre(self, name: str, description: str = "") -> Genre:
+        """Возвращает зарегистрированный жанр с таким названием или создает новый"""
+        genre = self._genres.get((name or "").strip())
+        if genre is None:
+            genre = Genre(name, description)
+            self._genres[genre.name] = genre
+        return genre
+
+    def publisher(self, publisher_id: str, name: str, location: Optional[str] = None) -> Publisher:
+        """Возвращает зарегистрированного издателя с таким ID или создает нового"""
+        publisher = self._publishers.get((publisher_id or "").strip())
+        if publisher is None:
+            publisher = Publisher(publisher_id, name, location)
+            self._publishers[publisher.publisher_id] = publisher
+        return publisher
+
+    def book(self, isbn: str, factory: Callable[[], Book]) -> Book:
+        """Возвращает зарегистрированную книгу с таким ISBN или создает ее фабрикой"""
+        book = self._books.get((isbn or "").strip())
+        if book is None:
+            book = factory()
+            self._books[book.isbn] = book
+        return book
+
+    def author_from_dict(self, data: Dict[str, Any]) -> Author:
+        return self.author(data["author_id"], data["name"], data.get("birth_year"), data.get("country"))
+
+    def genre_from_dict(self, data: Dict[str, Any]) -> Genre:
+        return self.genre(data["name"], data.get("description", ""))
+
+    def publisher_from_dict(self, data: Dict[str, Any]) -> Publisher:
+        return self.publisher(data["publisher_id"], data["name"], data.get("location"))
+
+    def book_from_dict(self, data: Dict[str, Any]) -> Book:
+        return self.book(data["isbn"], lambda: Book.from_dict(data, self))
+
+
+class User(TrackedEntity):
     """Класс пользователя библиотеки"""
 
+    __slots__ = ("_user_id", "_name", "_borrowed_books")
+
     def __init__(self, user_id: str, name: str) -> None:
         if not user_id or not user_id.strip():
             raise InvalidUserIDError("ID пользователя обязателен")
         if not name or not name.strip():
             raise InvalidUserNameError("Имя пользователя обязательно и не может быть пустым")
+        self._library = None
         self._user_id = user_id.strip()
         self._name = name.strip()
         self._borrowed_books: List[Book] = [] 
@@ -627,6 +770,7 @@ class User:
         if not value or not value.strip():
             raise InvalidUserNameError("Имя пользователя обязательно и не может быть пустым")
         self._name = value.strip()
+        self._touch()
 
     @property
     def borrowed_books(self) -> List[Book]:
@@ -637,17 +781,20 @@ class User:
         if not isinstance(value, list) or not all(isinstance(b, Book) for b in value):
             raise UserError("borrowed_books должен быть списком объектов Book")
         self._borrowed_books = value
+        self._touch()
 
      
     def borrow_book(self, book: Book) -> None:
         """Добавляет книгу в список заимствованных"""
         if book not in self._borrowed_books:
             self._borrowed_books.append(book)
+            self._touch()
 
     def return_book(self, book: Book) -> None:
         """Удаляет книгу из списка заимствованных"""
         if book in self._borrowed_books:
             self._borrowed_books.remove(book)
+            self._touch()
 
      
     def to_dict(self) -> Dict[str, Any]:
@@ -673,9 +820,11 @@ class User:
         borrowed = ", ".join([b.title for b in self._borrowed_books]) or "нет книг"
         return f"ID: {self._user_id}\nИмя: {self._name}\nЗаимствованные книги: {borrowed}"
 
-class BorrowRecord:
+class BorrowRecord(TrackedEntity):
     """Класс записи о заимствовании книги"""
 
+    __slots__ = ("_record_id", "_book", "_user", "_borrow_date", "_due_date", "_return_date")
+
     def __init__(self,
                  record_id: str,
                  book: Book,
@@ -693,6 +842,7 @@ class BorrowRecord:
         if due_date <= borrow_date:
             raise DateConsistencyError("Дата возврата должна быть позже даты выдачи")
 
+        self._library = None
         self._record_id = record_id.strip()
         self._book = book
         self._user = user
@@ -709,7 +859,7 @@ class BorrowRecord:
     def record_id(self, value: str) -> None:
         if not value or not value.strip():
             raise InvalidRecordIDError("ID записи обязателен")
-        self._record_id = value.strip()
+        self._set_tracked("_record_id", value.strip())
 
     @property
     def book(self) -> Book:
@@ -719,7 +869,7 @@ class BorrowRecord:
     def book(self, value: Book) -> None:
         if not isinstance(value, Book):
             raise InvalidBookReferenceError("Книга должна быть объектом Book")
-        self._book = value
+        self._set_tracked("_book", value)
 
     @property
     def user(self) -> User:
@@ -729,7 +879,7 @@ class BorrowRecord:
     def user(self, value: User) -> None:
         if not isinstance(value, User):
             raise InvalidUserReferenceError("Пользователь должен быть объектом User")
-        self._user = value
+        self._set_tracked("_user", value)
 
     @property
     def borrow_date(self) -> datetime:
@@ -739,7 +889,7 @@ class BorrowRecord:
     def borrow_date(self, value: datetime) -> None:
         if value >= self._due_date:
             raise DateConsistencyError("Дата выдачи должна быть раньше срока возврата")
-        self._borrow_date = value
+        self._set_tracked("_borrow_date", value)
 
     @property
     def due_date(self) -> datetime:
@@ -749,7 +899,7 @@ class BorrowRecord:
     def due_date(self, value: datetime) -> None:
         if value <= self._borrow_date:
             raise DateConsistencyError("Срок возврата должен быть позже даты выдачи")
-        self._due_date = value
+        self._set_tracked("_due_date", value)
 
     @property
     def return_date(self) -> Optional[datetime]:
@@ -759,7 +909,7 @@ class BorrowRecord:
     def return_date(self, value: Optional[datetime]) -> None:
         if value and value < self._borrow_date:
             raise InvalidReturnDateError("Дата возврата не может быть раньше даты выдачи")
-        self._return_date = value
+        self._set_tracked("_return_date", value)
 
      
     def is_overdue(self) -> bool:
@@ -835,9 +985,11 @@ class BorrowRecord:
                 f"Статус: {status}{overdue}")
 
 
-class Fine:
+class Fine(TrackedEntity):
     """Класс штрафа за различные нарушения"""
 
+    __slots__ = ("_fine_id", "_user", "_borrow_record", "_amount", "_reason", "_paid")
+
     def __init__(self,
                  fine_id: str,
                  user: User,
@@ -857,12 +1009,14 @@ class Fine:
         if not reason or not reason.strip():
             raise InvalidFineReasonError("Причина штрафа обязательна")
 
+        self._library = None
         self._fine_id = fine_id.strip()
         self._user = user
         self._borrow_record = borrow_record
         self._amount = amount
         self._reason = reason.strip()
         self._paid = paid
+        self._touch()
 
     @property
     def fine_id(self) -> str:
@@ -882,7 +1036,7 @@ class Fine:
     def user(self, value: User) -> None:
         if not isinstance(value, User):
             raise InvalidUserReferenceError("Пользователь должен быть объектом User")
-        self._user = value
+        self._set_tracked("_user", value)
 
     @property
     def borrow_record(self) -> BorrowRecord:
@@ -892,7 +1046,7 @@ class Fine:
     def borrow_record(self, value: BorrowRecord) -> None:
         if not isinstance(value, BorrowRecord):
             raise InvalidFineReferenceError("Запись о заимствовании должна быть объектом BorrowRecord")
-        self._borrow_record = value
+        self._set_tracked("_borrow_record", value)
 
     @property
     def amount(self) -> float:
@@ -903,6 +1057,7 @@ class Fine:
         if value <= 0:
             raise InvalidFineAmountError("Сумма штрафа должна быть положительной")
         self._amount = value
+        self._touch()
 
     @property
     def reason(self) -> str:
@@ -913,6 +1068,7 @@ class Fine:
         if not value or not value.strip():
             raise InvalidFineReasonError("Причина штрафа обязательна")
         self._reason = value.strip()
+        self._touch()
 
     @property
     def paid(self) -> bool:
@@ -920,12 +1076,12 @@ class Fine:
 
     @paid.setter
     def paid(self, value: bool) -> None:
-        self._paid = value
+        self._set_tracked("_paid", value)
 
      
     def pay_fine(self) -> None:
         """Отмечает штраф как оплаченный"""
-        self._paid = True
+        self._set_tracked("_paid", True)
 
      
     def to_dict(self) -> Dict[str, Any]:
@@ -973,9 +1129,11 @@ class Fine:
                 f"Причина: {self._reason}\n"
                 f"Статус: {status}\n")
 
-class Reservation:
+class Reservation(TrackedEntity):
     """Класс резервирования книги"""
 
+    __slots__ = ("_reservation_id", "_user", "_book", "_reservation_date", "_expiry_date", "_active")
+
     def __init__(self,
                  reservation_id: str,
                  user: User,
@@ -992,12 +1150,14 @@ class Reservation:
         if expiry_date <= reservation_date:
             raise ReservationDateConsistencyError("Дата истечения резервирования должна быть позже даты создания")
 
+        self._library = None
         self._reservation_id = reservation_id.strip()
         self._user = user
         self._book = book
         self._reservation_date = reservation_date
         self._expiry_date = expiry_date
         self._active = True
+        self._touch()
 
      
     @property
@@ -1008,7 +1168,7 @@ class Reservation:
     def reservation_id(self, value: str) -> None:
         if not value or not value.strip():
             raise InvalidReservationIDError("ID резервирования обязателен")
-        self._reservation_id = value.strip()
+        self._set_tracked("_reservation_id", value.strip())
 
     @property
     def user(self) -> User:
@@ -1018,7 +1178,7 @@ class Reservation:
     def user(self, value: User) -> None:
         if not isinstance(value, User):
             raise InvalidUserReferenceError("Пользователь должен быть объектом User")
-        self._user = value
+        self._set_tracked("_user", value)
 
     @property
     def book(self) -> Book:
@@ -1028,7 +1188,7 @@ class Reservation:
     def book(self, value: Book) -> None:
         if not isinstance(value, Book):
             raise InvalidBookReferenceError("Книга должна быть объектом Book")
-        self._book = value
+        self._set_tracked("_book", value)
 
     @property
     def reservation_date(self) -> datetime:
@@ -1039,6 +1199,7 @@ class Reservation:
         if value >= self._expiry_date:
             raise ExpireDateConsistencyError("Дата резервирования должна быть раньше даты истечения")
         self._reservation_date = value
+        self._touch()
 
     @property
     def expiry_date(self) -> datetime:
@@ -1048,7 +1209,7 @@ class Reservation:
     def expiry_date(self, value: datetime) -> None:
         if value <= self._reservation_date:
             raise ReservationDateConsistencyError("Дата истечения должна быть позже даты резервирования")
-        self._expiry_date = value
+        self._set_tracked("_expiry_date", value)
 
     @property
     def active(self) -> bool:
@@ -1056,16 +1217,16 @@ class Reservation:
 
     @active.setter
     def active(self, value: bool) -> None:
-        self._active = value
+        self._set_tracked("_active", value)
 
      
     def cancel_reservation(self) -> None:
         """Отменяет резервирование"""
-        self._active = False
+        self._set_tracked("_active", False)
 
     def activate_reservation(self) -> None:
         """Активирует резервирование (если было отменено)"""
-        self._active = True
+        self._set_tracked("_active", True)
 
     def is_expired(self) -> bool:
         """Проверяет, истекло ли резервирование"""
@@ -1131,9 +1292,11 @@ class Reservation:
                 f"Статус: {status}{expired}\n"
                 f"Дней до истечения: {self.get_days_until_expiry()}")
 
-class Review:
+class Review(TrackedEntity):
     """Класс отзыва на книгу"""
 
+    __slots__ = ("_review_id", "_user", "_book", "_rating", "_comment", "_review_date")
+
     def __init__(self,
                  review_id: str,
                  user: User,
@@ -1151,12 +1314,14 @@ class Review:
         if rating < 1 or rating > 5:
             raise InvalidRatingError("Рейтинг должен быть от 1 до 5")
 
+        self._library = None
         self._review_id = review_id.strip()
         self._user = user
         self._book = book
         self._rating = rating
         self._comment = comment.strip()
         self._review_date = review_date or datetime.now()
+        self._touch()
 
      
     @property
@@ -1177,7 +1342,7 @@ class Review:
     def user(self, value: User) -> None:
         if not isinstance(value, User):
             raise InvalidUserReferenceError("Пользователь должен быть объектом User")
-        self._user = value
+        self._set_tracked("_user", value)
 
     @property
     def book(self) -> Book:
@@ -1187,7 +1352,7 @@ class Review:
     def book(self, value: Book) -> None:
         if not isinstance(value, Book):
             raise InvalidBookReferenceError("Книга должна быть объектом Book")
-        self._book = value
+        self._set_tracked("_book", value)
 
     @property
     def rating(self) -> int:
@@ -1198,6 +1363,7 @@ class Review:
         if value < 1 or value > 5:
             raise InvalidRatingError("Рейтинг должен быть от 1 до 5")
         self._rating = value
+        self._touch()
 
     @property
     def comment(self) -> str:
@@ -1206,6 +1372,7 @@ class Review:
     @comment.setter
     def comment(self, value: str) -> None:
         self._comment = value.strip()
+        self._touch()
 
     @property
     def review_date(self) -> datetime:
@@ -1214,6 +1381,7 @@ class Review:
     @review_date.setter
     def review_date(self, value: datetime) -> None:
         self._review_date = value
+        self._touch()
 
      
     def is_positive(self) -> bool:
@@ -1275,23 +1443,1276 @@ class Review:
                 f"Комментарий: {self._comment or 'без комментария'}\n"
                 f"Дата: {self._review_date.strftime('%d.%m.%Y %H:%M')}")
 
+class TokenIndex:
+    """
+    Инвертированный индекс: токен -> множество ключей (ISBN). Словарь токенов хранится
+    отсортированным (для поиска по началу токена) и с триграммами (для поиска по его части).
+    """
+
+    _TOKEN_RE = re.compile(r"\w+")
+    # Доля ключей, начиная с которой токен запроса не сужает поиск и не используется
+    SELECTIVITY = 0.2
+
+    def __init__(self) -> None:
+        self._postings: Dict[str, Set[str]] = {}
+        self._key_tokens: Dict[str, Set[str]] = {}
+        self._vocabulary = SortedList()
+        self._token_trigrams: Dict[str, Set[str]] = {}
+
+    @classmethod
+    def tokenize(cls, text: str) -> List[str]:
+        """Разбивает текст на токены в нижнем регистре"""
+        return cls._TOKEN_RE.findall(text.lower())
+
+    @staticmethod
+    def _trigrams(token: str) -> Set[str]:
+        return {token[i:i + 3] for i in range(len(token) - 2)}
+
+    def add(self, key: str, texts: List[str]) -> None:
+        """Индексирует тексты под ключом"""
+        tokens = self._key_tokens.setdefault(key, set())
+        for text in texts:
+            for token in self.tokenize(text):
+                tokens.add(token)
+                keys = self._postings.get(token)
+                if keys is None:
+                    keys = self._postings[token] = set()
+                    self._vocabulary.add(token)
+                    for trigram in self._trigrams(token):
+                        self._token_trigrams.setdefault(trigram, set()).add(token)
+                keys.add(key)
+
+    def remove(self, key: str) -> None:
+        """Удаляет ключ из всех списков вхождений"""
+        for token in self._key_tokens.pop(key, ()):
+            keys = self._postings.get(token)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                del self._postings[token]
+                self._vocabulary.remove(token)
+                for trigram in self._trigrams(token):
+                    tokens = self._token_trigrams[trigram]
+                    tokens.discard(token)
+                    if not tokens:
+                        del self._token_trigrams[trigram]
+
+    def _matching_tokens(self, token: str, at_start: bool, at_end: bool) -> Iterable[str]:
+        """
+        Токены словаря, в которых может стоять токен запроса: at_start - токен запроса
+        начинает токен текста (перед ним во фрагменте разделитель), at_end - заканчивает.
+        """
+        if at_start and at_end:
+            return (token,) if token in self._postings else ()
+        if at_start:
+            vocabulary = self._vocabulary
+            tail = vocabulary.iter_range(vocabulary.bisect_left(token), len(vocabulary))
+            return itertools.takewhile(lambda indexed: indexed.startswith(token), tail)
+        if len(token) < 3:
+            candidates: Iterable[str] = self._postings
+        else:
+            groups = sorted((self._token_trigrams.get(trigram, set()) for trigram in self._trigrams(token)),
+                            key=len)
+            candidates = groups[0].intersection(*groups[1:])
+        if at_end:
+            return (indexed for indexed in candidates if indexed.endswith(token))
+        return (indexed for indexed in candidates if token in indexed)
+
+    def lookup(self, fragment: str) -> Optional[Set[str]]:
+        """
+        Возвращает ключи, тексты которых могут содержать фрагмент как подстроку.
+        None означает, что индекс неприменим: во фрагменте нет токенов или ни один из них
+        не отсекает заметной доли ключей, и дешевле проверить все тексты подряд.
+        """
+        fragment = fragment.lower()
+        parts = [(m.group(), m.start() > 0, m.end() < len(fragment)) for m in self._TOKEN_RE.finditer(fragment)]
+        limit = int(len(self._key_tokens) * self.SELECTIVITY)
+
+        result: Optional[Set[str]] = None
+        # Сначала точные токены, затем начала токенов, затем части - от длинных к коротким
+        for token, at_start, at_end in sorted(parts, key=lambda part: (not (part[1] and part[2]),
+                                                                       not part[1], -len(part[0]))):
+            matched: Set[str] = set()
+            total = 0
+            for indexed_token in self._matching_tokens(token, at_start, at_end):
+                keys = self._postings[indexed_token]
+                total += len(keys)
+                if total > limit:
+                    break
+                matched |= keys
+            else:
+                result = matched if result is None else result & matched
+                if not result:
+                    return set()
+        return result
+
+
+class TrigramIndex:
+    """Триграммный индекс для нечеткого поиска с ранжированием по сходству"""
+
+    _WORD_RE = re.compile(r"\w+")
+
+    def __init__(self) -> None:
+        self._postings: Dict[str, Set[Tuple[str, int]]] = {}
+        self._key_trigrams: Dict[str, List[Set[str]]] = {}
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Приводит текст к единой форме: NFKC, casefold, ё -> е"""
+        return unicodedata.normalize("NFKC", text).casefold().replace("ё", "е")
+
+    @classmethod
+    def trigrams(cls, text: str) -> Set[str]:
+        """Возвращает множество триграмм слов текста (слова дополняются пробелами)"""
+        result = set()
+        for word in cls._WORD_RE.findall(cls.normalize(text)):
+            padded = f"  {word} "
+            for i in range(len(padded) - 2):
+                result.add(padded[i:i + 3])
+        return result
+
+    def add(self, key: str, texts: List[str]) -> None:
+        """Индексирует тексты под ключом"""
+        entries = self._key_trigrams.setdefault(key, [])
+        for text in texts:
+            grams = self.trigrams(text)
+            entry = (key, len(entries))
+            entries.append(grams)
+            for gram in grams:
+                self._postings.setdefault(gram, set()).add(entry)
+
+    def remove(self, key: str) -> None:
+        """Удаляет ключ из индекса"""
+        for position, grams in enumerate(self._key_trigrams.pop(key, ())):
+            entry = (key, position)
+            for gram in grams:
+                entries = self._postings.get(gram)
+                if entries is None:
+                    continue
+                entries.discard(entry)
+                if not entries:
+                    del self._postings[gram]
+
+    def scores(self, query: str, threshold: float = 0.3) -> Dict[str, float]:
+        """
+        Возвращает сходство (коэффициент Жаккара по триграммам) для ключей не ниже порога.
+        Для ключа с несколькими текстами берется лучший из них.
+        """
+        query_grams = self.trigrams(query)
+        if not query_grams:
+            return {}
+
+        shared: Dict[Tuple[str, int], int] = {}
+        for gram in query_grams:
+            for entry in self._postings.get(gram, ()):
+                shared[entry] = shared.get(entry, 0) + 1
+
+        result: Dict[str, float] = {}
+        for (key, position), common in shared.items():
+            size = len(self._key_trigrams[key][position])
+            similarity = common / (len(query_grams) + size - common)
+            if similarity >= threshold and similarity > result.get(key, 0.0):
+                result[key] = similarity
+        return result
+
+
+class SortedList:
+    """
+    Отсортированная последовательность из блоков ограниченного размера (по образцу
+    sortedcontainers.SortedList). Вставка и удаление сдвигают элементы только внутри
+    одного блока и стоят O(log n + LOAD), а не O(n), как insort в один большой список.
+    Позиции элементов считаются по смещениям блоков, которые пересчитываются лениво,
+    после изменений. update() добавляет пачку элементов одной сортировкой.
+    """
+
+    LOAD = 1000
+
+    def __init__(self, items: Iterable[Any] = ()) -> None:
+        self._blocks: List[List[Any]] = []
+        self._maxes: List[Any] = []
+        self._len = 0
+        # Позиция начала каждого блока; None - устарели после изменения
+        self._offsets: Optional[List[int]] = None
+        self.update(items)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[Any]:
+        for block in self._blocks:
+            yield from block
+
+    def _rebuild(self, items: List[Any]) -> None:
+        """Раскладывает отсортированный список по блокам"""
+        load = self.LOAD
+        self._blocks = [items[i:i + load] for i in range(0, len(items), load)]
+        self._maxes = [block[-1] for block in self._blocks]
+        self._len = len(items)
+        self._offsets = None
+
+    def update(self, items: Iterable[Any]) -> None:
+        """Добавляет элементы: небольшую пачку по одному, крупную - слиянием и одной сортировкой"""
+        items = list(items)
+        if len(items) * 8 < self._len:
+            for item in items:
+                self.add(item)
+            return
+        if items:
+            merged = list(self)
+            merged.extend(items)
+            merged.sort()
+            self._rebuild(merged)
+
+    def add(self, item: Any) -> None:
+        """Вставляет элемент с сохранением порядка"""
+        if not self._blocks:
+            self._blocks.append([item])
+            self._maxes.append(item)
+        else:
+            i = bisect_left(self._maxes, item)
+            if i == len(self._maxes):
+                i -= 1
+                self._blocks[i].append(item)
+                self._maxes[i] = item
+            else:
+                insort(self._blocks[i], item)
+            block = self._blocks[i]
+            if len(block) > 2 * self.LOAD:
+                self._blocks[i:i + 1] = [block[:self.LOAD], block[self.LOAD:]]
+                self._maxes[i:i + 1] = [block[self.LOAD - 1], block[-1]]
+        self._len += 1
+        self._offsets = None
+
+    def remove(self, item: Any) -> bool:
+        """Удаляет одно вхождение элемента; False, если его нет"""
+        i = bisect_left(self._maxes, item)
+        if i == len(self._maxes):
+            return False
+        block = self._blocks[i]
+        j = bisect_left(block, item)
+        if block[j] != item:
+            return False
+        del block[j]
+        if not block:
+            del self._blocks[i]
+            del self._maxes[i]
+        elif j == len(block):
+            self._maxes[i] = block[-1]
+        self._len -= 1
+        self._offsets = None
+        return True
+
+    def _block_offsets(self) -> List[int]:
+        if self._offsets is None:
+            offsets, total = [], 0
+            for block in self._blocks:
+                offsets.append(total)
+                total += len(block)
+            self._offsets = offsets
+        return self._offsets
+
+    def bisect_left(self, value: Any, key: Optional[Callable[[Any], Any]] = None) -> int:
+        """Позиция первого элемента не меньше value (с key - сравнивается key(элемент))"""
+        i = bisect_left(self._maxes, value, key=key)
+        if i == len(self._maxes):
+            return self._len
+        return self._block_offsets()[i] + bisect_left(self._blocks[i], value, key=key)
+
+    def bisect_right(self, value: Any, key: Optional[Callable[[Any], Any]] = None) -> int:
+        """Позиция первого элемента больше value (с key - сравнивается key(элемент))"""
+        i = bisect_right(self._maxes, value, key=key)
+        if i == len(self._maxes):
+            return self._len
+        return self._block_offsets()[i] + bisect_right(self._blocks[i], value, key=key)
+
+    def iter_range(self, start: int, stop: int, reverse: bool = False) -> Iterator[Any]:
+        """Лениво перебирает элементы с позициями [start, stop), при reverse - с конца"""
+        start, stop = max(start, 0), min(stop, self._len)
+        if start >= stop:
+            return
+        offsets = self._block_offsets()
+        remaining = stop - start
+        if not reverse:
+            i = bisect_right(offsets, start) - 1
+            j = start - offsets[i]
+            while remaining > 0:
+                chunk = self._blocks[i][j:j + remaining]
+                yield from chunk
+                remaining -= len(chunk)
+                i, j = i + 1, 0
+        else:
+            i = bisect_right(offsets, stop - 1) - 1
+            end = stop - offsets[i]
+            while remaining > 0:
+                chunk = self._blocks[i][max(end - remaining, 0):end]
+                yield from reversed(chunk)
+                remaining -= len(chunk)
+                i -= 1
+                end = len(self._blocks[i]) if i >= 0 else 0
+
+
+class PrefixIndex:
+    """Отсортированный массив нормализованных строк для автодополнения по префиксу"""
+
+    _WORD_START_RE = re.compile(r"\b\w")
+
+    def __init__(self) -> None:
+        self._entries = SortedList()
+        self._counts: Dict[Tuple[str, str], int] = {}
+
+    @classmethod
+    def _keys(cls, text: str) -> Set[Tuple[str, str]]:
+        """Строки индекса для текста: сам текст и его хвосты с начала каждого слова"""
+        normalized = TrigramIndex.normalize(text.strip())
+        return {(normalized[m.start():], text) for m in cls._WORD_START_RE.finditer(normalized)}
+
+    def add(self, text: str) -> None:
+        """Добавляет строку (повторные добавления учитываются счетчиком)"""
+        self.add_many((text,))
+
+    def add_many(self, texts: Iterable[str]) -> None:
+        """Добавляет пачку строк; новые строки индекса вставляются одной сортировкой"""
+        fresh = []
+        for text in texts:
+            for entry in self._keys(text):
+                count = self._counts.get(entry, 0)
+                if count == 0:
+                    fresh.append(entry)
+                self._counts[entry] = count + 1
+        self._entries.update(fresh)
+
+    def remove(self, text: str) -> None:
+        """Убирает одно вхождение строки"""
+        for entry in self._keys(text):
+            count = self._counts.get(entry, 0)
+            if count > 1:
+                self._counts[entry] = count - 1
+            elif count == 1:
+                del self._counts[entry]
+                self._entries.remove(entry)
+
+    def complete(self, prefix: str, limit: int = 10) -> List[str]:
+        """Возвращает до limit исходных строк, начинающихся с префикса (или содержащих слово с ним)"""
+        normalized = TrigramIndex.normalize(prefix.strip())
+        if not normalized or limit <= 0:
+            return []
+        results: Dict[str, None] = {}
+        for key, text in self._entries.iter_range(self._entries.bisect_left((normalized,)), len(self._entries)):
+            if not key.startswith(normalized):
+                break
+            results[text] = None
+            if len(results) >= limit:
+                break
+        return list(results)
+
+
+class ValueIndex:
+    """Индекс точных значений: значение -> множество ключей (ISBN)"""
+
+    def __init__(self) -> None:
+        self._postings: Dict[Any, Set[str]] = {}
+        self._key_values: Dict[str, Set[Any]] = {}
+
+    def add(self, key: str, values: Iterable[Any]) -> None:
+        """Индексирует значения под ключом"""
+        key_values = self._key_values.setdefault(key, set())
+        for value in values:
+            key_values.add(value)
+            self._postings.setdefault(value, set()).add(key)
+
+    def remove(self, key: str) -> None:
+        """Удаляет ключ из индекса"""
+        for value in self._key_values.pop(key, ()):
+            keys = self._postings.get(value)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                del self._postings[value]
+
+    def get(self, value: Any) -> Set[str]:
+        """Возвращает ключи с заданным значением"""
+        return self._postings.get(value, set())
+
+
+class SortedIndex:
+    """Упорядоченный индекс пар (значение, ключ) для запросов по диапазону"""
+
+    def __init__(self) -> None:
+        self._entries = SortedList()
+        self._key_values: Dict[str, Any] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, key: str, value: Any) -> None:
+        """Индексирует значение ключа (None не индексируется)"""
+        self.add_many(((key, value),))
+
+    def add_many(self, items: Iterable[Tuple[str, Any]]) -> None:
+        """Индексирует пачку пар (ключ, значение); новые пары вставляются одной сортировкой"""
+        fresh = []
+        for key, value in items:
+            self.remove(key)
+            if value is not None:
+                self._key_values[key] = value
+                fresh.append((value, key))
+        self._entries.update(fresh)
+
+    def remove(self, key: str) -> None:
+        """Удаляет ключ из индекса"""
+        if key in self._key_values:
+            self._entries.remove((self._key_values.pop(key), key))
+
+    def _bounds(self, start: Any = None, end: Any = None) -> Tuple[int, int]:
+        """Позиции начала и конца диапазона [start, end] в массиве"""
+        low = 0 if start is None else self._entries.bisect_left(start, key=itemgetter(0))
+        high = len(self._entries) if end is None else self._entries.bisect_right(end, key=itemgetter(0))
+        return low, high
+
+    def count(self, start: Any = None, end: Any = None) -> int:
+        """Количество ключей со значением в диапазоне [start, end]"""
+        low, high = self._bounds(start, end)
+        return max(high - low, 0)
+
+    def range(self, start: Any = None, end: Any = None, reverse: bool = False) -> Iterator[str]:
+        """Лениво перебирает ключи со значением в диапазоне [start, end] по порядку значений"""
+        low, high = self._bounds(start, end)
+        for _, key in self._entries.iter_range(low, high, reverse):
+            yield key
+
+
+class TimeIndex:
+    """
+    Упорядоченный по времени индекс пар (момент, ID) на SortedList: вставка и удаление
+    стоят O(log n + LOAD), подсчет элементов раньше момента - O(log n) между изменениями
+    (после изменения смещения блоков пересчитываются один раз за O(n / LOAD)).
+    """
+
+    def __init__(self) -> None:
+        self._keys = SortedList()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, moment: datetime, item_id: str) -> None:
+        """Добавляет элемент с сохранением порядка"""
+        self._keys.add((moment, item_id))
+
+    def remove(self, moment: datetime, item_id: str) -> None:
+        """Удаляет элемент, если он есть в индексе"""
+        self._keys.remove((moment, item_id))
+
+    def count_before(self, moment: datetime) -> int:
+        """Количество элементов строго раньше заданного момента"""
+        return self._keys.bisect_left((moment,))
+
+    def iter_before(self, moment: datetime) -> Iterator[str]:
+        """Перебирает ID элементов строго раньше заданного момента по возрастанию времени"""
+        for _, item_id in self._keys.iter_range(0, self.count_before(moment)):
+            yield item_id
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+MICROSECONDS_PER_DAY = 86400 * 10 ** 6
+
+
+def to_epoch_micros(moment: datetime) -> int:
+    """Переводит дату в целое число микросекунд от 1970-01-01"""
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+
+def from_epoch_micros(micros: int) -> datetime:
+    """Обратное преобразование для to_epoch_micros"""
+    return EPOCH + timedelta(microseconds=micros)
+
+
+@contextlib.contextmanager
+def _gc_paused() -> Iterator[None]:
+    """
+    Приостанавливает циклический сборщик мусора. Загрузка снимка и построение индексов
+    создают десятки тысяч объектов, которые переживут их, и сборщик без пользы
+    обходил бы эти объекты снова и снова.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class BorrowRecordStore:
+    """
+    Колоночная выгрузка записей о заимствовании для аналитики. Library не держит ее
+    постоянно: сами записи остаются объектами BorrowRecord, а столбцы строятся
+    по запросу (Library.loan_store) и живут, пока идет расчет.
+    Книги и пользователи хранятся как целые индексы в таблицах ISBN и ID,
+    даты - как микросекунды от начала эпохи в массивах int64 (array('q')), чтобы
+    сравнения совпадали с BorrowRecord.is_overdue до микросекунды.
+    Номер строки записи не меняется: удаление только снимает флаг live, а повторное
+    добавление той же записи (например, после изменения даты возврата) перезаписывает
+    ее строку на месте. materialize() собирает по строке отдельный объект BorrowRecord.
+    """
+
+    NO_RETURN = -(2 ** 63)
+
+    def __init__(self) -> None:
+        self.record_ids: List[str] = []
+        self.isbns: List[str] = []
+        self.user_ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._isbn_index: Dict[str, int] = {}
+        self._user_index: Dict[str, int] = {}
+
+        self.book_idx = array("q")
+        self.user_idx = array("q")
+        self.borrow_ts = array("q")
+        self.due_ts = array("q")
+        self.return_ts = array("q")
+        # 1 - строка действующей записи, 0 - запись удалена
+        self.live = array("b")
+        self._live_count = 0
+
+    def __len__(self) -> int:
+        return self._live_count
+
+    def __contains__(self, record_id: str) -> bool:
+        return self.row(record_id) is not None
+
+    @staticmethod
+    def _intern(value: str, values: List[str], index: Dict[str, int]) -> int:
+        """Возвращает индекс строки в таблице, добавляя ее при необходимости"""
+        position = index.get(value)
+        if position is None:
+            position = index[value] = len(values)
+            values.append(value)
+        return position
+
+    def append(self, record_id: str, isbn: str, user_id: str, borrow_date: datetime,
+               due_date: datetime, return_date: Optional[datetime] = None) -> int:
+        """Добавляет строку (или заново занимает строку удаленной записи с тем же ID) и возвращает ее номер"""
+        values = (self._intern(isbn, self.isbns, self._isbn_index),
+                  self._intern(user_id, self.user_ids, self._user_index),
+                  to_epoch_micros(borrow_date), to_epoch_micros(due_date),
+                  self.NO_RETURN if return_date is None else to_epoch_micros(return_date), 1)
+        columns = (self.book_idx, self.user_idx, self.borrow_ts, self.due_ts, self.return_ts, self.live)
+        row = self._rows.get(record_id)
+        if row is None:
+            row = self._rows[record_id] = len(self.record_ids)
+            self.record_ids.append(record_id)
+            for column, value in zip(columns, values):
+                column.append(value)
+        elif self.live[row]:
+            raise LibraryException(f"Запись с ID {record_id} уже существует")
+        else:
+            for column, value in zip(columns, values):
+                column[row] = value
+        self._live_count += 1
+        return row
+
+    @classmethod
+    def from_records(cls, records: Iterable[BorrowRecord]) -> "BorrowRecordStore":
+        """Строит хранилище по записям о заимствовании"""
+        store = cls()
+        for record in records:
+            store.add_record(record)
+        return store
+
+    def add_record(self, record: BorrowRecord) -> int:
+        """Добавляет строку по объекту BorrowRecord"""
+        return self.append(record.record_id, record.book.isbn, record.user.user_id,
+                           record.borrow_date, record.due_date, record.return_date)
+
+    def remove(self, record_id: str) -> None:
+        """Помечает строку записи удаленной; номера остальных строк не меняются"""
+        row = self.row(record_id)
+        if row is not None:
+            self.live[row] = 0
+            self._live_count -= 1
+
+    def row(self, record_id: str) -> Optional[int]:
+        """Номер строки действующей записи или None"""
+        row = self._rows.get(record_id)
+        return row if row is not None and self.live[row] else None
+
+    def materialize(self, row: int, books_dict: Dict[str, Book],
+                    users_dict: Dict[str, User]) -> BorrowRecord:
+        """Создает объект BorrowRecord по строке хранилища"""
+        return_ts = self.return_ts[row]
+        return BorrowRecord(
+            record_id=self.record_ids[row],
+            book=books_dict[self.isbns[self.book_idx[row]]],
+            user=users_dict[self.user_ids[self.user_idx[row]]],
+            borrow_date=from_epoch_micros(self.borrow_ts[row]),
+            due_date=from_epoch_micros(self.due_ts[row]),
+            return_date=None if return_ts == self.NO_RETURN else from_epoch_micros(return_ts)
+        )
+
+    def iter_records(self, books_dict: Dict[str, Book],
+                     users_dict: Dict[str, User]) -> Iterator[BorrowRecord]:
+        """Лениво создает объекты BorrowRecord для всех действующих строк"""
+        for row, live in enumerate(self.live):
+            if live:
+                yield self.materialize(row, books_dict, users_dict)
+
+    def overdue_rate(self, as_of: Optional[datetime] = None) -> float:
+        """Доля просроченных выдач: возвращенных позже срока или не возвращенных к as_of"""
+        if not self._live_count:
+            return 0.0
+        now = to_epoch_micros(as_of or datetime.now())
+        if np is not None:
+            live = np.frombuffer(self.live, dtype=np.int8).astype(bool)
+            returned = np.frombuffer(self.return_ts, dtype=np.int64)[live]
+            due = np.frombuffer(self.due_ts, dtype=np.int64)[live]
+            reference = np.where(returned == self.NO_RETURN, now, returned)
+            return float(np.count_nonzero(reference > due)) / self._live_count
+        overdue = 0
+        for due, returned, live in zip(self.due_ts, self.return_ts, self.live):
+            if live and (now if returned == self.NO_RETURN else returned) > due:
+                overdue += 1
+        return overdue / self._live_count
+
+    def mean_loan_days_by(self, group_of_isbn: Callable[[str], Optional[str]],
+                          as_of: Optional[datetime] = None) -> Dict[str, float]:
+        """
+        Средняя длительность выдачи в днях по группам книг (например, по жанрам).
+        Для невозвращенных книг длительность считается до момента as_of.
+        """
+        if not self._live_count:
+            return {}
+        now = to_epoch_micros(as_of or datetime.now())
+        group_names: List[str] = []
+        group_index: Dict[str, int] = {}
+        book_groups = []
+        for isbn in self.isbns:
+            group = group_of_isbn(isbn)
+            book_groups.append(-1 if group is None else self._intern(group, group_names, group_index))
+
+        if np is not None:
+            groups = np.asarray(book_groups, dtype=np.int64)[np.frombuffer(self.book_idx, dtype=np.int64)]
+            returned = np.frombuffer(self.return_ts, dtype=np.int64)
+            borrowed = np.frombuffer(self.borrow_ts, dtype=np.int64)
+            length = np.where(returned == self.NO_RETURN, now, returned) - borrowed
+            known = (groups >= 0) & np.frombuffer(self.live, dtype=np.int8).astype(bool)
+            totals = np.bincount(groups[known], weights=length[known], minlength=len(group_names))
+            counts = np.bincount(groups[known], minlength=len(group_names))
+            return {name: float(totals[i] / counts[i]) / MICROSECONDS_PER_DAY
+                    for i, name in enumerate(group_names) if counts[i]}
+
+        totals = [0] * len(group_names)
+        counts = [0] * len(group_names)
+        for book, borrowed, returned, live in zip(self.book_idx, self.borrow_ts, self.return_ts, self.live):
+            group = book_groups[book]
+            if group < 0 or not live:
+                continue
+            totals[group] += (now if returned == self.NO_RETURN else returned) - borrowed
+            counts[group] += 1
+        return {name: totals[i] / counts[i] / MICROSECONDS_PER_DAY
+                for i, name in enumerate(group_names) if counts[i]}
+
+
+class _LibraryIdentityMap(IdentityMap):
+    """IdentityMap, который ищет зарегистрированные сущности в текущих реестрах библиотеки, а не в их копии"""
+
+    def __init__(self, library: "Library") -> None:
+        super().__init__()
+        self._library = library
+
+    def author(self, author_id: str, name: str, birth_year: Optional[int] = None,
+               country: Optional[str] = None) -> Author:
+        author = self._library._authors.get((author_id or "").strip())
+        return author if author is not None else super().author(author_id, name, birth_year, country)
+
+    def genre(self, name: str, description: str = "") -> Genre:
+        genre = self._library._genres.get((name or "").strip())
+        return genre if genre is not None else super().genre(name, description)
+
+    def publisher(self, publisher_id: str, name: str, location: Optional[str] = None) -> Publisher:
+        publisher = self._library._publishers.get((publisher_id or "").strip())
+        return publisher if publisher is not None else super().publisher(publisher_id, name, location)
+
+    def book(self, isbn: str, factory: Callable[[], Book]) -> Book:
+        book = self._library._books.get((isbn or "").strip())
+        return book if book is not None else super().book(isbn, factory)
+
+
+class StorageEngine(abc.ABC):
+    """
+    Движок хранения разделов Library. Library берет у движка по коллекции на раздел
+    (отображение ключ -> сущность); сохраняющие движки хранят to_dict сущностей в JSON
+    и отдают их через StoredCollection.
+    """
+
+    PERSISTENT = True
+
+    def collection(self, section: str, decode: Callable[[Dict[str, Any]], Any]) -> MutableMapping:
+        """Коллекция раздела; decode собирает сущность из прочитанного словаря"""
+        return StoredCollection(self, section, decode)
+
+    @abc.abstractmethod
+    def get(self, section: str, key: str) -> Optional[Dict[str, Any]]:
+        """Словарь to_dict записи или None, если ее нет"""
+
+    @abc.abstractmethod
+    def put(self, section: str, key: str, data: Dict[str, Any]) -> None:
+        """Записывает словарь to_dict под ключом раздела"""
+
+    @abc.abstractmethod
+    def delete(self, section: str, key: str) -> bool:
+        """Удаляет запись; False, если ее не было"""
+
+    @abc.abstractmethod
+    def keys(self, section: str) -> List[str]:
+        """Ключи раздела в порядке обхода движка"""
+
+    @abc.abstractmethod
+    def count(self, section: str) -> int:
+        """Число записей раздела"""
+
+    def contains(self, section: str, key: str) -> bool:
+        return self.get(section, key) is not None
+
+    def items(self, section: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        for key in self.keys(section):
+            data = self.get(section, key)
+            if data is not None:
+                yield key, data
+
+    def is_empty(self) -> bool:
+        return not any(self.count(section) for section in Library.SECTIONS)
+
+    def flush(self) -> None:
+        """Фиксирует накопленные изменения"""
+
+    def close(self) -> None:
+        self.flush()
+
+
+class MemoryStorage(StorageEngine):
+    """Движок по умолчанию: обычные словари с живыми объектами, без сохранения между запусками"""
+
+    PERSISTENT = False
+
+    def __init__(self) -> None:
+        self._sections: Dict[str, Dict[str, Any]] = {}
+        self._decoders: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+
+    def collection(self, section: str, decode: Callable[[Dict[str, Any]], Any]) -> MutableMapping:
+        self._decoders[section] = decode
+        return self._sections.setdefault(section, {})
+
+    def get(self, section: str, key: str) -> Optional[Dict[str, Any]]:
+        entity = self._sections.get(section, {}).get(key)
+        return entity.to_dict() if entity is not None else None
+
+    def put(self, section: str, key: str, data: Dict[str, Any]) -> None:
+        if section not in self._decoders:
+            raise LibraryOperationError(f"Раздел {section} еще не открыт в MemoryStorage")
+        self._sections[section][key] = self._decoders[section](data)
+
+    def delete(self, section: str, key: str) -> bool:
+        return self._sections.get(section, {}).pop(key, None) is not None
+
+    def keys(self, section: str) -> List[str]:
+        return list(self._sections.get(section, {}))
+
+    def count(self, section: str) -> int:
+        return len(self._sections.get(section, {}))
+
+    def contains(self, section: str, key: str) -> bool:
+        return key in self._sections.get(section, {})
+
+
+class StoredCollection(MutableMapping):
+    """
+    Раздел библиотеки в сохраняющем движке. Прочитанные сущности кэшируются, чтобы
+    на каждый ключ приходился один объект, а запись сразу передается движку.
+    """
+
+    def __init__(self, engine: StorageEngine, section: str, decode: Callable[[Dict[str, Any]], Any]) -> None:
+        self._engine = engine
+        self._section = section
+        self._decode = decode
+        self._cache: Dict[str, Any] = {}
+        # Параллельные читатели не должны собрать два объекта для одного ключа
+        self._miss_lock = threading.RLock()
+
+    def __getitem__(self, key: str) -> Any:
+        entity = self._cache.get(key)
+        if entity is None:
+            with self._miss_lock:
+                entity = self._cache.get(key)
+                if entity is None:
+                    data = self._engine.get(self._section, key)
+                    if data is None:
+                        raise KeyError(key)
+                    entity = self._cache[key] = self._decode(data)
+        return entity
+
+    def __setitem__(self, key: str, entity: Any) -> None:
+        self._cache[key] = entity
+        self._engine.put(self._section, key, entity.to_dict())
+
+    def __delitem__(self, key: str) -> None:
+        self._cache.pop(key, None)
+        if not self._engine.delete(self._section, key):
+            raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._cache or self._engine.contains(self._section, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._engine.keys(self._section))
+
+    def __len__(self) -> int:
+        return self._engine.count(self._section)
+
+    def prime(self, entities: Dict[str, Any]) -> None:
+        """Кладет в кэш уже собранные объекты этого раздела"""
+        self._cache.update(entities)
+
+
+class DbmStorage(StorageEngine):
+    """
+    Хранение в stdlib dbm: по файлу на раздел в каталоге directory. Реализация dbm
+    выбирается модулем dbm (gnu, ndbm или dumb); порядок обхода ключей определяет она.
+    """
+
+    def __init__(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._databases: Dict[str, Any] = {}
+        # Реализации dbm не рассчитаны на одновременные обращения из нескольких потоков
+        self._lock = threading.RLock()
+
+    def _database(self, section: str) -> Any:
+        database = self._databases.get(section)
+        if database is None:
+            database = self._databases[section] = dbm.open(os.path.join(self.directory, section), "c")
+        return database
+
+    def get(self, section: str, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            raw = self._database(section).get(key.encode("utf-8"))
+        return json.loads(raw) if raw is not None else None
+
+    def put(self, section: str, key: str, data: Dict[str, Any]) -> None:
+        raw = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        with self._lock:
+            self._database(section)[key.encode("utf-8")] = raw
+
+    def delete(self, section: str, key: str) -> bool:
+        with self._lock:
+            try:
+                del self._database(section)[key.encode("utf-8")]
+            except KeyError:
+                return False
+        return True
+
+    def keys(self, section: str) -> List[str]:
+        with self._lock:
+            return [key.decode("utf-8") for key in self._database(section).keys()]
+
+    def count(self, section: str) -> int:
+        with self._lock:
+            return len(self._database(section))
+
+    def contains(self, section: str, key: str) -> bool:
+        with self._lock:
+            return key.encode("utf-8") in self._database(section)
+
+    def flush(self) -> None:
+        with self._lock:
+            for database in self._databases.values():
+                if hasattr(database, "sync"):
+                    database.sync()
+
+    def close(self) -> None:
+        with self._lock:
+            for database in self._databases.values():
+                database.close()
+            self._databases.clear()
+
+
+class SqliteStorage(StorageEngine):
+    """
+    Хранение в одной таблице SQLite (раздел, ключ, JSON). Ключи обходятся в порядке
+    добавления. Записи копятся в открытой транзакции до flush() или close().
+    """
+
+    def __init__(self, filename: str) -> None:
+        # Соединение общее для потоков библиотеки, обращения к нему идут по одному
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._lock = threading.RLock()
+        self._connection.execute("CREATE TABLE IF NOT EXISTS entities (section TEXT NOT NULL, key TEXT NOT NULL, "
+                                 "data TEXT NOT NULL, PRIMARY KEY (section, key))")
+
+    def get(self, section: str, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connection.execute("SELECT data FROM entities WHERE section = ? AND key = ?",
+                                           (section, key)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, section: str, key: str, data: Dict[str, Any]) -> None:
+        raw = json.dumps(data, ensure_ascii=False)
+        with self._lock:
+            # Обновление на месте сохраняет rowid, а с ним и порядок обхода
+            self._connection.execute("INSERT INTO entities VALUES (?, ?, ?) "
+                                     "ON CONFLICT (section, key) DO UPDATE SET data = excluded.data",
+                                     (section, key, raw))
+
+    def delete(self, section: str, key: str) -> bool:
+        with self._lock:
+            return self._connection.execute("DELETE FROM entities WHERE section = ? AND key = ?",
+                                            (section, key)).rowcount > 0
+
+    def keys(self, section: str) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._connection.execute(
+                "SELECT key FROM entities WHERE section = ? ORDER BY rowid", (section,))]
+
+    def items(self, section: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            rows = self._connection.execute("SELECT key, data FROM entities WHERE section = ? ORDER BY rowid",
+                                            (section,)).fetchall()
+        for key, data in rows:
+            yield key, json.loads(data)
+
+    def count(self, section: str) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT count(*) FROM entities WHERE section = ?",
+                                            (section,)).fetchone()[0]
+
+    def contains(self, section: str, key: str) -> bool:
+        with self._lock:
+            return self._connection.execute("SELECT 1 FROM entities WHERE section = ? AND key = ?",
+                                            (section, key)).fetchone() is not None
+
+    def flush(self) -> None:
+        with self._lock:
+            self._connection.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+
+class ReadWriteLock:
+    """
+    Блокировка "читатели-писатель": читать могут сколько угодно потоков сразу, писать - один
+    и только без читателей. Ждущий писатель не пропускает вперед новых читателей, поэтому
+    изменения не голодают при непрерывном чтении. Обе стороны реентерабельны в пределах
+    потока, чтение внутри своей записи разрешено, а повышение чтения до записи - нет:
+    два таких потока ждали бы друг друга бесконечно.
+    """
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition(threading.Lock())
+        self._readers: Dict[int, int] = {}
+        self._writer: Optional[int] = None
+        self._write_depth = 0
+        self._waiting_writers = 0
+
+    def acquire_read(self) -> None:
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me or me in self._readers:
+                # Повторное чтение не ждет писателей, иначе поток ждал бы сам себя
+                self._readers[me] = self._readers.get(me, 0) + 1
+                return
+            while self._writer is not None or self._waiting_writers:
+                self._condition.wait()
+            self._readers[me] = 1
+
+    def release_read(self) -> None:
+        me = threading.get_ident()
+        with self._condition:
+            depth = self._readers.get(me)
+            if not depth:
+                raise LibraryOperationError("Поток не держит блокировку на чтение")
+            if depth > 1:
+                self._readers[me] = depth - 1
+                return
+            del self._readers[me]
+            if not self._readers:
+                self._condition.notify_all()
+
+    def acquire_write(self) -> None:
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._write_depth += 1
+                return
+            if me in self._readers:
+                raise LibraryOperationError("Нельзя повысить блокировку на чтение до записи")
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = me
+            self._write_depth = 1
+
+    def release_write(self) -> None:
+        with self._condition:
+            if self._writer != threading.get_ident():
+                raise LibraryOperationError("Поток не держит блокировку на запись")
+            self._write_depth -= 1
+            if not self._write_depth:
+                self._writer = None
+                self._condition.notify_all()
+
+
+def _journaled(method: Callable) -> Callable:
+    """
+    Декоратор изменяющих методов Library. Если подключен журнал, операция верхнего уровня
+    выполняется с зафиксированным временем и после успешного выполнения записывается
+    в журнал вместе с этим временем - так повтор журнала дает тот же результат.
+    Вложенные вызовы (например, add_borrow_record внутри borrow_book) не журналируются.
+    Подтверждения fsync от журнала с durable=True операция ждет, уже отпустив блокировку журнала.
+    """
+    @functools.wraps(method)
+    def wrapper(self: "Library", *args: Any, **kwargs: Any) -> Any:
+        if self._journal is None:
+            return method(self, *args, **kwargs)
+        # Подмена часов и счетчик вложенности общие для библиотеки, поэтому журналируемые
+        # операции разных потоков выполняются по одной - в том же порядке попадают в журнал
+        with self._journal_lock:
+            if self._journal_depth:
+                return method(self, *args, **kwargs)
+            at = self._clock()
+            saved_clock = self._clock
+            self._clock = lambda: at
+            self._journal_depth += 1
+            try:
+                result = method(self, *args, **kwargs)
+            finally:
+                self._journal_depth -= 1
+                self._clock = saved_clock
+            wait = self._journal.record(method.__name__, at, args, kwargs)
+        if wait is not None:
+            wait()
+        return result
+    return wrapper
+
+
+def _synchronized(reads: Iterable[str] = (), writes: Iterable[str] = ()) -> Callable:
+    """
+    Помечает метод Library разделами, которые он читает (reads) и изменяет (writes).
+    Сам метод не меняется: обертки с блокировками ставит на экземпляр только
+    Library(..., thread_safe=True), поэтому однопоточная библиотека за них не платит.
+    """
+    def decorate(method: Callable) -> Callable:
+        method._lock_sections = (frozenset(reads), frozenset(writes))
+        return method
+    return decorate
+
+
+def _lock_plan(reads: Set[str], writes: Set[str], faulting: bool) -> List[Tuple[str, bool]]:
+    """
+    Блокировки разделов для метода: (раздел, на запись ли) в порядке Library.SECTIONS.
+    Единый порядок не дает операциям над несколькими разделами ждать друг друга вечно.
+    Пока подключен каталог (faulting), чтение книг и пользователей может их подгрузить,
+    и эти разделы берутся на запись.
+    """
+    exclusive = set(writes)
+    if faulting and (reads | writes) & {"books", "users"}:
+        exclusive |= {"books", "users"}
+    return [(section, section in exclusive) for section in Library.SECTIONS
+            if section in exclusive or section in reads]
+
+
+def _bind_locked(library: "Library", method: Callable) -> Callable:
+    """
+    Метод библиотеки, выполняемый под блокировками своих разделов: чтения разных потоков
+    идут параллельно, а изменение нескольких коллекций другие потоки видят только целиком.
+    """
+    reads, writes = method._lock_sections
+    plans = {faulting: _lock_plan(reads, writes, faulting) for faulting in (False, True)}
+    locks = library._locks
+
+    @functools.wraps(method)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        held: List[Tuple[ReadWriteLock, bool]] = []
+        try:
+            for section, exclusive in plans[library._catalog is not None]:
+                lock = locks[section]
+                if exclusive:
+                    lock.acquire_write()
+                else:
+                    lock.acquire_read()
+                held.append((lock, exclusive))
+            return method(library, *args, **kwargs)
+        finally:
+            for lock, exclusive in reversed(held):
+                if exclusive:
+                    lock.release_write()
+                else:
+                    lock.release_read()
+    return wrapper
+
+
 class Library:
     """Главный класс-менеджер библиотеки"""
 
-    def __init__(self, name: str) -> None:
+    FINE_PER_DAY = 10
+
+    # Разделы to_dict в порядке загрузки и разделы, на которые они ссылаются
+    SECTIONS = ("authors", "genres", "publishers", "books", "users",
+                "borrow_records", "fines", "reservations", "reviews")
+    SECTION_DEPENDENCIES = {
+        "users": ("books",),
+        "borrow_records": ("books", "users"),
+        "fines": ("users", "borrow_records"),
+        "reservations": ("users", "books"),
+        "reviews": ("users", "books"),
+    }
+    SECTION_ADDERS = {
+        "authors": "add_author",
+        "genres": "add_genre",
+        "publishers": "add_publisher",
+        "books": "add_book",
+        "users": "add_user",
+        "borrow_records": "add_borrow_record",
+        "fines": "add_fine",
+        "reservations": "add_reservation",
+        "reviews": "add_review",
+    }
+    ENTITY_SECTIONS = (
+        (Author, "authors"),
+        (Genre, "genres"),
+        (Publisher, "publishers"),
+        (Book, "books"),
+        (User, "users"),
+        (BorrowRecord, "borrow_records"),
+        (Fine, "fines"),
+        (Reservation, "reservations"),
+        (Review, "reviews"),
+    )
+    # Раздел -> поле to_dict (и свойство сущности), однозначно определяющее сущность
+    SECTION_KEYS = {
+        "authors": "author_id",
+        "genres": "name",
+        "publishers": "publisher_id",
+        "books": "isbn",
+        "users": "user_id",
+        "borrow_records": "record_id",
+        "fines": "fine_id",
+        "reservations": "reservation_id",
+        "reviews": "review_id",
+    }
+    SECTION_REMOVERS = {
+        "genres": "delete_genre",
+        "books": "delete_book",
+        "users": "delete_user",
+        "borrow_records": "delete_borrow_record",
+        "fines": "delete_fine",
+        "reservations": "delete_reservation",
+        "reviews": "delete_review",
+    }
+
+    def __init__(self, name: str, storage: Optional[StorageEngine] = None, thread_safe: bool = False) -> None:
+        """
+        storage: движок хранения разделов (по умолчанию MemoryStorage - обычные словари).
+        Если сохраняющий движок уже содержит данные, библиотека открывается на них.
+        thread_safe: методы библиотеки берут блокировки "читатели-писатель" по разделам,
+        так что чтения идут параллельно, а изменения атомарны. Ленивые переборы
+        (books_by_year, iter_overdue, query) выбирают результат сразу, под блокировкой.
+        Сеттеры сущностей, вызванные напрямую, блокировок не берут.
+        """
         if not name or not name.strip():
             raise InvalidLibraryNameError("Название библиотеки обязательно")
 
         self._name = name.strip()
-        self._books: Dict[str, Book] = {}
-        self._users: Dict[str, User] = {}
-        self._authors: Dict[str, Author] = {}
-        self._genres: Dict[str, Genre] = {}
-        self._publishers: Dict[str, Publisher] = {}
-        self._borrow_records: Dict[str, BorrowRecord] = {}
-        self._fines: Dict[str, Fine] = {}
-        self._reservations: Dict[str, Reservation] = {}
-        self._reviews: Dict[str, Review] = {}
+        # Блокировки разделов (None - однопоточный режим без накладных расходов)
+        self._locks: Optional[Dict[str, ReadWriteLock]] = (
+            {section: ReadWriteLock() for section in self.SECTIONS} if thread_safe else None)
+        # Ленивую индексацию и учет изменений делят потоки, держащие разные разделы
+        self._index_lock = threading.Lock()
+        self._dirty_lock = threading.Lock()
+        self._journal_lock = threading.RLock()
+        if thread_safe:
+            for attribute in dir(type(self)):
+                method = getattr(type(self), attribute, None)
+                if hasattr(method, "_lock_sections"):
+                    setattr(self, attribute, _bind_locked(self, method))
+        self._storage = storage or MemoryStorage()
+        # Общий реестр для сущностей, читаемых из движка хранения
+        self._storage_identity_map = self.identity_map()
+        self._books: Dict[str, Book] = self._storage.collection("books", self._decoder("books"))
+        self._users: Dict[str, User] = self._storage.collection("users", self._decoder("users"))
+        self._authors: Dict[str, Author] = self._storage.collection("authors", self._decoder("authors"))
+        self._genres: Dict[str, Genre] = self._storage.collection("genres", self._decoder("genres"))
+        self._publishers: Dict[str, Publisher] = self._storage.collection("publishers", self._decoder("publishers"))
+        self._borrow_records: Dict[str, BorrowRecord] = self._storage.collection(
+            "borrow_records", self._decoder("borrow_records"))
+        self._fines: Dict[str, Fine] = self._storage.collection("fines", self._decoder("fines"))
+        self._reservations: Dict[str, Reservation] = self._storage.collection(
+            "reservations", self._decoder("reservations"))
+        self._reviews: Dict[str, Review] = self._storage.collection("reviews", self._decoder("reviews"))
+
+        self._book_order: Dict[str, int] = {}
+        self._book_counter = 0
+        self._title_index = TokenIndex()
+        self._author_index = TokenIndex()
+        self._genre_index = TokenIndex()
+        self._fuzzy_index = TrigramIndex()
+        self._completions = PrefixIndex()
+        self._indexed_texts: Dict[str, List[str]] = {}
+        self._books_by_author = ValueIndex()
+        self._books_by_genre = ValueIndex()
+        self._books_by_publisher = ValueIndex()
+        self._year_index = SortedIndex()
+        self._pages_index = SortedIndex()
+        # Книги, еще не попавшие в поисковые индексы: индексы строятся при первом запросе,
+        # поэтому массовая загрузка не платит за них заранее
+        self._unindexed: Dict[str, Book] = {}
+
+        self._fines_by_user: Dict[str, Dict[str, Fine]] = {}
+        self._fines_by_record: Dict[str, Dict[str, Fine]] = {}
+        self._reviews_by_book: Dict[str, Dict[str, Review]] = {}
+        self._records_by_book: Dict[str, Dict[str, BorrowRecord]] = {}
+        self._records_by_user: Dict[str, Dict[str, BorrowRecord]] = {}
+        # Вхождения во вторичные индексы, снятые _untrack, до повторного _track или удаления
+        self._detached: Dict[int, List[Tuple[str, str, Any]]] = {}
+        # Книги, снятые с поисковых индексов на время переименования их автора или жанра
+        self._reindexing: Dict[int, List[Book]] = {}
+
+        # Счетчики и временные индексы для get_statistics
+        self._open_loans = TimeIndex()
+        self._late_returns = 0
+        self._unpaid_fines = 0
+        self._active_reservations = TimeIndex()
+
+        # Очереди ожидания по ISBN: активные резервирования в порядке поступления
+        self._waitlists: Dict[str, Dict[Reservation, Reservation]] = {}
+        self._open_loans_by_book: Dict[str, int] = {}
+
+        # Колоночная копия записей о заимствовании для аналитики
+
+        # Каталог на диске, из которого get_book/get_user подгружают недостающие записи,
+        # и удаленные ключи ("books"/"users", ключ), которые подгружать больше нельзя
+        self._catalog: Optional["MappedCatalog"] = None
+        self._catalog_deleted: Set[Tuple[str, str]] = set()
+
+        # Журнал изменений и источник текущего времени для операций (фиксируется при повторе)
+        self._journal: Optional["LibraryJournal"] = None
+        self._journal_depth = 0
+        self._clock: Callable[[], datetime] = datetime.now
+
+        # Изменения с последней контрольной точки: раздел -> ключ -> сущность (None - удалена)
+        self._dirty: Dict[str, Dict[str, Any]] = {}
+        self._loading = False
+
+        if self._storage.PERSISTENT and not self._storage.is_empty():
+            self._open_storage()
 
      
     @property
@@ -1304,6 +2725,14 @@ class Library:
             raise InvalidLibraryNameError("Название библиотеки обязательно")
         self._name = value.strip()
 
+    @property
+    def storage(self) -> StorageEngine:
+        return self._storage
+
+    @property
+    def thread_safe(self) -> bool:
+        return self._locks is not None
+
     @property
     def books(self) -> Dict[str, Book]:
         return self._books
@@ -1340,120 +2769,537 @@ class Library:
     def reviews(self) -> Dict[str, Review]:
         return self._reviews
 
+    @property
+    def loan_store(self) -> BorrowRecordStore:
+        """Колоночная выгрузка текущих записей о заимствовании, строится при каждом обращении"""
+        return BorrowRecordStore.from_records(self._borrow_records.values())
+
+    @_synchronized(writes=("books",))
+    @_journaled
     def add_book(self, book: Book) -> None:
         """Добавляет книгу в библиотеку"""
         if book.isbn in self._books:
             raise DuplicateItemError(f"Книга с ISBN {book.isbn} уже существует")
         self._books[book.isbn] = book
+        self._book_counter += 1
+        self._book_order[book.isbn] = self._book_counter
+        book._library = self
+        self._unindexed[book.isbn] = book
+        self._record_change("books", book.isbn, book)
 
+    @_synchronized(reads=("books",))
     def get_book(self, isbn: str) -> Optional[Book]:
-        """Возвращает книгу по ISBN"""
-        return self._books.get(isbn)
-
+        """Возвращает книгу по ISBN, при необходимости подгружая ее из подключенного каталога"""
+        book = self._books.get(isbn)
+        if book is None and self._catalog is not None and ("books", isbn) not in self._catalog_deleted:
+            book = self._catalog.get_book(isbn)
+            if book is not None:
+                # Подгрузка из каталога не изменяет библиотеку: ни журнала, ни учета изменений
+                self._restore("books", (book,))
+        return book
+
+    @_synchronized(writes=("books",))
+    @_journaled
     def update_book(self, isbn: str, new_book: Book) -> None:
         """Обновляет информацию о книге"""
-        if isbn not in self._books:
+        if self.get_book(isbn) is None:
             raise ItemNotFoundError(f"Книга с ISBN {isbn} не найдена")
+        self._unindex_book(isbn)
+        self._books[isbn]._library = None
         self._books[isbn] = new_book
+        new_book._library = self
+        self._index_book(isbn, new_book)
+        self._record_change("books", isbn, new_book)
 
+    @_synchronized(writes=("books",))
+    @_journaled
     def delete_book(self, isbn: str) -> None:
         """Удаляет книгу из библиотеки"""
-        if isbn not in self._books:
+        if self.get_book(isbn) is None:
             raise LibraryException(f"Книга с ISBN {isbn} не найдена")
-        del self._books[isbn]
-
+        if self._catalog is not None:
+            self._catalog_deleted.add(("books", isbn))
+        self._unindex_book(isbn)
+        self._books.pop(isbn)._library = None
+        del self._book_order[isbn]
+        self._record_change("books", isbn, None)
+
+    def _index_book(self, key: str, book: Book) -> None:
+        """Добавляет книгу в поисковые индексы"""
+        self._index_books(((key, book),))
+
+    def _index_books(self, items: Iterable[Tuple[str, Book]]) -> None:
+        """
+        Добавляет пачку книг в поисковые индексы. Упорядоченные индексы (автодополнение,
+        год, страницы) получают все новые строки разом и сортируют их один раз.
+        """
+        texts: List[str] = []
+        years: List[Tuple[str, Any]] = []
+        pages: List[Tuple[str, Any]] = []
+        for key, book in items:
+            author_names = [a.name for a in book.authors]
+            book_texts = self._indexed_texts[key] = [book.title] + author_names
+            texts.extend(book_texts)
+            self._title_index.add(key, [book.title])
+            self._author_index.add(key, author_names)
+            self._genre_index.add(key, [book.genre.name])
+            self._fuzzy_index.add(key, book_texts)
+            self._books_by_author.add(key, [a.author_id for a in book.authors])
+            self._books_by_genre.add(key, [book.genre.name])
+            self._books_by_publisher.add(key, [book.publisher.publisher_id])
+            years.append((key, book.year))
+            pages.append((key, book.pages))
+        self._completions.add_many(texts)
+        self._year_index.add_many(years)
+        self._pages_index.add_many(pages)
+
+    def _ensure_indexed(self) -> None:
+        """Добавляет в поисковые индексы книги, загруженные после последнего запроса"""
+        if self._unindexed:
+            # Параллельные читатели ждут, пока индексирует один; очередь очищается только
+            # после индексации, чтобы никто не искал по недостроенным индексам
+            with self._index_lock, _gc_paused():
+                if self._unindexed:
+                    self._index_books(self._unindexed.items())
+                    self._unindexed = {}
+
+    def _unindex_book(self, key: str) -> None:
+        """Удаляет книгу из поисковых индексов"""
+        if self._unindexed.pop(key, None) is not None:
+            return
+        for text in self._indexed_texts.pop(key, ()):
+            self._completions.remove(text)
+        self._title_index.remove(key)
+        self._author_index.remove(key)
+        self._genre_index.remove(key)
+        self._fuzzy_index.remove(key)
+        self._books_by_author.remove(key)
+        self._books_by_genre.remove(key)
+        self._books_by_publisher.remove(key)
+        self._year_index.remove(key)
+        self._pages_index.remove(key)
+
+    @_synchronized(writes=("users",))
+    @_journaled
     def add_user(self, user: User) -> None:
         """Добавляет пользователя"""
         if user.user_id in self._users:
             raise LibraryException(f"Пользователь с ID {user.user_id} уже существует")
         self._users[user.user_id] = user
+        user._library = self
+        self._record_change("users", user.user_id, user)
 
+    @_synchronized(reads=("users",))
     def get_user(self, user_id: str) -> Optional[User]:
-        """Возвращает пользователя по ID"""
-        return self._users.get(user_id)
+        """Возвращает пользователя по ID, при необходимости подгружая его из подключенного каталога"""
+        user = self._users.get(user_id)
+        if user is None and self._catalog is not None and ("users", user_id) not in self._catalog_deleted:
+            user = self._catalog.get_user(user_id, self.get_book)
+            if user is not None:
+                self._restore("users", (user,))
+        return user
 
+    @_synchronized(writes=("users",))
+    @_journaled
     def update_user(self, user_id: str, new_user: User) -> None:
         """Обновляет информацию о пользователе"""
-        if user_id not in self._users:
+        if self.get_user(user_id) is None:
             raise LibraryException(f"Пользователь с ID {user_id} не найден")
+        self._users[user_id]._library = None
         self._users[user_id] = new_user
+        new_user._library = self
+        self._record_change("users", user_id, new_user)
 
+    @_synchronized(writes=("users",))
+    @_journaled
     def delete_user(self, user_id: str) -> None:
         """Удаляет пользователя"""
-        if user_id not in self._users:
+        if self.get_user(user_id) is None:
             raise LibraryException(f"Пользователь с ID {user_id} не найден")
-        del self._users[user_id]
+        if self._catalog is not None:
+            self._catalog_deleted.add(("users", user_id))
+        self._users.pop(user_id)._library = None
+        self._record_change("users", user_id, None)
 
+    @_synchronized(writes=("books", "users"))
+    def attach_catalog(self, catalog: "MappedCatalog") -> None:
+        """
+        Подключает каталог на диске: книги и пользователи, которых нет в памяти,
+        подгружаются по одному при обращении через get_book/get_user.
+        """
+        self._catalog = catalog
+        self._catalog_deleted.clear()
+
+    @_synchronized(writes=("authors",))
+    @_journaled
     def add_author(self, author: Author) -> None:
         """Добавляет автора"""
         if author.author_id in self._authors:
             raise LibraryException(f"Автор с ID {author.author_id} уже существует")
         self._authors[author.author_id] = author
+        author._library = self
+        self._record_change("authors", author.author_id, author)
 
+    @_synchronized(reads=("authors",))
     def get_author(self, author_id: str) -> Optional[Author]:
         """Возвращает автора по ID"""
         return self._authors.get(author_id)
 
+    @_synchronized(writes=("genres",))
+    @_journaled
     def add_genre(self, genre: Genre) -> None:
         """Добавляет жанр"""
         if genre.name in self._genres:
             raise LibraryException(f"Жанр с названием {genre.name} уже существует")
         self._genres[genre.name] = genre
+        genre._library = self
+        self._record_change("genres", genre.name, genre)
 
+    @_synchronized(reads=("genres",))
     def get_genre(self, genre_name: str) -> Optional[Genre]:
         """Возвращает жанр по названию"""
         return self._genres.get(genre_name)
 
+    @_synchronized(writes=("genres", "books"))
+    @_journaled
+    def rename_genre(self, genre_name: str, new_name: str) -> None:
+        """
+        Переименовывает жанр: реестр жанров переходит на новое название, книги жанра
+        переиндексируются и вместе с жанром попадают в учет изменений
+        """
+        genre = self._genres.get(genre_name)
+        if genre is None:
+            raise LibraryException(f"Жанр с названием {genre_name} не найден")
+        if not new_name or not new_name.strip():
+            raise InvalidGenreNameError("Название жанра не может быть пустым")
+        new_name = new_name.strip()
+        if new_name == genre_name:
+            return
+        if new_name in self._genres:
+            raise LibraryException(f"Жанр с названием {new_name} уже существует")
+        self._ensure_indexed()
+        books = self._dependent_books(genre)
+        self._untrack(genre)
+        try:
+            genre._name = new_name
+        finally:
+            self._track(genre)
+        del self._genres[genre_name]
+        self._genres[new_name] = genre
+        self._record_change("genres", genre_name, None)
+        self._record_change("genres", new_name, genre)
+        for book in books:
+            self._mark_dirty(book)
+
+    @_synchronized(writes=("genres",), reads=("books",))
+    @_journaled
+    def delete_genre(self, genre_name: str) -> None:
+        """Удаляет жанр; жанр, к которому относятся книги, удалить нельзя"""
+        genre = self._genres.get(genre_name)
+        if genre is None:
+            raise LibraryException(f"Жанр с названием {genre_name} не найден")
+        self._ensure_indexed()
+        if self._books_by_genre.get(genre_name):
+            raise GenreError(f"Жанр {genre_name} нельзя удалить: к нему относятся книги")
+        del self._genres[genre_name]
+        genre._library = None
+        self._record_change("genres", genre_name, None)
+
+    @_synchronized(writes=("publishers",))
+    @_journaled
     def add_publisher(self, publisher: Publisher) -> None:
         """Добавляет издателя"""
         if publisher.publisher_id in self._publishers:
             raise LibraryException(f"Издатель с ID {publisher.publisher_id} уже существует")
         self._publishers[publisher.publisher_id] = publisher
+        publisher._library = self
+        self._record_change("publishers", publisher.publisher_id, publisher)
 
+    @_synchronized(reads=("publishers",))
     def get_publisher(self, publisher_id: str) -> Optional[Publisher]:
         """Возвращает издателя по ID"""
         return self._publishers.get(publisher_id)
 
+    @_synchronized(writes=("borrow_records",))
+    @_journaled
     def add_borrow_record(self, record: BorrowRecord) -> None:
         """Добавляет запись о заимствовании"""
         if record.record_id in self._borrow_records:
             raise LibraryException(f"Запись с ID {record.record_id} уже существует")
         self._borrow_records[record.record_id] = record
+        record._library = self
+        self._track(record)
+        self._record_change("borrow_records", record.record_id, record)
 
+    @_synchronized(reads=("borrow_records",))
     def get_borrow_record(self, record_id: str) -> Optional[BorrowRecord]:
         """Возвращает запись о заимствовании по ID"""
         return self._borrow_records.get(record_id)
 
+    @_synchronized(writes=("borrow_records",))
+    @_journaled
+    def delete_borrow_record(self, record_id: str) -> None:
+        """Удаляет запись о заимствовании"""
+        record = self._borrow_records.pop(record_id, None)
+        if record is None:
+            raise LibraryException(f"Запись с ID {record_id} не найдена")
+        self._untrack(record)
+        self._unlink(record)
+        record._library = None
+        self._record_change("borrow_records", record_id, None)
+
+    @_synchronized(writes=("fines",))
+    @_journaled
     def add_fine(self, fine: Fine) -> None:
         """Добавляет штраф"""
         if fine.fine_id in self._fines:
             raise LibraryException(f"Штраф с ID {fine.fine_id} уже существует")
         self._fines[fine.fine_id] = fine
+        fine._library = self
+        self._track(fine)
+        self._record_change("fines", fine.fine_id, fine)
 
+    @_synchronized(reads=("fines",))
     def get_fine(self, fine_id: str) -> Optional[Fine]:
         """Возвращает штраф по ID"""
         return self._fines.get(fine_id)
 
+    @_synchronized(writes=("fines",))
+    @_journaled
+    def delete_fine(self, fine_id: str) -> None:
+        """Удаляет штраф"""
+        fine = self._fines.pop(fine_id, None)
+        if fine is None:
+            raise LibraryException(f"Штраф с ID {fine_id} не найден")
+        self._untrack(fine)
+        self._unlink(fine)
+        fine._library = None
+        self._record_change("fines", fine_id, None)
+
+    @_synchronized(writes=("reservations",))
+    @_journaled
     def add_reservation(self, reservation: Reservation) -> None:
         """Добавляет резервирование"""
         if reservation.reservation_id in self._reservations:
             raise LibraryException(f"Резервирование с ID {reservation.reservation_id} уже существует")
         self._reservations[reservation.reservation_id] = reservation
+        reservation._library = self
+        self._track(reservation)
+        self._record_change("reservations", reservation.reservation_id, reservation)
 
+    @_synchronized(reads=("reservations",))
     def get_reservation(self, reservation_id: str) -> Optional[Reservation]:
         """Возвращает резервирование по ID"""
         return self._reservations.get(reservation_id)
 
+    @_synchronized(writes=("reservations",))
+    @_journaled
+    def delete_reservation(self, reservation_id: str) -> None:
+        """Удаляет резервирование"""
+        reservation = self._reservations.pop(reservation_id, None)
+        if reservation is None:
+            raise LibraryException(f"Резервирование с ID {reservation_id} не найдено")
+        self._untrack(reservation)
+        self._unlink(reservation)
+        reservation._library = None
+        self._record_change("reservations", reservation_id, None)
+
+    @_synchronized(writes=("reservations",))
+    def get_waitlist(self, isbn: str) -> List[Reservation]:
+        """Возвращает активные резервирования книги в порядке очереди"""
+        self.expire_reservations()
+        return list(self._waitlists.get(isbn, {}))
+
+    @_synchronized(writes=("reservations",))
+    def next_reservation(self, isbn: str) -> Optional[Reservation]:
+        """
+        Возвращает первое в очереди действующее резервирование книги. Снятые по пути
+        истекшие резервирования попадают в журнал как изменения сущностей.
+        """
+        waitlist = self._waitlists.get(isbn)
+        now = self._clock()
+        while waitlist:
+            reservation = next(iter(waitlist))
+            if reservation.expiry_date >= now:
+                return reservation
+            reservation.active = False
+            waitlist = self._waitlists.get(isbn)
+        return None
+
+    @_synchronized(writes=("reservations",))
+    def expire_reservations(self, as_of: Optional[datetime] = None) -> List[Reservation]:
+        """Деактивирует все резервирования, истекшие к моменту as_of"""
+        as_of = as_of or self._clock()
+        if not self._active_reservations.count_before(as_of):
+            # Истекших нет: вызов ничего не меняет и в журнал не пишется
+            return []
+        return self._expire_reservations(as_of)
+
+    @_journaled
+    def _expire_reservations(self, as_of: datetime) -> List[Reservation]:
+        """Журналируемая часть expire_reservations: деактивирует истекшие резервирования"""
+        expired = [self._reservations[r_id] for r_id in self._active_reservations.iter_before(as_of)]
+        for reservation in expired:
+            reservation.active = False
+        return expired
+
+    @_synchronized(writes=("reservations",))
+    @_journaled
+    def cancel_reservation(self, reservation_id: str) -> None:
+        """Отменяет резервирование"""
+        reservation = self.get_reservation(reservation_id)
+        if not reservation:
+            raise LibraryException(f"Резервирование с ID {reservation_id} не найдено")
+        reservation.cancel_reservation()
+
+    @_synchronized(writes=("reviews",))
+    @_journaled
     def add_review(self, review: Review) -> None:
         """Добавляет отзыв"""
         if review.review_id in self._reviews:
             raise LibraryException(f"Отзыв с ID {review.review_id} уже существует")
         self._reviews[review.review_id] = review
+        review._library = self
+        self._track(review)
+        self._record_change("reviews", review.review_id, review)
 
+    @_synchronized(reads=("reviews",))
     def get_review(self, review_id: str) -> Optional[Review]:
         """Возвращает отзыв по ID"""
         return self._reviews.get(review_id)
 
+    @_synchronized(writes=("reviews",))
+    @_journaled
+    def delete_review(self, review_id: str) -> None:
+        """Удаляет отзыв"""
+        review = self._reviews.pop(review_id, None)
+        if review is None:
+            raise LibraryException(f"Отзыв с ID {review_id} не найден")
+        self._untrack(review)
+        self._unlink(review)
+        review._library = None
+        self._record_change("reviews", review_id, None)
+
+    @staticmethod
+    def _references(entity: TrackedEntity) -> List[Tuple[str, str, Any]]:
+        """
+        Вхождения сущности во вторичные индексы по ссылкам: (индекс, ключ, ID сущности).
+        Активное резервирование стоит в очереди своей книги под самим собой.
+        """
+        if isinstance(entity, BorrowRecord):
+            return [("_records_by_book", entity.book.isbn, entity.record_id),
+                    ("_records_by_user", entity.user.user_id, entity.record_id)]
+        if isinstance(entity, Fine):
+            return [("_fines_by_user", entity.user.user_id, entity.fine_id),
+                    ("_fines_by_record", entity.borrow_record.record_id, entity.fine_id)]
+        if isinstance(entity, Review):
+            return [("_reviews_by_book", entity.book.isbn, entity.review_id)]
+        if isinstance(entity, Reservation) and entity.active:
+            return [("_waitlists", entity.book.isbn, entity)]
+        return []
+
+    def _dependent_books(self, entity: Union[Author, Genre]) -> List[Book]:
+        """Проиндексированные книги автора или жанра"""
+        if isinstance(entity, Author):
+            keys = self._books_by_author.get(entity.author_id)
+        else:
+            keys = self._books_by_genre.get(entity.name)
+        return [self._books[isbn] for isbn in keys]
+
+    def _link(self, entity: TrackedEntity) -> None:
+        """
+        Ставит сущность во вторичные индексы по ее текущим ссылкам. Вхождения, снятые _untrack
+        и не изменившиеся, остаются на своих местах - порядок элементов в индексах сохраняется.
+        """
+        references = self._references(entity)
+        for reference in self._detached.pop(id(entity), ()):
+            if reference not in references:
+                self._remove_from_index(getattr(self, reference[0]), reference[1], reference[2])
+        for index, key, item_id in references:
+            getattr(self, index).setdefault(key, {})[item_id] = entity
+
+    def _unlink(self, entity: TrackedEntity) -> None:
+        """Убирает удаляемую сущность из вторичных индексов по ссылкам"""
+        for index, key, item_id in self._detached.pop(id(entity), None) or self._references(entity):
+            self._remove_from_index(getattr(self, index), key, item_id)
+
+    def _track(self, entity: TrackedEntity) -> None:
+        """Учитывает текущее состояние сущности в счетчиках и индексах"""
+        self._link(entity)
+        for book in self._reindexing.pop(id(entity), ()):
+            self._track(book)
+        if isinstance(entity, Book):
+            if self._books.get(entity.isbn) is entity and entity.isbn not in self._unindexed:
+                self._index_book(entity.isbn, entity)
+        elif isinstance(entity, BorrowRecord):
+            if entity.return_date is None:
+                self._open_loans.add(entity.due_date, entity.record_id)
+                isbn = entity.book.isbn
+                self._open_loans_by_book[isbn] = self._open_loans_by_book.get(isbn, 0) + 1
+            elif entity.return_date > entity.due_date:
+                self._late_returns += 1
+        elif isinstance(entity, Fine):
+            if not entity.paid:
+                self._unpaid_fines += 1
+        elif isinstance(entity, Reservation):
+            if entity.active:
+                self._active_reservations.add(entity.expiry_date, entity.reservation_id)
+
+    def _untrack(self, entity: TrackedEntity) -> None:
+        """
+        Снимает вклад сущности из счетчиков и индексов. Вхождения во вторичные индексы
+        по ссылкам запоминаются и исправляются следующим _track (или _unlink при удалении).
+        """
+        references = self._references(entity)
+        if references:
+            self._detached[id(entity)] = references
+        if isinstance(entity, (Author, Genre)):
+            # Имена авторов и жанров скопированы в поисковые индексы книг: книги снимаются
+            # с индексов и возвращаются в них следующим _track, уже с новым именем
+            books = self._dependent_books(entity)
+            self._reindexing[id(entity)] = books
+            for book in books:
+                self._untrack(book)
+        if isinstance(entity, Book):
+            if self._books.get(entity.isbn) is entity:
+                self._unindex_book(entity.isbn)
+        elif isinstance(entity, BorrowRecord):
+            if entity.return_date is None:
+                self._open_loans.remove(entity.due_date, entity.record_id)
+                isbn = entity.book.isbn
+                if self._open_loans_by_book.get(isbn, 0) > 1:
+                    self._open_loans_by_book[isbn] -= 1
+                else:
+                    self._open_loans_by_book.pop(isbn, None)
+            elif entity.return_date > entity.due_date:
+                self._late_returns -= 1
+        elif isinstance(entity, Fine):
+            if not entity.paid:
+                self._unpaid_fines -= 1
+        elif isinstance(entity, Reservation):
+            if entity.active:
+                self._active_reservations.remove(entity.expiry_date, entity.reservation_id)
+
+    @staticmethod
+    def _remove_from_index(index: Dict[str, Dict[str, Any]], key: str, item_id: str) -> None:
+        """Удаляет элемент из вторичного индекса"""
+        items = index.get(key)
+        if items is None:
+            return
+        items.pop(item_id, None)
+        if not items:
+            del index[key]
+
+    @staticmethod
+    def _next_id(prefix: str, items: Dict[str, Any]) -> str:
+        """Генерирует свободный ID вида prefix_N"""
+        number = len(items) + 1
+        while f"{prefix}_{number}" in items:
+            number += 1
+        return f"{prefix}_{number}"
+
+    @_synchronized(reads=("books",), writes=("users", "borrow_records"))
+    @_journaled
     def borrow_book(self, user_id: str, isbn: str, due_date: datetime) -> BorrowRecord:
         """Выдает книгу пользователю"""
         user = self.get_user(user_id)
@@ -1464,35 +3310,106 @@ class Library:
         if not book:
             raise LibraryException(f"Книга с ISBN {isbn} не найдена")
 
-        record_id = f"br_{len(self._borrow_records) + 1}"
-        record = BorrowRecord(record_id, book, user, datetime.now(), due_date)
+        record_id = self._next_id("br", self._borrow_records)
+        record = BorrowRecord(record_id, book, user, self._clock(), due_date)
 
         self.add_borrow_record(record)
         user.borrow_book(book)
 
         return record
 
+    @_synchronized(writes=("users", "borrow_records", "fines"))
+    @_journaled
     def return_book(self, record_id: str) -> None:
         """Возвращает книгу в библиотеку"""
         record = self.get_borrow_record(record_id)
         if not record:
             raise LibraryException(f"Запись с ID {record_id} не найдена")
 
-        record.return_date = datetime.now()
+        record.return_date = self._clock()
         record.user.return_book(record.book)
 
         if record.is_overdue():
-            fine_id = f"fine_{len(self._fines) + 1}"
-            days_overdue = record.get_days_overdue()
-            amount = days_overdue * 10
-            fine = Fine(fine_id, record.user, record, amount, f"Просрочка возврата на {days_overdue} дней")
-            self.add_fine(fine)
+            self._charge_overdue_fine(record, record.return_date)
+
+    @_synchronized(reads=("borrow_records",))
+    def iter_overdue(self, as_of: Optional[datetime] = None) -> Iterator[BorrowRecord]:
+        """
+        Перебирает невозвращенные книги, просроченные на момент as_of, по возрастанию срока.
+        Потокобезопасная библиотека выбирает их сразу, под блокировкой (как _books_in_range).
+        """
+        as_of = as_of or self._clock()
+        records = (self._borrow_records[record_id] for record_id in self._open_loans.iter_before(as_of))
+        return iter(list(records)) if self._locks is not None else records
+
+    @_synchronized(writes=("fines",))
+    @_journaled
+    def pay_fine(self, fine_id: str) -> None:
+        """Отмечает штраф оплаченным"""
+        fine = self.get_fine(fine_id)
+        if not fine:
+            raise LibraryException(f"Штраф с ID {fine_id} не найден")
+        fine.pay_fine()
+
+    @_synchronized(reads=("borrow_records",), writes=("fines",))
+    @_journaled
+    def assess_overdue_fines(self, as_of: Optional[datetime] = None) -> List[Fine]:
+        """Начисляет или обновляет штрафы по всем просроченным на момент as_of выдачам"""
+        as_of = as_of or self._clock()
+        fines = []
+        for record in list(self.iter_overdue(as_of)):
+            fine = self._charge_overdue_fine(record, as_of)
+            if fine is not None:
+                fines.append(fine)
+        return fines
 
+    def _charge_overdue_fine(self, record: BorrowRecord, as_of: datetime) -> Optional[Fine]:
+        """
+        Доводит штраф за просрочку по записи до суммы на момент as_of.
+        Уже оплаченные штрафы по записи вычитаются, неоплаченный обновляется, а не дублируется.
+        """
+        days_overdue = (as_of - record.due_date).days
+        record_fines = self._fines_by_record.get(record.record_id, {}).values()
+        unpaid = next((f for f in record_fines if not f.paid), None)
+        amount = days_overdue * self.FINE_PER_DAY - sum(f.amount for f in record_fines if f.paid)
+        if amount <= 0:
+            return unpaid
+
+        reason = f"Просрочка возврата на {days_overdue} дней"
+        if unpaid is not None:
+            unpaid.amount = amount
+            unpaid.reason = reason
+            return unpaid
+
+        fine = Fine(self._next_id("fine", self._fines), record.user, record, amount, reason)
+        self.add_fine(fine)
+        return fine
+
+    @_synchronized(reads=("books",))
     def search_books(self, title: str = "", author: str = "", genre: str = "") -> List[Book]:
         """Поиск книг по различным критериям"""
+        self._ensure_indexed()
+        candidates: Optional[Set[str]] = None
+        for index, fragment in ((self._title_index, title),
+                                (self._author_index, author),
+                                (self._genre_index, genre)):
+            if not fragment:
+                continue
+            keys = index.lookup(fragment)
+            if keys is None:
+                continue
+            candidates = keys if candidates is None else candidates & keys
+            if not candidates:
+                return []
+
+        if candidates is None:
+            books = self._books.values()
+        else:
+            books = [self._books[isbn] for isbn in sorted(candidates, key=self._book_order.__getitem__)]
+
+        # Индекс дает надмножество кандидатов, точное совпадение подстрок проверяется здесь
         results = []
-
-        for book in self._books.values():
+        for book in books:
             matches_title = not title or title.lower() in book.title.lower()
             matches_author = not author or any(author.lower() in a.name.lower() for a in book.authors)
             matches_genre = not genre or genre.lower() in book.genre.name.lower()
@@ -1502,14 +3419,78 @@ class Library:
 
         return results
 
+    def books_by_year(self, start: Optional[int] = None, end: Optional[int] = None,
+                      reverse: bool = False) -> Iterator[Book]:
+        """Лениво перебирает книги, изданные в [start, end], по возрастанию года"""
+        return self._books_in_range(self._year_index, start, end, reverse)
+
+    def books_by_pages(self, start: Optional[int] = None, end: Optional[int] = None,
+                       reverse: bool = False) -> Iterator[Book]:
+        """Лениво перебирает книги с количеством страниц в [start, end] по возрастанию объема"""
+        return self._books_in_range(self._pages_index, start, end, reverse)
+
+    @_synchronized(reads=("books",))
+    def _books_in_range(self, index: SortedIndex, start: Any, end: Any, reverse: bool) -> Iterator[Book]:
+        """
+        Книги из диапазона упорядоченного индекса. Генератор не может держать блокировку
+        между шагами, поэтому потокобезопасная библиотека выбирает их сразу, под блокировкой.
+        """
+        self._ensure_indexed()
+        books = (self._books[isbn] for isbn in index.range(start, end, reverse))
+        return iter(list(books)) if self._locks is not None else books
+
+    def identity_map(self) -> IdentityMap:
+        """Реестр для загрузчиков, выдающий уже зарегистрированных авторов, жанры и издателей"""
+        return _LibraryIdentityMap(self)
+
+    def query(self) -> "BookQuery":
+        """Создает составной запрос к каталогу книг"""
+        return BookQuery(self)
+
+    @_synchronized(reads=("books", "borrow_records", "reviews"))
+    def _run_query(self, query: "BookQuery") -> List[Book]:
+        """Результат запроса целиком: индексы и условия запроса читают книги, выдачи и отзывы"""
+        return list(query._execute())
+
+    @_synchronized(reads=("books",))
+    def autocomplete(self, prefix: str, limit: int = 10) -> List[str]:
+        """Подсказки названий книг и имен авторов по началу строки или слова"""
+        self._ensure_indexed()
+        return self._completions.complete(prefix, limit)
+
+    @_synchronized(reads=("books",))
+    def fuzzy_search_books(self, query: str, limit: int = 10,
+                           threshold: float = 0.3) -> List[Tuple[Book, float]]:
+        """Нечеткий поиск по названию и авторам: до limit книг, упорядоченных по сходству"""
+        if limit <= 0:
+            return []
+        self._ensure_indexed()
+        scores = self._fuzzy_index.scores(query, threshold)
+        best = heapq.nsmallest(limit, scores.items(),
+                               key=lambda item: (-item[1], self._book_order[item[0]]))
+        return [(self._books[isbn], score) for isbn, score in best]
+
+    @_synchronized(reads=("fines",))
     def get_user_fines(self, user_id: str) -> List[Fine]:
         """Возвращает все штрафы пользователя"""
-        return [fine for fine in self._fines.values() if fine.user.user_id == user_id and not fine.paid]
+        return [fine for fine in self._fines_by_user.get(user_id, {}).values() if not fine.paid]
 
+    @_synchronized(reads=("reviews",))
     def get_book_reviews(self, isbn: str) -> List[Review]:
         """Возвращает все отзывы на книгу"""
-        return [review for review in self._reviews.values() if review.book.isbn == isbn]
+        return list(self._reviews_by_book.get(isbn, {}).values())
 
+    @_synchronized(reads=("borrow_records",))
+    def get_book_borrow_records(self, isbn: str) -> List[BorrowRecord]:
+        """Возвращает все записи о заимствовании книги"""
+        return list(self._records_by_book.get(isbn, {}).values())
+
+    @_synchronized(reads=("borrow_records",))
+    def get_user_borrow_records(self, user_id: str) -> List[BorrowRecord]:
+        """Возвращает все записи о заимствовании пользователя"""
+        return list(self._records_by_user.get(user_id, {}).values())
+
+    @_synchronized(reads=("reviews",))
     def get_average_book_rating(self, isbn: str) -> Optional[float]:
         """Возвращает средний рейтинг книги"""
         reviews = self.get_book_reviews(isbn)
@@ -1517,20 +3498,44 @@ class Library:
             return None
         return sum(review.rating for review in reviews) / len(reviews)
 
+    @_synchronized(reads=("borrow_records",))
+    def get_overdue_rate(self, as_of: Optional[datetime] = None) -> float:
+        """Доля просроченных выдач за всю историю"""
+        return self.loan_store.overdue_rate(as_of)
+
+    @_synchronized(reads=("books", "borrow_records"))
+    def get_mean_loan_days_by_genre(self, as_of: Optional[datetime] = None) -> Dict[str, float]:
+        """Средняя длительность выдачи в днях по жанрам"""
+        def genre_of(isbn: str) -> Optional[str]:
+            book = self._books.get(isbn)
+            return book.genre.name if book else None
+
+        return self.loan_store.mean_loan_days_by(genre_of, as_of)
+
+    @_synchronized(reads=("books", "borrow_records", "fines", "reviews"))
+    def analytics(self, as_of: Optional[datetime] = None) -> "LibraryAnalytics":
+        """Выгружает данные в массивы NumPy для векторных отчетов"""
+        # Модуль аналитики сам импортирует main, поэтому подключается только здесь
+        from analytics import LibraryAnalytics
+        return LibraryAnalytics(self, as_of)
+
+    @_synchronized(reads=SECTIONS)
     def get_statistics(self) -> Dict[str, Any]:
         """Возвращает статистику библиотеки"""
+        now = self._clock()
         return {
             "total_books": len(self._books),
             "total_users": len(self._users),
             "total_authors": len(self._authors),
-            "active_borrows": len([r for r in self._borrow_records.values() if not r.is_returned()]),
-            "overdue_books": len([r for r in self._borrow_records.values() if r.is_overdue()]),
-            "active_reservations": len([r for r in self._reservations.values() if r.is_active()]),
-            "unpaid_fines": len([f for f in self._fines.values() if not f.paid]),
+            "active_borrows": len(self._open_loans),
+            "overdue_books": self._late_returns + self._open_loans.count_before(now),
+            "active_reservations": len(self._active_reservations) - self._active_reservations.count_before(now),
+            "unpaid_fines": self._unpaid_fines,
             "total_reviews": len(self._reviews)
         }
 
      
+    @_synchronized(reads=SECTIONS)
     def to_dict(self) -> Dict[str, Any]:
         """Сохраняет всю библиотеку в словарь"""
         return {
@@ -1547,57 +3552,249 @@ class Library:
         }
 
     @classmethod
-    def from_dict(cls, data: Dict[str, Any]) -> 'Library':
+    def from_dict(cls, data: Dict[str, Any], thread_safe: bool = False) -> 'Library':
         """Загружает всю библиотеку из словаря"""
-        library = cls(data["name"])
-
-        for author_data in data.get("authors", []):
-            author = Author.from_dict(author_data)
-            library.add_author(author)
-
-        for genre_data in data.get("genres", []):
-            genre = Genre.from_dict(genre_data)
-            library.add_genre(genre)
-
-        for publisher_data in data.get("publishers", []):
-            publisher = Publisher.from_dict(publisher_data)
-            library.add_publisher(publisher)
-
-        authors_dict = {a.author_id: a for a in library._authors.values()}
-        genres_dict = {g.name: g for g in library._genres.values()}
-        publishers_dict = {p.publisher_id: p for p in library._publishers.values()}
-
-        for book_data in data.get("books", []):
-            book = Book.from_dict(book_data)
-            library.add_book(book)
+        library = cls(data["name"], thread_safe=thread_safe)
+        identity_map = library.identity_map()
 
-        books_dict = {b.isbn: b for b in library._books.values()}
-
-        for user_data in data.get("users", []):
-            user = User.from_dict(user_data, books_dict)
-            library.add_user(user)
-
-        users_dict = {u.user_id: u for u in library._users.values()}
-
-        for record_data in data.get("borrow_records", []):
-            record = BorrowRecord.from_dict(record_data, books_dict, users_dict)
-            library.add_borrow_record(record)
-
-        borrow_records_dict = {r.record_id: r for r in library._borrow_records.values()}
+        with library.bulk_load():
+            for section in cls.SECTIONS:
+                for item_data in data.get(section, []):
+                    library.add_from_dict(section, item_data, identity_map)
+        return library
 
-        for fine_data in data.get("fines", []):
-            fine = Fine.from_dict(fine_data, users_dict, borrow_records_dict)
-            library.add_fine(fine)
+    def add_from_dict(self, section: str, data: Dict[str, Any], identity_map: IdentityMap) -> None:
+        """
+        Создает сущность раздела section (ключа из to_dict) по словарю и добавляет ее.
+        Разделы, на которые она ссылается, должны быть загружены раньше (см. SECTION_DEPENDENCIES).
+        """
+        getattr(self, self.SECTION_ADDERS[section])(self.entity_from_dict(section, data, identity_map))
+
+    def entity_from_dict(self, section: str, data: Dict[str, Any], identity_map: IdentityMap) -> Any:
+        """Создает сущность раздела section по словарю, разрешая ссылки через реестры библиотеки"""
+        if section == "authors":
+            return identity_map.author_from_dict(data)
+        if section == "genres":
+            return identity_map.genre_from_dict(data)
+        if section == "publishers":
+            return identity_map.publisher_from_dict(data)
+        if section == "books":
+            return Book.from_dict(data, identity_map)
+        if section == "users":
+            return User.from_dict(data, self._books)
+        if section == "borrow_records":
+            return BorrowRecord.from_dict(data, self._books, self._users)
+        if section == "fines":
+            return Fine.from_dict(data, self._users, self._borrow_records)
+        if section == "reservations":
+            return Reservation.from_dict(data, self._users, self._books)
+        if section == "reviews":
+            return Review.from_dict(data, self._users, self._books)
+        raise LibraryOperationError(f"Неизвестный раздел библиотеки: {section}")
 
-        for reservation_data in data.get("reservations", []):
-            reservation = Reservation.from_dict(reservation_data, users_dict, books_dict)
-            library.add_reservation(reservation)
+    @classmethod
+    def section_of(cls, entity: Any) -> str:
+        """Раздел, в котором хранится сущность"""
+        for entity_cls, section in cls.ENTITY_SECTIONS:
+            if isinstance(entity, entity_cls):
+                return section
+        raise LibraryOperationError(f"Сущность {type(entity).__name__} не относится ни к одному разделу")
+
+    def _record_change(self, section: str, key: str, entity: Any) -> None:
+        """Отмечает ключ раздела измененным (entity=None - удаленным) с последней контрольной точки"""
+        if self._loading:
+            return
+        with self._dirty_lock:
+            self._dirty.setdefault(section, {})[key] = entity
+
+    def _mark_dirty(self, entity: Any) -> None:
+        """Отмечает измененной сущность библиотеки, поле которой поменялось через сеттер"""
+        section = self.section_of(entity)
+        key = getattr(entity, self.SECTION_KEYS[section])
+        collection = getattr(self, section)
+        if collection.get(key) is entity:
+            # Повторная запись переносит изменение на месте в движок хранения (для словаря ничего не меняет)
+            collection[key] = entity
+            self._record_change(section, key, entity)
+            if self._journal is not None:
+                self._journal_entity(section, entity)
+
+    def _journal_entity(self, section: str, entity: Any) -> None:
+        """
+        Записывает в журнал новое состояние сущности, измененной через ее свойства вне
+        журналируемой операции (например, Librarian.manage_fine). При повторе состояние
+        переносится в сущность через _upsert_from_dict, поэтому повтор такой записи безвреден.
+        """
+        with self._journal_lock:
+            if self._journal is None or self._journal_depth:
+                return
+            wait = self._journal.record("_upsert_from_dict", self._clock(), (section, entity.to_dict()), {})
+        if wait is not None:
+            wait()
+
+    def _decoder(self, section: str) -> Callable[[Dict[str, Any]], Any]:
+        """Функция, собирающая сущность раздела из словаря, прочитанного из движка хранения"""
+        registry_classes = {"authors": Author, "genres": Genre, "publishers": Publisher}
+
+        def decode(data: Dict[str, Any]) -> Any:
+            if section in registry_classes:
+                # Реестр искал бы сущность в этой же коллекции, поэтому она создается напрямую
+                entity = registry_classes[section].from_dict(data)
+            else:
+                entity = self.entity_from_dict(section, data, self._storage_identity_map)
+            entity._library = self
+            return entity
+        return decode
 
-        for review_data in data.get("reviews", []):
-            review = Review.from_dict(review_data, users_dict, books_dict)
-            library.add_review(review)
+    def _open_storage(self) -> None:
+        """
+        Открывает библиотеку на непустом движке хранения: сущности разделов читаются по порядку
+        и проходят через add_* во временные словари (так строятся вторичные индексы), затем
+        собранные объекты кладутся в кэши коллекций движка без повторной записи.
+        """
+        collections = {section: getattr(self, "_" + section) for section in self.SECTIONS}
+        with self.bulk_load():
+            try:
+                for section in self.SECTIONS:
+                    setattr(self, "_" + section, {})
+                for section in self.SECTIONS:
+                    for _, data in self._storage.items(section):
+                        self.add_from_dict(section, data, self._storage_identity_map)
+                for section, collection in collections.items():
+                    collection.prime(getattr(self, "_" + section))
+            finally:
+                for section, collection in collections.items():
+                    setattr(self, "_" + section, collection)
+
+    def flush(self) -> None:
+        """Фиксирует изменения в движке хранения"""
+        self._storage.flush()
+
+    def close(self) -> None:
+        """Фиксирует изменения и закрывает движок хранения"""
+        self._storage.close()
+
+    def has_changes(self) -> bool:
+        """Есть ли изменения с последней контрольной точки"""
+        return any(self._dirty.values())
+
+    def checkpoint(self) -> None:
+        """Ставит контрольную точку: текущее состояние считается сохраненным"""
+        with self._dirty_lock:
+            self._dirty.clear()
+
+    @contextlib.contextmanager
+    def bulk_load(self) -> Iterator[None]:
+        """
+        Загрузка сохраненного состояния: изменения внутри блока не учитываются,
+        по выходе ставится контрольная точка
+        """
+        self._loading = True
+        try:
+            yield
+        finally:
+            self._loading = False
+        self.checkpoint()
 
-        return library
+    def _restore(self, section: str, entities: Iterable[Any]) -> None:
+        """
+        Кладет в раздел сущности, восстановленные из снимка или подгруженные из каталога,
+        минуя add_*: их ключей в разделе еще нет, а в учет изменений и журнал они не попадают.
+        Книги встают в очередь на индексацию, остальные сущности - в индексы через _track.
+        """
+        collection = getattr(self, "_" + section)
+        key_field = self.SECTION_KEYS[section]
+        tracked = section in ("borrow_records", "fines", "reservations", "reviews")
+        for entity in entities:
+            key = getattr(entity, key_field)
+            collection[key] = entity
+            entity._library = self
+            if tracked:
+                self._track(entity)
+            elif section == "books":
+                self._book_counter += 1
+                self._book_order[key] = self._book_counter
+                self._unindexed[key] = entity
+
+    @_synchronized(reads=SECTIONS)
+    def delta_to_dict(self) -> Dict[str, Any]:
+        """
+        Изменения с последней контрольной точки в формате to_dict: разделы содержат
+        только добавленные и измененные сущности, "deleted" - ключи удаленных по разделам.
+        """
+        delta: Dict[str, Any] = {"name": self._name}
+        deleted: Dict[str, List[str]] = {}
+        with self._dirty_lock:
+            dirty = {section: dict(changes) for section, changes in self._dirty.items()}
+        for section in self.SECTIONS:
+            changes = dirty.get(section)
+            if not changes:
+                continue
+            delta[section] = [entity.to_dict() for entity in changes.values() if entity is not None]
+            keys = [key for key, entity in changes.items() if entity is None]
+            if keys:
+                deleted[section] = keys
+        delta["deleted"] = deleted
+        return delta
+
+    @_synchronized(writes=SECTIONS)
+    def apply_delta(self, delta: Dict[str, Any]) -> None:
+        """
+        Применяет изменения из delta_to_dict поверх текущего состояния: новые сущности
+        добавляются, существующие обновляются на месте (ссылки на них остаются верными),
+        удаленные убираются. Сами примененные изменения в учет изменений не попадают.
+        """
+        pending = self._dirty
+        self._dirty = {}
+        try:
+            self.name = delta["name"]
+            identity_map = self.identity_map()
+            for section in self.SECTIONS:
+                for item_data in delta.get(section, []):
+                    self._upsert_from_dict(section, item_data, identity_map)
+            deleted = delta.get("deleted", {})
+            for section in reversed(self.SECTIONS):
+                keys = deleted.get(section)
+                if not keys:
+                    continue
+                if section not in self.SECTION_REMOVERS:
+                    raise LibraryOperationError(f"Из раздела {section} нельзя удалять сущности")
+                remove = getattr(self, self.SECTION_REMOVERS[section])
+                for key in keys:
+                    if key in getattr(self, section):
+                        remove(key)
+        finally:
+            self._dirty = pending
+
+    @_synchronized(reads=SECTIONS)
+    def _journal_snapshot(self, rotate: Callable[[], Any]) -> Tuple[Dict[str, Any], Any]:
+        """
+        Состояние для снимка журнала и результат rotate(), начинающей новый сегмент журнала.
+        Оба снимаются, пока ни одна журналируемая операция не выполняется, - так изменение
+        не может попасть и в снимок, и в новый сегмент. Блокировки берутся в том же порядке,
+        что и у изменяющих методов: разделы, блокировка журнала библиотеки, затем журнала.
+        """
+        with self._journal_lock:
+            boundary = rotate()
+            return self.to_dict(), boundary
+
+    def _upsert_from_dict(self, section: str, data: Dict[str, Any],
+                          identity_map: Optional[IdentityMap] = None) -> None:
+        """Добавляет сущность из словаря или переносит его поля в уже существующую"""
+        identity_map = identity_map or self.identity_map()
+        current = getattr(self, section).get(data[self.SECTION_KEYS[section]])
+        if current is None:
+            self.add_from_dict(section, data, identity_map)
+            return
+        if section in ("authors", "genres", "publishers"):
+            # Реестр вернул бы саму current, поэтому новое состояние читается отдельно
+            fresh = type(current).from_dict(data)
+        else:
+            fresh = self.entity_from_dict(section, data, identity_map)
+        for name in _slot_names(type(fresh)):
+            value = getattr(fresh, name)
+            if name != "_library" and getattr(current, name) != value:
+                current._set_tracked(name, value)
 
     def __str__(self) -> str:
         stats = self.get_statistics()
@@ -1611,9 +3808,216 @@ class Library:
                 f"Неоплаченные штрафы: {stats['unpaid_fines']}\n"
                 f"Отзывы: {stats['total_reviews']}")
 
+class BookQuery:
+    """
+    Составной запрос к каталогу: фильтры, сортировка, смещение и лимит.
+    Перед выполнением выбирается самый селективный из доступных индексов,
+    остальные условия проверяются на отобранных книгах.
+    """
+
+    def __init__(self, library: Library) -> None:
+        self._library = library
+        self._filters: List[Tuple[str, Callable[[str, Book], bool]]] = []
+        self._sources: List[Tuple[str, Callable[[], int], Callable[[], Iterable[str]]]] = []
+        self._order_by: Optional[Tuple[str, Callable[[Book], Any], bool]] = None
+        self._offset = 0
+        self._limit: Optional[int] = None
+
+    def _add(self, description: str, predicate: Callable[[str, Book], bool],
+             estimate: Optional[Callable[[], int]] = None,
+             keys: Optional[Callable[[], Iterable[str]]] = None) -> "BookQuery":
+        """Добавляет условие и, если есть индекс, источник кандидатов для него"""
+        self._filters.append((description, predicate))
+        if estimate is not None and keys is not None:
+            self._sources.append((description, estimate, keys))
+        return self
+
+    def isbn(self, isbn: str) -> "BookQuery":
+        """Книга с заданным ISBN"""
+        books = self._library._books
+        return self._add(f"isbn = {isbn}", lambda key, book: key == isbn,
+                         lambda: 1 if isbn in books else 0,
+                         lambda: [isbn] if isbn in books else [])
+
+    def author(self, author_id: str) -> "BookQuery":
+        """Книги автора с заданным ID"""
+        index = self._library._books_by_author
+        return self._add(f"author_id = {author_id}",
+                         lambda key, book: any(a.author_id == author_id for a in book.authors),
+                         lambda: len(index.get(author_id)), lambda: index.get(author_id))
+
+    def genre(self, genre_name: str) -> "BookQuery":
+        """Книги заданного жанра"""
+        index = self._library._books_by_genre
+        return self._add(f"genre = {genre_name}", lambda key, book: book.genre.name == genre_name,
+                         lambda: len(index.get(genre_name)), lambda: index.get(genre_name))
+
+    def publisher(self, publisher_id: str) -> "BookQuery":
+        """Книги издателя с заданным ID"""
+        index = self._library._books_by_publisher
+        return self._add(f"publisher_id = {publisher_id}",
+                         lambda key, book: book.publisher.publisher_id == publisher_id,
+                         lambda: len(index.get(publisher_id)), lambda: index.get(publisher_id))
+
+    def year_between(self, start: Optional[int] = None, end: Optional[int] = None) -> "BookQuery":
+        """Книги, изданные в диапазоне лет [start, end] (границы необязательны)"""
+        index = self._library._year_index
+        return self._add(f"year in [{start}, {end}]",
+                         lambda key, book: (start is None or book.year >= start) and
+                                           (end is None or book.year <= end),
+                         lambda: index.count(start, end), lambda: index.range(start, end))
+
+    def pages_between(self, start: Optional[int] = None, end: Optional[int] = None) -> "BookQuery":
+        """Книги с количеством страниц в диапазоне [start, end]"""
+        index = self._library._pages_index
+        return self._add(f"pages in [{start}, {end}]",
+                         lambda key, book: book.pages is not None and
+                                           (start is None or book.pages >= start) and
+                                           (end is None or book.pages <= end),
+                         lambda: index.count(start, end), lambda: index.range(start, end))
+
+    def title_contains(self, text: str) -> "BookQuery":
+        """Книги, в названии которых есть подстрока (без учета регистра)"""
+        library = self._library
+        fragment = text.lower()
+        candidates: List[Optional[Set[str]]] = []
+
+        def lookup() -> Optional[Set[str]]:
+            if not candidates:
+                candidates.append(library._title_index.lookup(text))
+            return candidates[0]
+
+        def estimate() -> int:
+            # None - индекс не сужает выборку: оценка не лучше полного просмотра, и _plan его выберет
+            keys = lookup()
+            return len(library._books) if keys is None else len(keys)
+
+        predicate = lambda key, book: fragment in book.title.lower()
+        if not TokenIndex.tokenize(text):
+            return self._add(f"title contains '{text}'", predicate)
+        return self._add(f"title contains '{text}'", predicate, estimate, lambda: lookup())
+
+    def on_loan(self, value: bool = True) -> "BookQuery":
+        """Книги, которые сейчас выданы (или, при value=False, находятся в библиотеке)"""
+        loans = self._library._open_loans_by_book
+        if not value:
+            return self._add("not on loan", lambda key, book: key not in loans)
+        return self._add("on loan", lambda key, book: key in loans,
+                         lambda: len(loans), lambda: list(loans))
+
+    def min_rating(self, rating: float) -> "BookQuery":
+        """Книги со средним рейтингом не ниже заданного"""
+        library = self._library
+        reviewed = library._reviews_by_book
+
+        def predicate(key: str, book: Book) -> bool:
+            average = library.get_average_book_rating(key)
+            return average is not None and average >= rating
+
+        return self._add(f"average rating >= {rating}", predicate,
+                         lambda: len(reviewed), lambda: list(reviewed))
+
+    def where(self, predicate: Callable[[Book], bool], description: str = "custom predicate") -> "BookQuery":
+        """Произвольное условие на книгу (проверяется без индекса)"""
+        return self._add(description, lambda key, book: predicate(book))
+
+    def order_by(self, key: Union[str, Callable[[Book], Any]], reverse: bool = False) -> "BookQuery":
+        """Сортировка по имени атрибута книги или по функции-ключу"""
+        if isinstance(key, str):
+            name = key
+            key_func = lambda book: getattr(book, name)
+        else:
+            name = getattr(key, "__name__", "custom key")
+            key_func = key
+        self._order_by = (name, key_func, reverse)
+        return self
+
+    def offset(self, count: int) -> "BookQuery":
+        """Пропускает первые count результатов"""
+        if count < 0:
+            raise LibraryOperationError("Смещение не может быть отрицательным")
+        self._offset = count
+        return self
+
+    def limit(self, count: Optional[int]) -> "BookQuery":
+        """Ограничивает количество результатов"""
+        if count is not None and count < 0:
+            raise LibraryOperationError("Лимит не может быть отрицательным")
+        self._limit = count
+        return self
+
+    def _plan(self) -> Tuple[Optional[Tuple[str, Callable[[], int], Callable[[], Iterable[str]]]], int]:
+        """Выбирает источник кандидатов с наименьшей оценкой числа строк"""
+        self._library._ensure_indexed()
+        best = None
+        best_estimate = len(self._library._books)
+        for source in self._sources:
+            estimate = source[1]()
+            if estimate < best_estimate:
+                best, best_estimate = source, estimate
+        return best, best_estimate
+
+    def explain(self) -> Dict[str, Any]:
+        """Описывает выбранный план выполнения запроса"""
+        source, estimate = self._plan()
+        return {
+            "access": "index" if source else "scan",
+            "index": source[0] if source else None,
+            "estimated_rows": estimate,
+            "filters": [description for description, _ in self._filters],
+            "order_by": (self._order_by[0], "desc" if self._order_by[2] else "asc") if self._order_by else None,
+            "offset": self._offset,
+            "limit": self._limit
+        }
+
+    def __iter__(self) -> Iterator[Book]:
+        # Потокобезопасная библиотека выполняет запрос целиком под блокировками разделов
+        if self._library._locks is not None:
+            return iter(self._library._run_query(self))
+        return self._execute()
+
+    def _execute(self) -> Iterator[Book]:
+        """Лениво выполняет запрос"""
+        library = self._library
+        books = library._books
+        source, _ = self._plan()
+        if source is None:
+            keys: Iterable[str] = books
+        else:
+            # Возвращаем кандидатов в порядке каталога, как при полном просмотре
+            keys = sorted((k for k in source[2]() if k in books), key=library._book_order.__getitem__)
+
+        matches = (books[key] for key in keys
+                   if all(predicate(key, books[key]) for _, predicate in self._filters))
+        if self._order_by is not None:
+            _, key_func, reverse = self._order_by
+            matches = iter(sorted(matches, key=key_func, reverse=reverse))
+
+        stop = None if self._limit is None else self._offset + self._limit
+        for i, book in enumerate(matches):
+            if stop is not None and i >= stop:
+                break
+            if i >= self._offset:
+                yield book
+
+    def all(self) -> List[Book]:
+        """Выполняет запрос и возвращает список книг"""
+        return list(self)
+
+    def first(self) -> Optional[Book]:
+        """Возвращает первую книгу результата или None"""
+        return next(iter(self), None)
+
+    def count(self) -> int:
+        """Количество книг в результате"""
+        return sum(1 for _ in self)
+
+
 class Librarian(User):
     """Класс библиотекаря - расширенный пользователь с админ-правами"""
 
+    __slots__ = ("_employee_id", "_department", "_admin_rights")
+
     def __init__(self,
                  user_id: str,
                  name: str,
@@ -1647,6 +4051,7 @@ class Librarian(User):
     @department.setter
     def department(self, value: str) -> None:
         self._department = value.strip()
+        self._touch()
 
     @property
     def admin_rights(self) -> bool:
@@ -1663,11 +4068,18 @@ class Librarian(User):
 
     def manage_fine(self, fine: Fine) -> None:
         """Управляет штрафом (отмечает оплаченным)"""
-        fine.pay_fine()
+        # Через библиотеку - под ее блокировками и одной записью журнала
+        if fine._library is not None:
+            fine._library.pay_fine(fine.fine_id)
+        else:
+            fine.pay_fine()
 
     def cancel_reservation(self, reservation: Reservation) -> None:
         """Отменяет резервирование книги"""
-        reservation.cancel_reservation()
+        if reservation._library is not None:
+            reservation._library.cancel_reservation(reservation.reservation_id)
+        else:
+            reservation.cancel_reservation()
 
     def add_new_user(self, library: Library, user_id: str, name: str) -> User:
         """Добавляет нового пользователя в библиотеку"""
@@ -1720,59 +4132,323 @@ class Librarian(User):
                 f"Админ-права: {'Да' if self._admin_rights else 'Нет'}")
 
 
-def indent(elem, level=0):
-    """Добавляет отступы и переносы строк для красивого XML"""
-    i = "\n" + level*"    "
-    if len(elem):
-        if not elem.text or not elem.text.strip():
-            elem.text = i + "    "
-        for child in elem:
-            indent(child, level+1)
-        if not elem.tail or not elem.tail.strip():
-            elem.tail = i
-    else:
-        if level and (not elem.tail or not elem.tail.strip()):
-            elem.tail = i
+class JsonStreamReader:
+    """
+    Потоковый разбор JSON: ключи объекта верхнего уровня и элементы массивов
+    читаются по одному, в памяти держится только текущий фрагмент файла.
+    """
+
+    _WHITESPACE = " \t\n\r"
+
+    def __init__(self, file, chunk_size: int = 1 << 16) -> None:
+        self._file = file
+        self._chunk_size = chunk_size
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        """Дочитывает следующий фрагмент, отбрасывая уже разобранную часть буфера"""
+        if self._eof:
+            return False
+        chunk = self._file.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        """Следующий значимый символ (пустая строка в конце файла)"""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in self._WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer) or not self._fill():
+                break
+        return self._buffer[self._pos:self._pos + 1]
+
+    def _expect(self, char: str) -> None:
+        found = self._peek()
+        if found != char:
+            raise LibraryException(f"Ошибка разбора JSON: ожидался '{char}', найдено '{found}'")
+        self._pos += 1
+
+    def value(self) -> Any:
+        """Читает одно JSON-значение целиком"""
+        self._peek()
+        while True:
+            try:
+                result, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError as e:
+                if self._fill():
+                    continue
+                raise LibraryException(f"Ошибка разбора JSON: {e}") from e
+            # Число на границе фрагмента может продолжаться в следующем
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return result
+
+    def skip_value(self) -> None:
+        """Пропускает значение, не держа большие массивы в памяти целиком"""
+        if self._peek() == "[":
+            for _ in self.iter_array():
+                pass
+        else:
+            self.value()
+
+    def iter_object(self) -> Iterator[str]:
+        """Перебирает ключи объекта; значение каждого ключа нужно прочитать до следующего шага"""
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self.value()
+            self._expect(":")
+            yield key
+            if self._peek() == ",":
+                self._pos += 1
+                continue
+            self._expect("}")
+            return
+
+    def iter_array(self) -> Iterator[Any]:
+        """Перебирает элементы массива по одному"""
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self.value()
+            if self._peek() == ",":
+                self._pos += 1
+                continue
+            self._expect("]")
+            return
+
+
+class XmlStreamWriter:
+    """
+    Потоковая запись XML: элементы пишутся в файл сразу, в памяти хранится только
+    стек открытых тегов. С pretty=True результат побайтно совпадает с прежним
+    форматом (ElementTree.write после расстановки отступов).
+    """
+
+    INDENT = "    "
+
+    def __init__(self, filename: str, root_tag: str,
+                 attrib: Optional[Dict[str, str]] = None, pretty: bool = True) -> None:
+        self._file = open(filename, "w", encoding="utf-8", errors="xmlcharrefreplace")
+        self._pretty = pretty
+        # Открытые элементы: [тег, есть ли дочерние элементы, текст]
+        self._stack: List[List[Any]] = []
+        self._file.write("<?xml version='1.0' encoding='utf-8'?>\n")
+        self.start(root_tag, attrib)
+
+    @staticmethod
+    def _escape_text(text: str) -> str:
+        return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+    @classmethod
+    def _escape_attrib(cls, value: str) -> str:
+        return (cls._escape_text(value).replace("\"", "&quot;").replace("\r", "&#13;")
+                .replace("\n", "&#10;").replace("\t", "&#09;"))
+
+    def start(self, tag: str, attrib: Optional[Dict[str, str]] = None) -> None:
+        """Открывает элемент; закрывающая скобка тега пишется, когда станет известно содержимое"""
+        if self._stack:
+            parent = self._stack[-1]
+            if not parent[1]:
+                parent[1] = True
+                self._file.write(">")
+                if self._pretty:
+                    self._file.write("\n" + self.INDENT * len(self._stack))
+        self._file.write("<" + tag)
+        if attrib:
+            for key, value in attrib.items():
+                self._file.write(f' {key}="{self._escape_attrib(value)}"')
+        self._stack.append([tag, False, None])
+
+    def end(self) -> None:
+        """Закрывает последний открытый элемент"""
+        tag, has_children, text = self._stack.pop()
+        if has_children:
+            self._file.write(f"</{tag}>")
+        elif text:
+            self._file.write(f">{self._escape_text(text)}</{tag}>")
+        else:
+            self._file.write(" />")
+        if self._pretty:
+            level = len(self._stack)
+            if level:
+                self._file.write("\n" + self.INDENT * level)
+            elif has_children:
+                self._file.write("\n")
+
+    def element(self, tag: str, text: Optional[str] = None,
+                attrib: Optional[Dict[str, str]] = None) -> None:
+        """Пишет элемент без дочерних элементов"""
+        self.start(tag, attrib)
+        self._stack[-1][2] = text
+        self.end()
+
+    def close(self) -> None:
+        """Закрывает все открытые элементы и файл"""
+        while self._stack:
+            self.end()
+        self._file.close()
+
+    def __enter__(self) -> 'XmlStreamWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+
+def _write_author_xml(writer: XmlStreamWriter, author: Author) -> None:
+    """Пишет полный элемент автора"""
+    writer.start("author", {"id": author.author_id})
+    writer.element("name", author.name)
+    if author.birth_year is not None:
+        writer.element("birth_year", str(author.birth_year))
+    if author.country:
+        writer.element("country", author.country)
+    writer.end()
+
+
+def _write_genre_xml(writer: XmlStreamWriter, genre: Genre) -> None:
+    """Пишет полный элемент жанра"""
+    writer.start("genre")
+    writer.element("name", genre.name)
+    if genre.description:
+        writer.element("description", genre.description)
+    writer.end()
+
+
+def _write_publisher_xml(writer: XmlStreamWriter, publisher: Publisher) -> None:
+    """Пишет полный элемент издательства"""
+    writer.start("publisher", {"id": publisher.publisher_id})
+    writer.element("name", publisher.name)
+    if publisher.location:
+        writer.element("location", publisher.location)
+    writer.end()
+
+
+def _write_book_xml(writer: XmlStreamWriter, book: Book) -> None:
+    """Пишет книгу вместе с полными данными авторов, жанра и издательства"""
+    writer.start("book", {"isbn": book.isbn})
+    writer.element("title", book.title)
+
+    writer.start("authors")
+    for author in book.authors:
+        _write_author_xml(writer, author)
+    writer.end()
+
+    _write_genre_xml(writer, book.genre)
+    _write_publisher_xml(writer, book.publisher)
+
+    writer.element("year", str(book.year))
+    if book.pages is not None:
+        writer.element("pages", str(book.pages))
+    writer.end()
+
+
+def _write_borrow_record_xml(writer: XmlStreamWriter, record: BorrowRecord) -> None:
+    writer.start("borrow_record", {"id": record.record_id})
+
+    writer.element("book_isbn", record.book.isbn)
+    writer.element("user_id", record.user.user_id)
+    writer.element("borrow_date", record.borrow_date.isoformat())
+    writer.element("due_date", record.due_date.isoformat())
+
+    if record.return_date:
+        writer.element("return_date", record.return_date.isoformat())
+    writer.end()
+
+
+def _write_fine_xml(writer: XmlStreamWriter, fine: Fine) -> None:
+    writer.start("fine", {"id": fine.fine_id})
+
+    writer.element("user_id", fine.user.user_id)
+    writer.element("borrow_record_id", fine.borrow_record.record_id)
+    writer.element("amount", str(fine.amount))
+    writer.element("reason", fine.reason)
+    writer.element("paid", str(fine.paid))
+    writer.end()
+
+
+def _write_reservation_xml(writer: XmlStreamWriter, reservation: Reservation) -> None:
+    writer.start("reservation", {"id": reservation.reservation_id})
+
+    writer.element("user_id", reservation.user.user_id)
+    writer.element("book_isbn", reservation.book.isbn)
+    writer.element("reservation_date", reservation.reservation_date.isoformat())
+    writer.element("expiry_date", reservation.expiry_date.isoformat())
+    writer.element("active", str(reservation.active))
+    writer.end()
+
+
+def _write_review_xml(writer: XmlStreamWriter, review: Review) -> None:
+    writer.start("review", {"id": review.review_id})
+
+    writer.element("user_id", review.user.user_id)
+    writer.element("book_isbn", review.book.isbn)
+    writer.element("rating", str(review.rating))
+    writer.element("comment", review.comment)
+    writer.element("review_date", review.review_date.isoformat())
+    writer.end()
 
 
+def _iter_xml_elements(source, tag: str, depth: int = 1) -> Iterator[ET.Element]:
+    """
+    Потоково перебирает завершенные элементы tag на глубине depth (корень - глубина 0).
+    После обработки элемент удаляется из родителя, поэтому дерево в памяти не растет.
+    """
+    path = []
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            path.append(elem)
+            continue
+        path.pop()
+        if len(path) == depth:
+            if elem.tag == tag:
+                yield elem
+            path[-1].remove(elem)
+
 
 def save_authors_to_json(authors: List[Author], filename: str) -> None:
     """Сохраняет список авторов в JSON файл"""
     with open(filename, "w", encoding="utf-8") as f:
         json.dump([a.to_dict() for a in authors], f, ensure_ascii=False, indent=4)
 
-def load_authors_from_json(filename: str) -> List[Author]:
+def load_authors_from_json(filename: str, identity_map: Optional[IdentityMap] = None) -> List[Author]:
     """Загружает список авторов из JSON файла"""
     with open(filename, "r", encoding="utf-8") as f:
         data = json.load(f)
+    identity_map = identity_map or IdentityMap()
     authors = []
     for a_data in data:
-        authors.append(Author.from_dict(a_data))  
+        authors.append(identity_map.author_from_dict(a_data))
     return authors
 
 def save_authors_to_xml(authors: List[Author], filename: str) -> None:
     """Сохраняет список авторов в XML файл"""
-    root = ET.Element("authors")
-    for author in authors:
-        a_el = ET.SubElement(root, "author", {"id": author.author_id})
-        ET.SubElement(a_el, "name").text = author.name
-        if author.birth_year is not None:
-            ET.SubElement(a_el, "birth_year").text = str(author.birth_year)
-        if author.country:
-            ET.SubElement(a_el, "country").text = author.country
-
-    indent(root)  
-    tree = ET.ElementTree(root)
-    tree.write(filename, encoding="utf-8", xml_declaration=True)
+    with XmlStreamWriter(filename, "authors") as writer:
+        for author in authors:
+            _write_author_xml(writer, author)
 
 
-def load_authors_from_xml(filename: str) -> List[Author]:
-    """Считывает авторов из XML и возвращает список объектов Author"""
-    tree = ET.parse(filename)
-    root = tree.getroot()
-    authors = []
+def iter_authors_from_xml(filename: str, identity_map: Optional[IdentityMap] = None) -> Iterator[Author]:
+    """Потоково считывает авторов из XML, отдавая объекты по одному по мере разбора"""
+    identity_map = identity_map or IdentityMap()
 
-    for a_el in root.findall("author"):
+    for a_el in _iter_xml_elements(filename, "author"):
         author_id = a_el.get("id")  
         name = a_el.find("name").text  
         birth_year_el = a_el.find("birth_year")
@@ -1780,9 +4456,12 @@ def load_authors_from_xml(filename: str) -> List[Author]:
         country_el = a_el.find("country")
         country = country_el.text if country_el is not None else None
 
-        authors.append(Author(author_id, name, birth_year, country))
+        yield identity_map.author(author_id, name, birth_year, country)
 
-    return authors
+
+def load_authors_from_xml(filename: str, identity_map: Optional[IdentityMap] = None) -> List[Author]:
+    """Считывает авторов из XML и возвращает список объектов Author"""
+    return list(iter_authors_from_xml(filename, identity_map))
 
 
 def save_genres_to_json(genres: List[Genre], filename: str) -> None:
@@ -1790,173 +4469,143 @@ def save_genres_to_json(genres: List[Genre], filename: str) -> None:
     with open(filename, "w", encoding="utf-8") as f:
         json.dump([g.to_dict() for g in genres], f, ensure_ascii=False, indent=4)
 
-def load_genres_from_json(filename: str) -> List[Genre]:
+def load_genres_from_json(filename: str, identity_map: Optional[IdentityMap] = None) -> List[Genre]:
     """Загружает список жанров из JSON файла"""
     with open(filename, "r", encoding="utf-8") as f:
         data = json.load(f)
+    identity_map = identity_map or IdentityMap()
     genres = []
     for g_data in data:
-        genres.append(Genre.from_dict(g_data))  
+        genres.append(identity_map.genre_from_dict(g_data))
     return genres
 
 def save_genres_to_xml(genres: List[Genre], filename: str) -> None:
     """Сохраняет список жанров в XML файл"""
-    root = ET.Element("genres")
-    for genre in genres:
-        g_el = ET.SubElement(root, "genre")
-        ET.SubElement(g_el, "name").text = genre.name
-        if genre.description:
-            ET.SubElement(g_el, "description").text = genre.description
-
-    indent(root) 
-    tree = ET.ElementTree(root)
-    tree.write(filename, encoding="utf-8", xml_declaration=True)
+    with XmlStreamWriter(filename, "genres") as writer:
+        for genre in genres:
+            _write_genre_xml(writer, genre)
 
-def load_genres_from_xml(filename: str) -> List[Genre]:
-    """Считывает жанры из XML и возвращает список объектов Genre"""
-    tree = ET.parse(filename)
-    root = tree.getroot()
-    genres = []
+def iter_genres_from_xml(filename: str, identity_map: Optional[IdentityMap] = None) -> Iterator[Genre]:
+    """Потоково считывает жанры из XML, отдавая объекты по одному по мере разбора"""
+    identity_map = identity_map or IdentityMap()
 
-    for g_el in root.findall("genre"):
+    for g_el in _iter_xml_elements(filename, "genre"):
         name = g_el.find("name").text  
         description_el = g_el.find("description")
         description = description_el.text if description_el is not None else ""
-        genres.append(Genre(name, description))
+        yield identity_map.genre(name, description)
 
-    return genres
+
+def load_genres_from_xml(filename: str, identity_map: Optional[IdentityMap] = None) -> List[Genre]:
+    """Считывает жанры из XML и возвращает список объектов Genre"""
+    return list(iter_genres_from_xml(filename, identity_map))
 
 
 def save_publishers_to_json(publishers: List[Publisher], filename: str) -> None:
     with open(filename, "w", encoding="utf-8") as f:
         json.dump([p.to_dict() for p in publishers], f, ensure_ascii=False, indent=4)
 
-def load_publishers_from_json(filename: str) -> List[Publisher]:
+def load_publishers_from_json(filename: str, identity_map: Optional[IdentityMap] = None) -> List[Publisher]:
     with open(filename, "r", encoding="utf-8") as f:
         data = json.load(f)
-    return [Publisher.from_dict(p_data) for p_data in data]
+    identity_map = identity_map or IdentityMap()
+    return [identity_map.publisher_from_dict(p_data) for p_data in data]
 
  
 def save_publishers_to_xml(publishers: List[Publisher], filename: str) -> None:
-    root = ET.Element("publishers")
-    for publisher in publishers:
-        p_el = ET.SubElement(root, "publisher", {"id": publisher.publisher_id})
-        ET.SubElement(p_el, "name").text = publisher.name
-        if publisher.location:
-            ET.SubElement(p_el, "location").text = publisher.location
+    with XmlStreamWriter(filename, "publishers") as writer:
+        for publisher in publishers:
+            _write_publisher_xml(writer, publisher)
 
-    indent(root)
-    tree = ET.ElementTree(root)
-    tree.write(filename, encoding="utf-8", xml_declaration=True)
+def iter_publishers_from_xml(filename: str, identity_map: Optional[IdentityMap] = None) -> Iterator[Publisher]:
+    """Потоково считывает издательства из XML, отдавая объекты по одному по мере разбора"""
+    identity_map = identity_map or IdentityMap()
 
-def load_publishers_from_xml(filename: str) -> List[Publisher]:
-    tree = ET.parse(filename)
-    root = tree.getroot()
-    publishers = []
-
-    for p_el in root.findall("publisher"):
+    for p_el in _iter_xml_elements(filename, "publisher"):
         publisher_id = p_el.get("id")
         name = p_el.find("name").text
         location_el = p_el.find("location")
         location = location_el.text if location_el is not None else None
-        publishers.append(Publisher(publisher_id, name, location))
+        yield identity_map.publisher(publisher_id, name, location)
+
+
+def load_publishers_from_xml(filename: str, identity_map: Optional[IdentityMap] = None) -> List[Publisher]:
+    """Считывает издательства из XML и возвращает список объектов Publisher"""
+    return list(iter_publishers_from_xml(filename, identity_map))
+
 
-    return publishers
- 
 def save_books_to_json(books: List[Book], filename: str) -> None:
     """Сохраняет список книг в JSON файл"""
     with open(filename, "w", encoding="utf-8") as f:
         json.dump([b.to_dict() for b in books], f, ensure_ascii=False, indent=4)
 
 
-def load_books_from_json(filename: str) -> List[Book]:
+def load_books_from_json(filename: str, identity_map: Optional[IdentityMap] = None) -> List[Book]:
     """Загружает список книг из JSON файла"""
     with open(filename, "r", encoding="utf-8") as f:
         data = json.load(f)
+    identity_map = identity_map or IdentityMap()
     books = []
     for b_data in data:
-        books.append(Book.from_dict(b_data))
+        books.append(identity_map.book_from_dict(b_data))
     return books
 
 
  
 def save_books_to_xml(books: List[Book], filename: str) -> None:
     """Сохраняет список книг в XML файл"""
-    root = ET.Element("books")
-    for book in books:
-        b_el = ET.SubElement(root, "book", {"isbn": book.isbn})
-        ET.SubElement(b_el, "title").text = book.title
-
-        authors_el = ET.SubElement(b_el, "authors")
-        for author in book.authors:
-            a_el = ET.SubElement(authors_el, "author", {"id": author.author_id})
-            ET.SubElement(a_el, "name").text = author.name
-            if author.birth_year is not None:
-                ET.SubElement(a_el, "birth_year").text = str(author.birth_year)
-            if author.country:
-                ET.SubElement(a_el, "country").text = author.country
+    with XmlStreamWriter(filename, "books") as writer:
+        for book in books:
+            _write_book_xml(writer, book)
 
-        genre_el = ET.SubElement(b_el, "genre")
-        ET.SubElement(genre_el, "name").text = book.genre.name
-        if book.genre.description:
-            ET.SubElement(genre_el, "description").text = book.genre.description
 
-        publisher_el = ET.SubElement(b_el, "publisher", {"id": book.publisher.publisher_id})
-        ET.SubElement(publisher_el, "name").text = book.publisher.name
-        if book.publisher.location:
-            ET.SubElement(publisher_el, "location").text = book.publisher.location
+def _book_from_xml(b_el: ET.Element, identity_map: IdentityMap) -> Book:
+    """Создает книгу из XML-элемента, используя общие объекты авторов, жанров и издателей"""
+    isbn = b_el.get("isbn")
+    title = b_el.find("title").text
 
+    authors = []
+    authors_el = b_el.find("authors")
+    for a_el in authors_el.findall("author"):
+        author_id = a_el.get("id")
+        name = a_el.find("name").text
+        birth_year_el = a_el.find("birth_year")
+        birth_year = int(birth_year_el.text) if birth_year_el is not None else None
+        country_el = a_el.find("country")
+        country = country_el.text if country_el is not None else None
+        authors.append(identity_map.author(author_id, name, birth_year, country))
 
-        ET.SubElement(b_el, "year").text = str(book.year)
-        if book.pages is not None:
-            ET.SubElement(b_el, "pages").text = str(book.pages)
+    genre_el = b_el.find("genre")
+    genre_name = genre_el.find("name").text
+    description_el = genre_el.find("description")
+    genre_description = description_el.text if description_el is not None else ""
+    genre = identity_map.genre(genre_name, genre_description)
 
-    indent(root) 
-    tree = ET.ElementTree(root)
-    tree.write(filename, encoding="utf-8", xml_declaration=True)
+    publisher_el = b_el.find("publisher")
+    publisher_id = publisher_el.get("id")
+    publisher_name = publisher_el.find("name").text
+    location_el = publisher_el.find("location")
+    location = location_el.text if location_el is not None else None
+    publisher = identity_map.publisher(publisher_id, publisher_name, location)
 
+    year = int(b_el.find("year").text)
+    pages_el = b_el.find("pages")
+    pages = int(pages_el.text) if pages_el is not None else None
 
-def load_books_from_xml(filename: str) -> List[Book]:
-    """Считывает книги из XML и возвращает список объектов Book"""
-    tree = ET.parse(filename)
-    root = tree.getroot()
-    books = []
+    return Book(isbn, title, authors, genre, publisher, year, pages)
 
-    for b_el in root.findall("book"):
-        isbn = b_el.get("isbn")
-        title = b_el.find("title").text
-
-        authors = []
-        authors_el = b_el.find("authors")
-        for a_el in authors_el.findall("author"):
-            author_id = a_el.get("id")
-            name = a_el.find("name").text
-            birth_year_el = a_el.find("birth_year")
-            birth_year = int(birth_year_el.text) if birth_year_el is not None else None
-            country_el = a_el.find("country")
-            country = country_el.text if country_el is not None else None
-            authors.append(Author(author_id, name, birth_year, country))
-
-        genre_el = b_el.find("genre")
-        genre_name = genre_el.find("name").text
-        description_el = genre_el.find("description")
-        genre_description = description_el.text if description_el is not None else ""
-        genre = Genre(genre_name, genre_description)
-
-        publisher_el = b_el.find("publisher")
-        publisher_id = publisher_el.get("id")
-        publisher_name = publisher_el.find("name").text
-        location_el = publisher_el.find("location")
-        location = location_el.text if location_el is not None else None
-        publisher = Publisher(publisher_id, publisher_name, location)
 
-        year = int(b_el.find("year").text)
-        pages_el = b_el.find("pages")
-        pages = int(pages_el.text) if pages_el is not None else None
+def iter_books_from_xml(filename: str, identity_map: Optional[IdentityMap] = None) -> Iterator[Book]:
+    """Потоково считывает книги из XML, отдавая объекты по одному по мере разбора"""
+    identity_map = identity_map or IdentityMap()
 
-        books.append(Book(isbn, title, authors, genre, publisher, year, pages))
+    for b_el in _iter_xml_elements(filename, "book"):
+        yield identity_map.book(b_el.get("isbn"), lambda: _book_from_xml(b_el, identity_map))
 
-    return books
+
+def load_books_from_xml(filename: str, identity_map: Optional[IdentityMap] = None) -> List[Book]:
+    """Считывает книги из XML и возвращает список объектов Book"""
+    return list(iter_books_from_xml(filename, identity_map))
 
 
 def save_users_to_json(users: List[User], filename: str) -> None:
@@ -1973,68 +4622,40 @@ def save_users_to_json(users: List[User], filename: str) -> None:
         json.dump(data, f, ensure_ascii=False, indent=4)
 
 
-def load_users_from_json(filename: str) -> List[User]:
+def load_users_from_json(filename: str, identity_map: Optional[IdentityMap] = None) -> List[User]:
     """Загружает список пользователей из JSON файла с полными данными заимствованных книг"""
     with open(filename, "r", encoding="utf-8") as f:
         data = json.load(f)
 
+    identity_map = identity_map or IdentityMap()
     users = []
     for u_data in data:
         user = User(u_data["user_id"], u_data["name"])
         for b_data in u_data.get("borrowed_books", []):
-            user.borrow_book(Book.from_dict(b_data))
+            user.borrow_book(identity_map.book_from_dict(b_data))
         users.append(user)
     return users
 
 
 def save_users_to_xml(users: List[User], filename: str) -> None:
     """Сохраняет список пользователей в XML файл с полными данными заимствованных книг"""
-    root = ET.Element("users")
-
-    for user in users:
-        u_el = ET.SubElement(root, "user", {"id": user.user_id})
-        ET.SubElement(u_el, "name").text = user.name
-
-        borrowed_el = ET.SubElement(u_el, "borrowed_books")
-        for book in user.borrowed_books:
-            b_el = ET.SubElement(borrowed_el, "book", {"isbn": book.isbn})
-            ET.SubElement(b_el, "title").text = book.title
-
-            authors_el = ET.SubElement(b_el, "authors")
-            for author in book.authors:
-                a_el = ET.SubElement(authors_el, "author", {"id": author.author_id})
-                ET.SubElement(a_el, "name").text = author.name
-                if author.birth_year is not None:
-                    ET.SubElement(a_el, "birth_year").text = str(author.birth_year)
-                if author.country:
-                    ET.SubElement(a_el, "country").text = author.country
-
-            genre_el = ET.SubElement(b_el, "genre")
-            ET.SubElement(genre_el, "name").text = book.genre.name
-            if book.genre.description:
-                ET.SubElement(genre_el, "description").text = book.genre.description
-
-            publisher_el = ET.SubElement(b_el, "publisher", {"id": book.publisher.publisher_id})
-            ET.SubElement(publisher_el, "name").text = book.publisher.name
-            if book.publisher.location:
-                ET.SubElement(publisher_el, "location").text = book.publisher.location
-
-            ET.SubElement(b_el, "year").text = str(book.year)
-            if book.pages is not None:
-                ET.SubElement(b_el, "pages").text = str(book.pages)
-
-    indent(root)
-    tree = ET.ElementTree(root)
-    tree.write(filename, encoding="utf-8", xml_declaration=True)
-
-
-def load_users_from_xml(filename: str) -> List[User]:
-    """Загружает список пользователей из XML файла с полными данными заимствованных книг"""
-    tree = ET.parse(filename)
-    root = tree.getroot()
+    with XmlStreamWriter(filename, "users") as writer:
+        for user in users:
+            writer.start("user", {"id": user.user_id})
+            writer.element("name", user.name)
 
-    users = []
-    for u_el in root.findall("user"):
+            writer.start("borrowed_books")
+            for book in user.borrowed_books:
+                _write_book_xml(writer, book)
+            writer.end()
+            writer.end()
+
+
+def iter_users_from_xml(filename: str, identity_map: Optional[IdentityMap] = None) -> Iterator[User]:
+    """Потоково считывает пользователей из XML, отдавая объекты по одному по мере разбора"""
+    identity_map = identity_map or IdentityMap()
+
+    for u_el in _iter_xml_elements(filename, "user"):
         user_id = u_el.get("id")
         name = u_el.find("name").text
         user = User(user_id, name)
@@ -2042,43 +4663,15 @@ def load_users_from_xml(filename: str) -> List[User]:
         borrowed_el = u_el.find("borrowed_books")
         if borrowed_el is not None:
             for b_el in borrowed_el.findall("book"):
-                isbn = b_el.get("isbn")
-                title = b_el.find("title").text
-
-                authors = []
-                authors_el = b_el.find("authors")
-                for a_el in authors_el.findall("author"):
-                    author_id = a_el.get("id")
-                    author_name = a_el.find("name").text
-                    birth_year_el = a_el.find("birth_year")
-                    birth_year = int(birth_year_el.text) if birth_year_el is not None else None
-                    country_el = a_el.find("country")
-                    country = country_el.text if country_el is not None else None
-                    authors.append(Author(author_id, author_name, birth_year, country))
-
-                genre_el = b_el.find("genre")
-                genre_name = genre_el.find("name").text
-                description_el = genre_el.find("description")
-                genre_description = description_el.text if description_el is not None else ""
-                genre = Genre(genre_name, genre_description)
-
-                publisher_el = b_el.find("publisher")
-                publisher_id = publisher_el.get("id")
-                publisher_name = publisher_el.find("name").text
-                location_el = publisher_el.find("location")
-                location = location_el.text if location_el is not None else None
-                publisher = Publisher(publisher_id, publisher_name, location)
-
-                year = int(b_el.find("year").text)
-                pages_el = b_el.find("pages")
-                pages = int(pages_el.text) if pages_el is not None else None
-
-                book = Book(isbn, title, authors, genre, publisher, year, pages)
+                book = identity_map.book(b_el.get("isbn"), lambda: _book_from_xml(b_el, identity_map))
                 user.borrow_book(book)
 
-        users.append(user)
+        yield user
 
-    return users
+
+def load_users_from_xml(filename: str, identity_map: Optional[IdentityMap] = None) -> List[User]:
+    """Загружает список пользователей из XML файла с полными данными заимствованных книг"""
+    return list(iter_users_from_xml(filename, identity_map))
 
 
 def save_borrow_records_to_json(records: List[BorrowRecord], filename: str) -> None:
@@ -2107,33 +4700,16 @@ def load_borrow_records_from_json(filename: str,
 
 def save_borrow_records_to_xml(records: List[BorrowRecord], filename: str) -> None:
     """Сохраняет список записей о заимствованиях в XML файл"""
-    root = ET.Element("borrow_records")
-
-    for record in records:
-        r_el = ET.SubElement(root, "borrow_record", {"id": record.record_id})
-
-        ET.SubElement(r_el, "book_isbn").text = record.book.isbn
-        ET.SubElement(r_el, "user_id").text = record.user.user_id
-        ET.SubElement(r_el, "borrow_date").text = record.borrow_date.isoformat()
-        ET.SubElement(r_el, "due_date").text = record.due_date.isoformat()
-
-        if record.return_date:
-            ET.SubElement(r_el, "return_date").text = record.return_date.isoformat()
+    with XmlStreamWriter(filename, "borrow_records") as writer:
+        for record in records:
+            _write_borrow_record_xml(writer, record)
 
-    indent(root)
-    tree = ET.ElementTree(root)
-    tree.write(filename, encoding="utf-8", xml_declaration=True)
 
-
-def load_borrow_records_from_xml(filename: str,
+def iter_borrow_records_from_xml(filename: str,
                                  books_dict: Dict[str, Book] = None,
-                                 users_dict: Dict[str, User] = None) -> List[BorrowRecord]:
-    """Загружает список записей о заимствованиях из XML файла"""
-    tree = ET.parse(filename)
-    root = tree.getroot()
-
-    records = []
-    for r_el in root.findall("borrow_record"):
+                                 users_dict: Dict[str, User] = None) -> Iterator[BorrowRecord]:
+    """Потоково считывает записи о заимствованиях из XML, отдавая объекты по одному по мере разбора"""
+    for r_el in _iter_xml_elements(filename, "borrow_record"):
         try:
             record_id = r_el.get("id")
             book_isbn = r_el.find("book_isbn").text
@@ -2156,15 +4732,19 @@ def load_borrow_records_from_xml(filename: str,
                     due_date=due_date,
                     return_date=return_date
                 )
-                records.append(record)
+                yield record
             else:
                 print(f"Не найдена книга или пользователь для записи {record_id}")
 
         except Exception as e:
             print(f"Ошибка загрузки записи {r_el.get('id')}: {e}")
 
-    return records
 
+def load_borrow_records_from_xml(filename: str,
+                                 books_dict: Dict[str, Book] = None,
+                                 users_dict: Dict[str, User] = None) -> List[BorrowRecord]:
+    """Загружает список записей о заимствованиях из XML файла"""
+    return list(iter_borrow_records_from_xml(filename, books_dict, users_dict))
 
 
 def save_fines_to_json(fines: List[Fine], filename: str) -> None:
@@ -2193,31 +4773,16 @@ def load_fines_from_json(filename: str,
 
 def save_fines_to_xml(fines: List[Fine], filename: str) -> None:
     """Сохраняет список штрафов в XML файл"""
-    root = ET.Element("fines")
+    with XmlStreamWriter(filename, "fines") as writer:
+        for fine in fines:
+            _write_fine_xml(writer, fine)
 
-    for fine in fines:
-        f_el = ET.SubElement(root, "fine", {"id": fine.fine_id})
 
-        ET.SubElement(f_el, "user_id").text = fine.user.user_id
-        ET.SubElement(f_el, "borrow_record_id").text = fine.borrow_record.record_id
-        ET.SubElement(f_el, "amount").text = str(fine.amount)
-        ET.SubElement(f_el, "reason").text = fine.reason
-        ET.SubElement(f_el, "paid").text = str(fine.paid)
-
-    indent(root)
-    tree = ET.ElementTree(root)
-    tree.write(filename, encoding="utf-8", xml_declaration=True)
-
-
-def load_fines_from_xml(filename: str,
+def iter_fines_from_xml(filename: str,
                         users_dict: Dict[str, User] = None,
-                        borrow_records_dict: Dict[str, BorrowRecord] = None) -> List[Fine]:
-    """Загружает список штрафов из XML файла"""
-    tree = ET.parse(filename)
-    root = tree.getroot()
-
-    fines = []
-    for f_el in root.findall("fine"):
+                        borrow_records_dict: Dict[str, BorrowRecord] = None) -> Iterator[Fine]:
+    """Потоково считывает штрафы из XML, отдавая объекты по одному по мере разбора"""
+    for f_el in _iter_xml_elements(filename, "fine"):
         try:
             fine_id = f_el.get("id")
             user_id = f_el.find("user_id").text
@@ -2231,90 +4796,19 @@ def load_fines_from_xml(filename: str,
                 borrow_record = borrow_records_dict[borrow_record_id]
 
                 fine = Fine(fine_id, user, borrow_record, amount, reason, paid)
-                fines.append(fine)
+                yield fine
             else:
                 print(f"Не найден пользователь или запись для штрафа {fine_id}")
 
         except Exception as e:
             print(f"Ошибка загрузки штрафа {f_el.get('id')}: {e}")
 
-    return fines
-
-
-
-def save_fines_to_json(fines: List[Fine], filename: str) -> None:
-    """Сохраняет список штрафов в JSON файл"""
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump([fine.to_dict() for fine in fines], f, ensure_ascii=False, indent=4)
-
-
-def load_fines_from_json(filename: str,
-                         users_dict: Dict[str, User] = None,
-                         borrow_records_dict: Dict[str, BorrowRecord] = None) -> List[Fine]:
-    """Загружает список штрафов из JSON файла"""
-    with open(filename, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    fines = []
-    for f_data in data:
-        try:
-            fine = Fine.from_dict(f_data, users_dict, borrow_records_dict)
-            fines.append(fine)
-        except LibraryException as e:
-            print(f"Ошибка загрузки штрафа {f_data.get('fine_id')}: {e}")
-
-    return fines
-
-
-def save_fines_to_xml(fines: List[Fine], filename: str) -> None:
-    """Сохраняет список штрафов в XML файл"""
-    root = ET.Element("fines")
-
-    for fine in fines:
-        f_el = ET.SubElement(root, "fine", {"id": fine.fine_id})
-
-        ET.SubElement(f_el, "user_id").text = fine.user.user_id
-        ET.SubElement(f_el, "borrow_record_id").text = fine.borrow_record.record_id
-        ET.SubElement(f_el, "amount").text = str(fine.amount)
-        ET.SubElement(f_el, "reason").text = fine.reason
-        ET.SubElement(f_el, "paid").text = str(fine.paid)
-
-    indent(root)
-    tree = ET.ElementTree(root)
-    tree.write(filename, encoding="utf-8", xml_declaration=True)
-
 
 def load_fines_from_xml(filename: str,
                         users_dict: Dict[str, User] = None,
                         borrow_records_dict: Dict[str, BorrowRecord] = None) -> List[Fine]:
     """Загружает список штрафов из XML файла"""
-    tree = ET.parse(filename)
-    root = tree.getroot()
-
-    fines = []
-    for f_el in root.findall("fine"):
-        try:
-            fine_id = f_el.get("id")
-            user_id = f_el.find("user_id").text
-            borrow_record_id = f_el.find("borrow_record_id").text
-            amount = float(f_el.find("amount").text)
-            reason = f_el.find("reason").text
-            paid = f_el.find("paid").text.lower() == "true"
-
-            if users_dict and user_id in users_dict and borrow_records_dict and borrow_record_id in borrow_records_dict:
-                user = users_dict[user_id]
-                borrow_record = borrow_records_dict[borrow_record_id]
-
-                fine = Fine(fine_id, user, borrow_record, amount, reason, paid)
-                fines.append(fine)
-            else:
-                print(f"Не найден пользователь или запись для штрафа {fine_id}")
-
-        except Exception as e:
-            print(f"Ошибка загрузки штрафа {f_el.get('id')}: {e}")
-
-    return fines
-
+    return list(iter_fines_from_xml(filename, users_dict, borrow_records_dict))
 
 
 def save_reservations_to_json(reservations: List[Reservation], filename: str) -> None:
@@ -2343,31 +4837,16 @@ def load_reservations_from_json(filename: str,
 
 def save_reservations_to_xml(reservations: List[Reservation], filename: str) -> None:
     """Сохраняет список резервирований в XML файл"""
-    root = ET.Element("reservations")
-
-    for reservation in reservations:
-        r_el = ET.SubElement(root, "reservation", {"id": reservation.reservation_id})
-
-        ET.SubElement(r_el, "user_id").text = reservation.user.user_id
-        ET.SubElement(r_el, "book_isbn").text = reservation.book.isbn
-        ET.SubElement(r_el, "reservation_date").text = reservation.reservation_date.isoformat()
-        ET.SubElement(r_el, "expiry_date").text = reservation.expiry_date.isoformat()
-        ET.SubElement(r_el, "active").text = str(reservation.active)
+    with XmlStreamWriter(filename, "reservations") as writer:
+        for reservation in reservations:
+            _write_reservation_xml(writer, reservation)
 
-    indent(root)
-    tree = ET.ElementTree(root)
-    tree.write(filename, encoding="utf-8", xml_declaration=True)
 
-
-def load_reservations_from_xml(filename: str,
+def iter_reservations_from_xml(filename: str,
                                users_dict: Dict[str, User] = None,
-                               books_dict: Dict[str, Book] = None) -> List[Reservation]:
-    """Загружает список резервирований из XML файла"""
-    tree = ET.parse(filename)
-    root = tree.getroot()
-
-    reservations = []
-    for r_el in root.findall("reservation"):
+                               books_dict: Dict[str, Book] = None) -> Iterator[Reservation]:
+    """Потоково считывает резервирования из XML, отдавая объекты по одному по мере разбора"""
+    for r_el in _iter_xml_elements(filename, "reservation"):
         try:
             reservation_id = r_el.get("id")
             user_id = r_el.find("user_id").text
@@ -2383,15 +4862,19 @@ def load_reservations_from_xml(filename: str,
                 reservation = Reservation(reservation_id, user, book, reservation_date, expiry_date)
                 if not active:
                     reservation.cancel_reservation()
-                reservations.append(reservation)
+                yield reservation
             else:
                 print(f"Не найден пользователь или книга для резервирования {reservation_id}")
 
         except Exception as e:
             print(f"Ошибка загрузки резервирования {r_el.get('id')}: {e}")
 
-    return reservations
 
+def load_reservations_from_xml(filename: str,
+                               users_dict: Dict[str, User] = None,
+                               books_dict: Dict[str, Book] = None) -> List[Reservation]:
+    """Загружает список резервирований из XML файла"""
+    return list(iter_reservations_from_xml(filename, users_dict, books_dict))
 
 
 def save_reviews_to_json(reviews: List[Review], filename: str) -> None:
@@ -2420,31 +4903,16 @@ def load_reviews_from_json(filename: str,
 
 def save_reviews_to_xml(reviews: List[Review], filename: str) -> None:
     """Сохраняет список отзывов в XML файл"""
-    root = ET.Element("reviews")
+    with XmlStreamWriter(filename, "reviews") as writer:
+        for review in reviews:
+            _write_review_xml(writer, review)
 
-    for review in reviews:
-        r_el = ET.SubElement(root, "review", {"id": review.review_id})
 
-        ET.SubElement(r_el, "user_id").text = review.user.user_id
-        ET.SubElement(r_el, "book_isbn").text = review.book.isbn
-        ET.SubElement(r_el, "rating").text = str(review.rating)
-        ET.SubElement(r_el, "comment").text = review.comment
-        ET.SubElement(r_el, "review_date").text = review.review_date.isoformat()
-
-    indent(root)
-    tree = ET.ElementTree(root)
-    tree.write(filename, encoding="utf-8", xml_declaration=True)
-
-
-def load_reviews_from_xml(filename: str,
+def iter_reviews_from_xml(filename: str,
                           users_dict: Dict[str, User] = None,
-                          books_dict: Dict[str, Book] = None) -> List[Review]:
-    """Загружает список отзывов из XML файла"""
-    tree = ET.parse(filename)
-    root = tree.getroot()
-
-    reviews = []
-    for r_el in root.findall("review"):
+                          books_dict: Dict[str, Book] = None) -> Iterator[Review]:
+    """Потоково считывает отзывы из XML, отдавая объекты по одному по мере разбора"""
+    for r_el in _iter_xml_elements(filename, "review"):
         try:
             review_id = r_el.get("id")
             user_id = r_el.find("user_id").text
@@ -2458,74 +4926,1704 @@ def load_reviews_from_xml(filename: str,
                 book = books_dict[book_isbn]
 
                 review = Review(review_id, user, book, rating, comment, review_date)
-                reviews.append(review)
+                yield review
             else:
                 print(f"Не найден пользователь или книга для отзыва {review_id}")
 
         except Exception as e:
             print(f"Ошибка загрузки отзыва {r_el.get('id')}: {e}")
 
-    return reviews
 
+def load_reviews_from_xml(filename: str,
+                          users_dict: Dict[str, User] = None,
+                          books_dict: Dict[str, Book] = None) -> List[Review]:
+    """Загружает список отзывов из XML файла"""
+    return list(iter_reviews_from_xml(filename, users_dict, books_dict))
 
 
 def save_library_to_json(library: Library, filename: str) -> None:
-    """Сохраняет всю библиотеку в JSON файл"""
+    """Сохраняет всю библиотеку в JSON файл и ставит контрольную точку для save_delta"""
     with open(filename, "w", encoding="utf-8") as f:
         json.dump(library.to_dict(), f, ensure_ascii=False, indent=4)
+    library.checkpoint()
 
 
 def load_library_from_json(filename: str) -> Library:
-    """Загружает всю библиотеку из JSON файла"""
-    with open(filename, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    """
+    Загружает всю библиотеку из JSON файла потоково: разделы читаются по одному
+    элементу, сущности создаются сразу, а промежуточные словари не накапливаются.
+    """
+    library: Optional[Library] = None
+    identity_map: Optional[IdentityMap] = None
+    loaded: Set[str] = set()
+    deferred: Dict[str, List[Dict[str, Any]]] = {}
+
+    def ready(section: str) -> bool:
+        return all(dep in loaded for dep in Library.SECTION_DEPENDENCIES.get(section, ()))
+
+    def flush_deferred() -> None:
+        for section in Library.SECTIONS:
+            if section in deferred and ready(section):
+                for item_data in deferred.pop(section):
+                    library.add_from_dict(section, item_data, identity_map)
+                loaded.add(section)
+
+    with open(filename, "r", encoding="utf-8") as f, contextlib.ExitStack() as loading:
+        reader = JsonStreamReader(f)
+        for key in reader.iter_object():
+            if key == "name":
+                library = Library(reader.value())
+                identity_map = library.identity_map()
+                loading.enter_context(library.bulk_load())
+                continue
+            if key not in Library.SECTIONS:
+                reader.skip_value()
+                continue
+            if library is None:
+                raise LibraryException("Название библиотеки должно идти в файле раньше разделов")
+
+            if ready(key):
+                for item_data in reader.iter_array():
+                    library.add_from_dict(key, item_data, identity_map)
+                loaded.add(key)
+                flush_deferred()
+            else:
+                # Раздел встретился раньше тех, на которые ссылается - откладываем его
+                deferred[key] = list(reader.iter_array())
+
+        if library is None:
+            raise LibraryException("В файле нет названия библиотеки")
+        loaded.update(deferred)
+        for section in Library.SECTIONS:
+            for item_data in deferred.pop(section, []):
+                library.add_from_dict(section, item_data, identity_map)
+    return library
+
+
+def save_delta(library: Library, filename: str) -> None:
+    """
+    Записывает в JSON файл только сущности, добавленные, измененные или удаленные с последней
+    контрольной точки (сохранения снимка, загрузки или прошлой дельты), и ставит новую точку.
+    """
+    tmp_path = filename + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(library.delta_to_dict(), f, ensure_ascii=False)
+    os.replace(tmp_path, filename)
+    library.checkpoint()
+
+
+def load_library_with_deltas(snapshot_filename: str, delta_filenames: Iterable[str]) -> Library:
+    """Загружает JSON снимок и применяет к нему дельты save_delta в порядке их записи"""
+    library = load_library_from_json(snapshot_filename)
+    for filename in delta_filenames:
+        with open(filename, "r", encoding="utf-8") as f:
+            library.apply_delta(json.load(f))
+    return library
+
+
+class JsonLinesStore:
+    """
+    Хранение библиотеки в формате JSON Lines: каталог с файлом на каждый раздел,
+    по одному объекту на строку. Изменения дописываются в конец файла, при загрузке
+    последняя запись с тем же ключом побеждает, compact() сворачивает историю.
+    """
+
+    META_FILE = "library.json"
+    DELETED = "$deleted"
+
+    SECTION_KEYS = Library.SECTION_KEYS
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+    def _path(self, section: str) -> str:
+        return os.path.join(self.directory, f"{section}.jsonl")
+
+    def _write_section(self, section: str, items: Iterable[Dict[str, Any]]) -> None:
+        """Атомарно перезаписывает файл раздела"""
+        path = self._path(section)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for data in items:
+                f.write(json.dumps(data, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, path)
+
+    def save(self, library: Library) -> None:
+        """Записывает полный снимок библиотеки, заменяя журналы разделов"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, self.META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"name": library.name}, f, ensure_ascii=False)
+        for section in Library.SECTIONS:
+            entities = getattr(library, section).values()
+            self._write_section(section, (entity.to_dict() for entity in entities))
+
+    def append(self, *entities: Any) -> None:
+        """Дописывает новые или измененные сущности в конец журналов их разделов"""
+        lines: Dict[str, List[str]] = {}
+        for entity in entities:
+            lines.setdefault(Library.section_of(entity), []).append(
+                json.dumps(entity.to_dict(), ensure_ascii=False))
+        for section, section_lines in lines.items():
+            with open(self._path(section), "a", encoding="utf-8") as f:
+                f.write("\n".join(section_lines) + "\n")
+
+    def append_delete(self, section: str, key: str) -> None:
+        """Дописывает в журнал раздела отметку об удалении сущности"""
+        if section not in self.SECTION_KEYS:
+            raise LibraryOperationError(f"Неизвестный раздел библиотеки: {section}")
+        with open(self._path(section), "a", encoding="utf-8") as f:
+            f.write(json.dumps({self.DELETED: key}, ensure_ascii=False) + "\n")
+
+    def iter_lines(self, section: str) -> Iterator[Dict[str, Any]]:
+        """Потоково читает записи журнала раздела (включая устаревшие и отметки удаления)"""
+        path = self._path(section)
+        if not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def iter_section(self, section: str) -> Iterator[Dict[str, Any]]:
+        """Актуальные записи раздела: последняя версия каждой сущности на месте первой"""
+        key_field = self.SECTION_KEYS[section]
+        latest: Dict[str, Dict[str, Any]] = {}
+        for data in self.iter_lines(section):
+            if self.DELETED in data:
+                latest.pop(data[self.DELETED], None)
+            else:
+                latest[data[key_field]] = data
+        return iter(latest.values())
+
+    def load(self) -> Library:
+        """Восстанавливает библиотеку из журналов"""
+        with open(os.path.join(self.directory, self.META_FILE), "r", encoding="utf-8") as f:
+            library = Library(json.load(f)["name"])
+        identity_map = library.identity_map()
+        with library.bulk_load():
+            for section in Library.SECTIONS:
+                for data in self.iter_section(section):
+                    library.add_from_dict(section, data, identity_map)
+        return library
+
+    def compact(self) -> None:
+        """Сворачивает журналы: в каждом разделе остается одна строка на живую сущность"""
+        for section in Library.SECTIONS:
+            if os.path.exists(self._path(section)):
+                self._write_section(section, self.iter_section(section))
+
+
+def _slot_names(cls: type) -> List[str]:
+    """Все слоты класса с учетом базовых классов"""
+    names = []
+    for klass in reversed(cls.__mro__):
+        names.extend(getattr(klass, "__slots__", ()))
+    return names
+
+
+# Двоичный снимок: заголовок (сигнатура и смещение таблицы строк), ссылка на название,
+# разделы в порядке Library.SECTIONS (u32 число записей, затем записи с префиксом
+# длины u32) и таблица строк в конце файла. Строки и ссылки на сущности хранятся
+# u32-индексами, даты - микросекундами от EPOCH.
+SNAPSHOT_MAGIC = b"LIBSNAP1"
+_SNAPSHOT_HEADER = struct.Struct("<8sQ")
+_U32 = struct.Struct("<I")
+_NO_REF = 0xFFFFFFFF
+_NO_INT = -(2 ** 63)
+
+_AUTHOR_RECORD = struct.Struct("<?IIqI")        # в реестре, id, имя, год рождения, страна
+_GENRE_RECORD = struct.Struct("<?II")           # в реестре, название, описание
+_PUBLISHER_RECORD = struct.Struct("<?III")      # в реестре, id, название, город
+_BOOK_RECORD = struct.Struct("<IIIIqq")         # ISBN, название, жанр, издатель, год, страницы + авторы
+_USER_RECORD = struct.Struct("<II")             # id, имя + взятые книги
+_LOAN_RECORD = struct.Struct("<IIIqqq")         # id, книга, пользователь, выдача, срок, возврат
+_FINE_RECORD = struct.Struct("<III?dI?")        # id, пользователь, запись, целая сумма, сумма, причина, оплачен
+_RESERVATION_RECORD = struct.Struct("<IIIqq?")  # id, пользователь, книга, дата, истечение, активно
+_REVIEW_RECORD = struct.Struct("<IIIqIq")       # id, пользователь, книга, оценка, комментарий, дата
+
+
+_RESTORE_SLOTS: Dict[type, List[Any]] = {}
+
+
+def _restore_entity(cls: type, *values: Any) -> Any:
+    """Создает объект из значений слотов в порядке _slot_names, минуя проверки конструктора"""
+    setters = _RESTORE_SLOTS.get(cls)
+    if setters is None:
+        setters = _RESTORE_SLOTS[cls] = [getattr(cls, name).__set__ for name in _slot_names(cls)]
+    entity = cls.__new__(cls)
+    for setter, value in zip(setters, values):
+        setter(entity, value)
+    return entity
+
+
+def save_library_to_binary(library: Library, filename: str) -> None:
+    """
+    Сохраняет библиотеку в двоичный снимок. Авторы, жанры и издатели книг, не внесенные
+    в реестры библиотеки, тоже сохраняются (с пометкой), чтобы граф объектов восстановился полностью.
+    """
+    strings: Dict[str, int] = {}
+
+    def ref(value: Optional[str]) -> int:
+        if value is None:
+            return _NO_REF
+        index = strings.get(value)
+        if index is None:
+            index = strings[value] = len(strings)
+        return index
+
+    def number(value: Optional[int]) -> int:
+        return _NO_INT if value is None else value
+
+    def moment(value: Optional[datetime]) -> int:
+        return _NO_INT if value is None else to_epoch_micros(value)
+
+    # Раздел -> (ключ -> позиция), по позициям записи ссылаются друг на друга
+    positions: Dict[str, Dict[Any, int]] = {}
+
+    def positions_of(section: str, keys: Iterable[Any]) -> Dict[Any, int]:
+        positions[section] = {key: i for i, key in enumerate(keys)}
+        return positions[section]
+
+    def position(section: str, key: Any) -> int:
+        try:
+            return positions[section][key]
+        except KeyError:
+            raise LibraryOperationError(f"Снимок ссылается на отсутствующую запись {key} раздела {section}")
+
+    books = library.books.values()
+    extra_authors = {a.author_id: a for b in books for a in b.authors if a.author_id not in library.authors}
+    extra_genres = {b.genre.name: b.genre for b in books if b.genre.name not in library.genres}
+    extra_publishers = {b.publisher.publisher_id: b.publisher for b in books
+                        if b.publisher.publisher_id not in library.publishers}
+
+    # Снимок пишется во временный файл и подменяет прежний только целиком
+    tmp_path = filename + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, 0))
+        f.write(_U32.pack(ref(library.name)))
+
+        def write_section(payloads: List[bytes]) -> None:
+            f.write(_U32.pack(len(payloads)))
+            f.write(b"".join(_U32.pack(len(payload)) + payload for payload in payloads))
+
+        authors = list(library.authors.values()) + list(extra_authors.values())
+        positions_of("authors", (a.author_id for a in authors))
+        write_section([_AUTHOR_RECORD.pack(a.author_id not in extra_authors, ref(a.author_id), ref(a.name),
+                                           number(a.birth_year), ref(a.country)) for a in authors])
+
+        genres = list(library.genres.values()) + list(extra_genres.values())
+        positions_of("genres", (g.name for g in genres))
+        write_section([_GENRE_RECORD.pack(g.name not in extra_genres, ref(g.name), ref(g.description))
+                       for g in genres])
+
+        publishers = list(library.publishers.values()) + list(extra_publishers.values())
+        positions_of("publishers", (p.publisher_id for p in publishers))
+        write_section([_PUBLISHER_RECORD.pack(p.publisher_id not in extra_publishers, ref(p.publisher_id),
+                                              ref(p.name), ref(p.location)) for p in publishers])
+
+        positions_of("books", library.books)
+        write_section([
+            _BOOK_RECORD.pack(ref(b.isbn), ref(b.title), position("genres", b.genre.name),
+                              position("publishers", b.publisher.publisher_id), b.year, number(b.pages))
+            + struct.pack(f"<{len(b.authors)}I", *(position("authors", a.author_id) for a in b.authors))
+            for b in books
+        ])
+
+        book_positions = positions["books"]
+        positions_of("users", library.users)
+        user_payloads = []
+        for u in library.users.values():
+            # Книги, удаленные из библиотеки, выпадают из списка выданных, как и при загрузке JSON
+            held = [book_positions[b.isbn] for b in u.borrowed_books if b.isbn in book_positions]
+            user_payloads.append(_USER_RECORD.pack(ref(u.user_id), ref(u.name)) + struct.pack(f"<{len(held)}I", *held))
+        write_section(user_payloads)
+
+        positions_of("borrow_records", library.borrow_records)
+        write_section([
+            _LOAN_RECORD.pack(ref(r.record_id), position("books", r.book.isbn), position("users", r.user.user_id),
+                              moment(r.borrow_date), moment(r.due_date), moment(r.return_date))
+            for r in library.borrow_records.values()
+        ])
+        write_section([
+            _FINE_RECORD.pack(ref(fine.fine_id), position("users", fine.user.user_id),
+                              position("borrow_records", fine.borrow_record.record_id),
+                              isinstance(fine.amount, int), fine.amount, ref(fine.reason), fine.paid)
+            for fine in library.fines.values()
+        ])
+        write_section([
+            _RESERVATION_RECORD.pack(ref(r.reservation_id), position("users", r.user.user_id),
+                                     position("books", r.book.isbn), moment(r.reservation_date),
+                                     moment(r.expiry_date), r.active)
+            for r in library.reservations.values()
+        ])
+        write_section([
+            _REVIEW_RECORD.pack(ref(r.review_id), position("users", r.user.user_id), position("books", r.book.isbn),
+                                r.rating, ref(r.comment), moment(r.review_date))
+            for r in library.reviews.values()
+        ])
+
+        # Таблица строк: число строк, их длины в символах и все строки одним блоком UTF-8
+        strings_offset = f.tell()
+        f.write(_U32.pack(len(strings)))
+        lengths = array("I", map(len, strings))
+        if sys.byteorder == "big":
+            lengths.byteswap()
+        f.write(lengths.tobytes())
+        f.write("".join(strings).encode("utf-8"))
+
+        f.seek(0)
+        f.write(_SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, strings_offset))
+    os.replace(tmp_path, filename)
+
+
+def load_library_from_binary(filename: str) -> Library:
+    """
+    Восстанавливает библиотеку из двоичного снимка. Данные уже прошли проверку при
+    сохранении, поэтому объекты создаются напрямую, без конструкторов и разбора дат,
+    и кладутся в разделы без add_*; поисковые индексы строятся при первом поиске.
+    """
+    with _gc_paused():
+        return _read_binary_snapshot(filename)
+
+
+def _read_binary_snapshot(filename: str) -> Library:
+    """Разбирает двоичный снимок (см. load_library_from_binary)"""
+    with open(filename, "rb") as f:
+        data = f.read()
+
+    magic, strings_offset = _SNAPSHOT_HEADER.unpack_from(data, 0)
+    if magic != SNAPSHOT_MAGIC:
+        raise LibraryException(f"Файл {filename} не является двоичным снимком библиотеки")
+
+    (count,) = _U32.unpack_from(data, strings_offset)
+    lengths = array("I")
+    lengths.frombytes(data[strings_offset + 4:strings_offset + 4 + 4 * count])
+    if sys.byteorder == "big":
+        lengths.byteswap()
+    blob = data[strings_offset + 4 + 4 * count:].decode("utf-8")
+    strings: List[str] = []
+    start = 0
+    for length in lengths:
+        strings.append(blob[start:start + length])
+        start += length
+
+    def text(index: int) -> Optional[str]:
+        return None if index == _NO_REF else strings[index]
+
+    def number(value: int) -> Optional[int]:
+        return None if value == _NO_INT else value
+
+    def moment(value: int) -> Optional[datetime]:
+        return None if value == _NO_INT else from_epoch_micros(value)
+
+    pos = _SNAPSHOT_HEADER.size
+    library = Library(strings[_U32.unpack_from(data, pos)[0]])
+    pos += 4
+
+    def records(layout: struct.Struct) -> Iterator[Tuple[tuple, Tuple[int, ...]]]:
+        """Записи раздела: поля фиксированной части и хвост из u32-ссылок"""
+        nonlocal pos
+        (count,) = _U32.unpack_from(data, pos)
+        pos += 4
+        for _ in range(count):
+            (size,) = _U32.unpack_from(data, pos)
+            start = pos + 4
+            pos = start + size
+            tail = (size - layout.size) // 4
+            yield layout.unpack_from(data, start), struct.unpack_from(f"<{tail}I", data, start + layout.size)
+
+    def fixed_records(layout: struct.Struct) -> Iterator[tuple]:
+        """
+        Записи раздела без хвоста: длина каждой равна layout.size, поэтому раздел
+        разбирается одним iter_unpack вместе с префиксами длин
+        """
+        nonlocal pos
+        (count,) = _U32.unpack_from(data, pos)
+        start = pos + 4
+        pos = start + count * (4 + layout.size)
+        for size, *fields in struct.iter_unpack("<I" + layout.format[1:], data[start:pos]):
+            if size != layout.size:
+                raise LibraryException(f"Файл {filename} поврежден: неверная длина записи")
+            yield fields
+
+    with library.bulk_load():
+        authors, registered = [], []
+        for (in_registry, author_id, name, birth_year, country) in fixed_records(_AUTHOR_RECORD):
+            authors.append(_restore_entity(Author, None, text(author_id), text(name), number(birth_year),
+                                           text(country)))
+            registered.append(in_registry)
+        library._restore("authors", itertools.compress(authors, registered))
+
+        genres, registered = [], []
+        for (in_registry, name, description) in fixed_records(_GENRE_RECORD):
+            genres.append(_restore_entity(Genre, None, text(name), text(description)))
+            registered.append(in_registry)
+        library._restore("genres", itertools.compress(genres, registered))
+
+        publishers, registered = [], []
+        for (in_registry, publisher_id, name, location) in fixed_records(_PUBLISHER_RECORD):
+            publishers.append(_restore_entity(Publisher, None, text(publisher_id), text(name), text(location)))
+            registered.append(in_registry)
+        library._restore("publishers", itertools.compress(publishers, registered))
+
+        books = [_restore_entity(Book, None, text(isbn), text(title), [authors[i] for i in author_refs],
+                                 genres[genre], publishers[publisher], year, number(pages))
+                 for (isbn, title, genre, publisher, year, pages), author_refs in records(_BOOK_RECORD)]
+        library._restore("books", books)
+
+        users = [_restore_entity(User, None, text(user_id), text(name), [books[i] for i in book_refs])
+                 for (user_id, name), book_refs in records(_USER_RECORD)]
+        library._restore("users", users)
+
+        loans = [_restore_entity(BorrowRecord, None, text(record_id), books[book], users[user],
+                                 moment(borrow_date), moment(due_date), moment(return_date))
+                 for record_id, book, user, borrow_date, due_date, return_date in fixed_records(_LOAN_RECORD)]
+        library._restore("borrow_records", loans)
+
+        library._restore("fines", (
+            _restore_entity(Fine, None, text(fine_id), users[user], loans[record],
+                            int(amount) if is_int else amount, text(reason), paid)
+            for fine_id, user, record, is_int, amount, reason, paid in fixed_records(_FINE_RECORD)))
+
+        library._restore("reservations", (
+            _restore_entity(Reservation, None, text(reservation_id), users[user], books[book],
+                            moment(reservation_date), moment(expiry_date), active)
+            for reservation_id, user, book, reservation_date, expiry_date, active
+            in fixed_records(_RESERVATION_RECORD)))
+
+        library._restore("reviews", (
+            _restore_entity(Review, None, text(review_id), users[user], books[book],
+                            rating, text(comment), moment(review_date))
+            for review_id, user, book, rating, comment, review_date in fixed_records(_REVIEW_RECORD)))
+    return library
+
+
+class MappedCatalog:
+    """
+    Каталог книг и пользователей на диске с произвольным доступом через mmap.
+    Файл: заголовок, записи (ключ и to_dict в JSON) и два отсортированных индекса
+    смещений - по ISBN и по ID пользователя. Поиск - двоичный по индексу, в память
+    попадают только запрошенные записи.
+    """
+
+    MAGIC = b"LIBCAT01"
+    _HEADER = struct.Struct("<8sIQIQI")   # сигнатура, книги: число и смещение индекса, то же для пользователей, длина названия
+    _ENTRY = struct.Struct("<QII")        # смещение ключа, длина ключа, длина записи (запись следует за ключом)
+
+    def __init__(self, filename: str) -> None:
+        self._file = open(filename, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self._book_count, self._book_index, self._user_count,
+         self._user_index, name_length) = self._HEADER.unpack_from(self._map, 0)
+        if magic != self.MAGIC:
+            self.close()
+            raise LibraryException(f"Файл {filename} не является каталогом библиотеки")
+        self.name = self._map[self._HEADER.size:self._HEADER.size + name_length].decode("utf-8")
+        # Общие авторы, жанры и издатели для уже подгруженных книг
+        self._identity_map = IdentityMap()
 
-    return Library.from_dict(data)
+    @classmethod
+    def write(cls, library: Library, filename: str) -> None:
+        """Сохраняет книги и пользователей библиотеки в файл каталога"""
+        name = library.name.encode("utf-8")
+        with open(filename, "wb") as f:
+            f.write(cls._HEADER.pack(cls.MAGIC, 0, 0, 0, 0, len(name)) + name)
+
+            def write_records(items: Iterable[Tuple[str, Dict[str, Any]]]) -> List[Tuple[bytes, int, int]]:
+                entries = []
+                for key, data in items:
+                    key_bytes = key.encode("utf-8")
+                    record = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                    entries.append((key_bytes, f.tell(), len(record)))
+                    f.write(key_bytes + record)
+                return entries
+
+            def write_index(entries: List[Tuple[bytes, int, int]]) -> int:
+                offset = f.tell()
+                entries.sort()
+                f.write(b"".join(cls._ENTRY.pack(key_offset, len(key), size) for key, key_offset, size in entries))
+                return offset
+
+            book_entries = write_records((isbn, book.to_dict()) for isbn, book in library.books.items())
+            user_entries = write_records((user_id, user.to_dict()) for user_id, user in library.users.items())
+            book_index = write_index(book_entries)
+            user_index = write_index(user_entries)
+            f.seek(0)
+            f.write(cls._HEADER.pack(cls.MAGIC, len(book_entries), book_index,
+                                     len(user_entries), user_index, len(name)))
+
+    def _find(self, index_offset: int, count: int, key: str) -> Optional[Dict[str, Any]]:
+        """Двоичный поиск ключа в индексе; возвращает разобранную запись или None"""
+        target = key.encode("utf-8")
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            key_offset, key_length, size = self._ENTRY.unpack_from(self._map, index_offset + mid * self._ENTRY.size)
+            found = self._map[key_offset:key_offset + key_length]
+            if found < target:
+                lo = mid + 1
+            elif found > target:
+                hi = mid
+            else:
+                start = key_offset + key_length
+                return json.loads(self._map[start:start + size].decode("utf-8"))
+        return None
 
+    def get_book(self, isbn: str) -> Optional[Book]:
+        """Читает книгу с диска (без кэширования: повторно вызывается только при промахе библиотеки)"""
+        data = self._find(self._book_index, self._book_count, isbn)
+        return Book.from_dict(data, self._identity_map) if data is not None else None
+
+    def get_user(self, user_id: str, get_book: Callable[[str], Optional[Book]]) -> Optional[User]:
+        """Читает пользователя с диска; взятые книги разрешаются через get_book"""
+        data = self._find(self._user_index, self._user_count, user_id)
+        if data is None:
+            return None
+        user = User(data["user_id"], data["name"])
+        for isbn in data.get("borrowed_books", []):
+            book = get_book(isbn)
+            if book is not None:
+                user.borrow_book(book)
+        return user
 
-def save_library_to_xml(library: Library, filename: str) -> None:
-    """Сохраняет всю библиотеку в XML файл"""
-    root = ET.Element("library", {"name": library.name})
-
-    authors_el = ET.SubElement(root, "authors")
-    for author in library.authors.values():
-        a_el = ET.SubElement(authors_el, "author", {"id": author.author_id})
-        ET.SubElement(a_el, "name").text = author.name
-        if author.birth_year:
-            ET.SubElement(a_el, "birth_year").text = str(author.birth_year)
-        if author.country:
-            ET.SubElement(a_el, "country").text = author.country
-
-    genres_el = ET.SubElement(root, "genres")
-    for genre in library.genres.values():
-        g_el = ET.SubElement(genres_el, "genre")
-        ET.SubElement(g_el, "name").text = genre.name
-        if genre.description:
-            ET.SubElement(g_el, "description").text = genre.description
-
-    publishers_el = ET.SubElement(root, "publishers")
-    for publisher in library.publishers.values():
-        p_el = ET.SubElement(publishers_el, "publisher", {"id": publisher.publisher_id})
-        ET.SubElement(p_el, "name").text = publisher.name
-        if publisher.location:
-            ET.SubElement(p_el, "location").text = publisher.location
-
-    books_el = ET.SubElement(root, "books")
-    for book in library.books.values():
-        b_el = ET.SubElement(books_el, "book", {"isbn": book.isbn})
-        ET.SubElement(b_el, "title").text = book.title
-        ET.SubElement(b_el, "year").text = str(book.year)
-        if book.pages:
-            ET.SubElement(b_el, "pages").text = str(book.pages)
+    def close(self) -> None:
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self) -> "MappedCatalog":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+
+def save_library_catalog(library: Library, filename: str) -> None:
+    """Сохраняет книги и пользователей в каталог с произвольным доступом по ключу"""
+    MappedCatalog.write(library, filename)
+
+
+def open_library_catalog(filename: str) -> Library:
+    """
+    Открывает каталог как пустую библиотеку, которая подгружает книги и пользователей
+    по мере обращения к get_book/get_user. Коллекции books/users и поиск видят только
+    уже подгруженные записи.
+    """
+    catalog = MappedCatalog(filename)
+    library = Library(catalog.name)
+    library.attach_catalog(catalog)
+    return library
+
+
+class WriteAheadLog:
+    """
+    Сегмент журнала: одна JSON-строка на операцию. Запись буферизуется, а fsync выполняется
+    группой - когда накопилось group_size записей, фоновым потоком раз в group_interval
+    секунд или по wait(), так что одна синхронизация с диском подтверждает сразу все записи,
+    дописанные до нее. Пока идет fsync, новые записи дописываются и войдут в следующую группу.
+    """
+
+    def __init__(self, filename: str, group_size: int = 64, group_interval: float = 0.05) -> None:
+        self.filename = filename
+        self._file = open(filename, "a", encoding="utf-8")
+        self._group_size = group_size
+        # Номера последней дописанной и последней подтвержденной fsync записи
+        self._written = 0
+        self._synced = 0
+        self._syncing = False
+        self._condition = threading.Condition(threading.Lock())
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, args=(group_interval,), daemon=True)
+        self._flusher.start()
+
+    def append(self, entry: Dict[str, Any]) -> int:
+        """
+        Дописывает запись и возвращает ее номер для wait(); на диск она гарантированно
+        попадает после ближайшей групповой синхронизации
+        """
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._condition:
+            self._file.write(line)
+            self._written += 1
+            if self._written - self._synced >= self._group_size and not self._syncing:
+                self._sync_locked()
+            return self._written
+
+    def wait(self, number: int) -> None:
+        """Дожидается fsync, подтверждающего запись с номером number"""
+        with self._condition:
+            while self._synced < number:
+                if self._syncing:
+                    self._condition.wait()
+                else:
+                    self._sync_locked()
+
+    def sync(self) -> None:
+        """Немедленно сбрасывает накопленные записи на диск"""
+        self.wait(self._written)
+
+    def _sync_locked(self) -> None:
+        """Синхронизирует все дописанные записи; на время fsync блокировка отпускается"""
+        if self._synced == self._written or self._file.closed:
+            return
+        target = self._written
+        self._file.flush()
+        self._syncing = True
+        self._condition.release()
+        try:
+            os.fsync(self._file.fileno())
+        finally:
+            self._condition.acquire()
+            self._syncing = False
+            self._condition.notify_all()
+        self._synced = target
+
+    def _flush_periodically(self, interval: float) -> None:
+        while not self._closed.wait(interval):
+            self.sync()
+
+    def close(self) -> None:
+        self._closed.set()
+        self._flusher.join()
+        with self._condition:
+            while self._syncing:
+                self._condition.wait()
+            self._sync_locked()
+            self._file.close()
+
+    @staticmethod
+    def read(filename: str) -> Iterator[Dict[str, Any]]:
+        """Читает записи сегмента; оборванная последняя строка (сбой во время записи) пропускается"""
+        with open(filename, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    return
+                yield json.loads(line)
+
+
+class LibraryJournal:
+    """
+    Журнал изменений библиотеки в каталоге: снимки snapshot-N.json и сегменты wal-N.log.
+    Снимок N содержит все изменения из сегментов с номером меньше N, поэтому при запуске
+    берется последний снимок и поверх него повторяются сегменты начиная с N. Записи журнала
+    нумеруются сквозным номером seq, а снимок хранит номер последней вошедшей в него записи
+    (SEQUENCE_KEY) - уже примененные записи при повторе пропускаются.
+    Журналируются методы Library, помеченные @_journaled, а прямые изменения сущностей
+    через их свойства - как новое состояние сущности целиком.
+    При durable=True изменяющий метод возвращает управление только после fsync, в который
+    вошла его запись; иначе запись подтверждается ближайшей групповой синхронизацией.
+    """
+
+    SNAPSHOT_PATTERN = re.compile(r"snapshot-(\d+)\.json$")
+    SEGMENT_PATTERN = re.compile(r"wal-(\d+)\.log$")
+    SEQUENCE_KEY = "journal_seq"
+
+    def __init__(self, directory: str, group_size: int = 64, group_interval: float = 0.05,
+                 durable: bool = False) -> None:
+        self.directory = directory
+        self._durable = durable
+        self._group_size = group_size
+        self._group_interval = group_interval
+        self._library: Optional[Library] = None
+        self._log: Optional[WriteAheadLog] = None
+        self._segment = 0
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._compaction: Optional[threading.Thread] = None
+
+    def _files(self, pattern: "re.Pattern[str]") -> List[Tuple[int, str]]:
+        """Файлы каталога, подходящие под шаблон, по возрастанию номера"""
+        found = []
+        for name in os.listdir(self.directory):
+            match = pattern.match(name)
+            if match:
+                found.append((int(match.group(1)), os.path.join(self.directory, name)))
+        return sorted(found)
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"wal-{number}.log")
+
+    def open(self, name: str = "Библиотека", thread_safe: bool = False) -> Library:
+        """
+        Восстанавливает библиотеку (последний снимок + повтор журнала) и подключает к ней журнал.
+        name используется, только если в каталоге еще нет снимков; thread_safe передается Library.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        snapshots = self._files(self.SNAPSHOT_PATTERN)
+        if snapshots:
+            first_segment, path = snapshots[-1]
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            library = Library.from_dict(data, thread_safe)
+            self._seq = data.get(self.SEQUENCE_KEY, 0)
+        else:
+            # Пустой снимок фиксирует название новой библиотеки
+            first_segment, library, self._seq = 0, Library(name, thread_safe=thread_safe), 0
+            self._write_snapshot(self._snapshot_data(library.to_dict(), 0), 0)
+
+        identity_map = library.identity_map()
+        self._segment = first_segment
+        for number, path in self._files(self.SEGMENT_PATTERN):
+            if number >= first_segment:
+                for entry in WriteAheadLog.read(path):
+                    # Записи без номера остались от журналов до нумерации и повторяются всегда
+                    seq = entry.get("seq")
+                    if seq is None or seq > self._seq:
+                        self._replay(library, entry, identity_map)
+                        self._seq = seq or self._seq
+                self._segment = number + 1
+
+        # Каждый запуск пишет в новый сегмент, чтобы не дописывать за оборванной строкой
+        library.checkpoint()
+        self._library = library
+        self._log = WriteAheadLog(self._segment_path(self._segment), self._group_size, self._group_interval)
+        library._journal = self
+        return library
+
+    @staticmethod
+    def _encode(value: Any) -> Any:
+        if isinstance(value, datetime):
+            return {"$datetime": value.isoformat()}
+        if isinstance(value, (list, tuple)):
+            return [LibraryJournal._encode(item) for item in value]
+        if hasattr(value, "to_dict"):
+            return {"$entity": Library.section_of(value), "data": value.to_dict()}
+        return value
+
+    @staticmethod
+    def _decode(value: Any, library: Library, identity_map: IdentityMap) -> Any:
+        if isinstance(value, list):
+            return [LibraryJournal._decode(item, library, identity_map) for item in value]
+        if isinstance(value, dict):
+            if "$datetime" in value:
+                return datetime.fromisoformat(value["$datetime"])
+            if "$entity" in value:
+                return library.entity_from_dict(value["$entity"], value["data"], identity_map)
+        return value
+
+    def record(self, operation: str, at: datetime, args: Tuple[Any, ...],
+               kwargs: Dict[str, Any]) -> Optional[Callable[[], None]]:
+        """
+        Записывает выполненную операцию Library. При durable=True возвращает функцию,
+        дожидающуюся fsync этой записи: вызывать ее следует после снятия блокировок,
+        чтобы за время ожидания другие операции успели войти в ту же группу.
+        """
+        entry = {
+            "op": operation,
+            "at": at.isoformat(),
+            "args": [self._encode(arg) for arg in args],
+            "kwargs": {key: self._encode(value) for key, value in kwargs.items()},
+        }
+        with self._lock:
+            self._seq += 1
+            entry["seq"] = self._seq
+            number = self._log.append(entry)
+            log = self._log
+        return functools.partial(log.wait, number) if self._durable else None
+
+    @classmethod
+    def _replay(cls, library: Library, entry: Dict[str, Any], identity_map: IdentityMap) -> None:
+        """Повторяет операцию с тем же временем, что и при исходном выполнении"""
+        at = datetime.fromisoformat(entry["at"])
+        args = [cls._decode(arg, library, identity_map) for arg in entry["args"]]
+        kwargs = {key: cls._decode(value, library, identity_map) for key, value in entry["kwargs"].items()}
+        library._clock = lambda: at
+        try:
+            getattr(library, entry["op"])(*args, **kwargs)
+        finally:
+            library._clock = datetime.now
+
+    def sync(self) -> None:
+        """Дожидается записи на диск всех операций"""
+        self._log.sync()
+
+    def _snapshot_data(self, data: Dict[str, Any], seq: int) -> Dict[str, Any]:
+        """Данные снимка: to_dict библиотеки и номер последней учтенной в нем записи"""
+        data[self.SEQUENCE_KEY] = seq
+        return data
+
+    def _rotate(self) -> Tuple[int, int]:
+        """Закрывает текущий сегмент и начинает следующий; возвращает его номер и номер последней записи"""
+        with self._lock:
+            self._log.close()
+            self._segment += 1
+            self._log = WriteAheadLog(self._segment_path(self._segment), self._group_size, self._group_interval)
+            return self._segment, self._seq
+
+    def compact(self, background: bool = True) -> Optional[threading.Thread]:
+        """
+        Начинает новый сегмент и сохраняет снимок текущего состояния. Состояние снимается
+        синхронно, между журналируемыми операциями (чтобы оно точно соответствовало границе
+        сегментов), а запись снимка и удаление устаревших файлов выполняются в фоновом
+        потоке, если background=True.
+        """
+        if self._compaction is not None:
+            self._compaction.join()
+        data, (segment, seq) = self._library._journal_snapshot(self._rotate)
+        data = self._snapshot_data(data, seq)
+
+        if not background:
+            self._write_snapshot(data, segment)
+            return None
+        self._compaction = threading.Thread(target=self._write_snapshot, args=(data, segment))
+        self._compaction.start()
+        return self._compaction
+
+    def _write_snapshot(self, data: Dict[str, Any], segment: int) -> None:
+        """Атомарно записывает снимок segment и удаляет покрытые им снимки и сегменты"""
+        path = os.path.join(self.directory, f"snapshot-{segment}.json")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        for number, old_path in self._files(self.SNAPSHOT_PATTERN) + self._files(self.SEGMENT_PATTERN):
+            if number < segment:
+                os.remove(old_path)
+
+    def close(self) -> None:
+        """Дожидается фоновой компактации, сбрасывает журнал и отключает его от библиотеки"""
+        if self._compaction is not None:
+            self._compaction.join()
+            self._compaction = None
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        if self._library is not None:
+            self._library._journal = None
+            self._library = None
+
+
+class _RowCache:
+    """Сущности, уже собранные из строк в рамках одного обращения к SqliteLibrary"""
+
+    __slots__ = ("identity_map", "books", "users", "records")
+
+    def __init__(self) -> None:
+        self.identity_map = IdentityMap()
+        self.books: Dict[str, Book] = {}
+        self.users: Dict[str, User] = {}
+        self.records: Dict[str, BorrowRecord] = {}
+
+
+class SqliteLibrary:
+    """
+    Библиотека в базе SQLite для каталогов, которые не помещаются в память объектами.
+    Повторяет основные методы Library, но каждый из них - запрос к индексированным таблицам.
+    Сущности собираются из строк при обращении и не кэшируются: изменения сохраняются
+    только через методы хранилища (update_book, pay_fine, return_book и т.д.).
+    Даты хранятся микросекундами от EPOCH, библиотекари - как обычные пользователи.
+    """
+
+    FINE_PER_DAY = Library.FINE_PER_DAY
+    # Сколько ключей подставлять в один запрос с IN (...)
+    BATCH_SIZE = 500
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS authors (
+            author_id TEXT PRIMARY KEY, name TEXT NOT NULL, name_lower TEXT NOT NULL,
+            birth_year INTEGER, country TEXT, registered INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS genres (
+            name TEXT PRIMARY KEY, name_lower TEXT NOT NULL, description TEXT NOT NULL,
+            registered INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS publishers (
+            publisher_id TEXT PRIMARY KEY, name TEXT NOT NULL, location TEXT,
+            registered INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS books (
+            seq INTEGER PRIMARY KEY, isbn TEXT NOT NULL UNIQUE, title TEXT NOT NULL,
+            title_lower TEXT NOT NULL, genre TEXT NOT NULL, publisher_id TEXT NOT NULL,
+            year INTEGER NOT NULL, pages INTEGER);
+        CREATE TABLE IF NOT EXISTS book_authors (
+            isbn TEXT NOT NULL, position INTEGER NOT NULL, author_id TEXT NOT NULL,
+            PRIMARY KEY (isbn, position));
+        CREATE INDEX IF NOT EXISTS book_authors_author ON book_authors (author_id);
+        CREATE TABLE IF NOT EXISTS users (user_id TEXT PRIMARY KEY, name TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS user_books (
+            user_id TEXT NOT NULL, isbn TEXT NOT NULL, PRIMARY KEY (user_id, isbn));
+        CREATE INDEX IF NOT EXISTS user_books_book ON user_books (isbn);
+        CREATE TABLE IF NOT EXISTS borrow_records (
+            record_id TEXT PRIMARY KEY, isbn TEXT NOT NULL, user_id TEXT NOT NULL,
+            borrow_date INTEGER NOT NULL, due_date INTEGER NOT NULL, return_date INTEGER);
+        CREATE INDEX IF NOT EXISTS borrow_records_user ON borrow_records (user_id);
+        CREATE INDEX IF NOT EXISTS borrow_records_book ON borrow_records (isbn);
+        CREATE INDEX IF NOT EXISTS borrow_records_open_due ON borrow_records (due_date)
+            WHERE return_date IS NULL;
+        CREATE INDEX IF NOT EXISTS borrow_records_late ON borrow_records (return_date)
+            WHERE return_date > due_date;
+        CREATE TABLE IF NOT EXISTS fines (
+            fine_id TEXT PRIMARY KEY, user_id TEXT NOT NULL, record_id TEXT NOT NULL,
+            amount NOT NULL, reason TEXT NOT NULL, paid INTEGER NOT NULL);
+        CREATE INDEX IF NOT EXISTS fines_user ON fines (user_id);
+        CREATE INDEX IF NOT EXISTS fines_record ON fines (record_id);
+        CREATE INDEX IF NOT EXISTS fines_unpaid ON fines (user_id) WHERE paid = 0;
+        CREATE TABLE IF NOT EXISTS reservations (
+            reservation_id TEXT PRIMARY KEY, user_id TEXT NOT NULL, isbn TEXT NOT NULL,
+            reservation_date INTEGER NOT NULL, expiry_date INTEGER NOT NULL, active INTEGER NOT NULL);
+        CREATE INDEX IF NOT EXISTS reservations_book ON reservations (isbn);
+        CREATE INDEX IF NOT EXISTS reservations_user ON reservations (user_id);
+        CREATE INDEX IF NOT EXISTS reservations_active ON reservations (expiry_date) WHERE active = 1;
+        CREATE TABLE IF NOT EXISTS reviews (
+            review_id TEXT PRIMARY KEY, user_id TEXT NOT NULL, isbn TEXT NOT NULL,
+            rating INTEGER NOT NULL, comment TEXT NOT NULL, review_date INTEGER NOT NULL);
+        CREATE INDEX IF NOT EXISTS reviews_book ON reviews (isbn);
+        CREATE INDEX IF NOT EXISTS reviews_user ON reviews (user_id);
+    """
+    # Таблицы со ссылками на книгу и на пользователя: пока такие строки есть, удалять нельзя,
+    # иначе записи о заимствовании, штрафы и отзывы перестанут собираться
+    BOOK_REFERENCES = ("user_books", "borrow_records", "reservations", "reviews")
+    USER_REFERENCES = ("borrow_records", "fines", "reservations", "reviews")
+    # Триграммный полнотекстовый индекс для поиска по подстроке; rowid совпадает с books.seq
+    FTS_SCHEMA = "CREATE VIRTUAL TABLE IF NOT EXISTS book_text USING fts5(title, authors, genre, tokenize='trigram')"
+
+    # Запросы - константы, чтобы sqlite3 переиспользовал подготовленные выражения из своего кэша
+    _UPSERT_AUTHOR = ("INSERT INTO authors VALUES (?, ?, ?, ?, ?, 1) ON CONFLICT (author_id) DO UPDATE SET "
+                      "name = excluded.name, name_lower = excluded.name_lower, birth_year = excluded.birth_year, "
+                      "country = excluded.country, registered = 1")
+    _UPSERT_GENRE = ("INSERT INTO genres VALUES (?, ?, ?, 1) ON CONFLICT (name) DO UPDATE SET "
+                     "description = excluded.description, registered = 1")
+    _UPSERT_PUBLISHER = ("INSERT INTO publishers VALUES (?, ?, ?, 1) ON CONFLICT (publisher_id) DO UPDATE SET "
+                         "name = excluded.name, location = excluded.location, registered = 1")
+    _INSERT_AUTHOR_REF = "INSERT OR IGNORE INTO authors VALUES (?, ?, ?, ?, ?, 0)"
+    _INSERT_GENRE_REF = "INSERT OR IGNORE INTO genres VALUES (?, ?, ?, 0)"
+    _INSERT_PUBLISHER_REF = "INSERT OR IGNORE INTO publishers VALUES (?, ?, ?, 0)"
+    _INSERT_BOOK = ("INSERT INTO books (isbn, title, title_lower, genre, publisher_id, year, pages) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)")
+    _INSERT_BOOK_AUTHOR = "INSERT INTO book_authors VALUES (?, ?, ?)"
+    _INSERT_BOOK_TEXT = ("INSERT INTO book_text (rowid, title, authors, genre) "
+                         "VALUES ((SELECT seq FROM books WHERE isbn = ?), ?, ?, ?)")
+    _INSERT_USER = "INSERT INTO users VALUES (?, ?)"
+    _INSERT_USER_BOOK = "INSERT OR IGNORE INTO user_books VALUES (?, ?)"
+    _INSERT_RECORD = "INSERT INTO borrow_records VALUES (?, ?, ?, ?, ?, ?)"
+    _INSERT_FINE = "INSERT INTO fines VALUES (?, ?, ?, ?, ?, ?)"
+    _INSERT_RESERVATION = "INSERT INTO reservations VALUES (?, ?, ?, ?, ?, ?)"
+    _INSERT_REVIEW = "INSERT INTO reviews VALUES (?, ?, ?, ?, ?, ?)"
+
+    _SELECT_BOOKS = ("SELECT b.isbn, b.title, b.year, b.pages, g.name, g.description, "
+                     "p.publisher_id, p.name, p.location FROM books b "
+                     "JOIN genres g ON g.name = b.genre JOIN publishers p ON p.publisher_id = b.publisher_id "
+                     "WHERE b.isbn IN ({keys})")
+    _SELECT_BOOK_AUTHORS = ("SELECT ba.isbn, a.author_id, a.name, a.birth_year, a.country FROM book_authors ba "
+                            "JOIN authors a ON a.author_id = ba.author_id WHERE ba.isbn IN ({keys}) "
+                            "ORDER BY ba.isbn, ba.position")
+    _SELECT_USERS = "SELECT user_id, name FROM users WHERE user_id IN ({keys})"
+    _SELECT_USER_BOOKS = "SELECT user_id, isbn FROM user_books WHERE user_id IN ({keys}) ORDER BY rowid"
+    _SELECT_RECORDS = "SELECT * FROM borrow_records WHERE record_id IN ({keys})"
+
+    def __init__(self, filename: str, name: str = "Библиотека") -> None:
+        """name используется, только если база новая"""
+        self._connection = sqlite3.connect(filename, cached_statements=256)
+        self._connection.executescript(self.SCHEMA)
+        try:
+            self._connection.execute(self.FTS_SCHEMA)
+            self._fts = True
+        except sqlite3.OperationalError:
+            # Сборка SQLite без FTS5 или триграммного токенизатора: поиск проверяет все книги
+            self._fts = False
+        self._clock: Callable[[], datetime] = datetime.now
+
+        row = self._connection.execute("SELECT value FROM meta WHERE key = 'name'").fetchone()
+        if row is None:
+            self.name = name
+        else:
+            self._name = row[0]
+
+    @property
+    def name(self) -> str:
+        return self._name
 
-    users_el = ET.SubElement(root, "users")
-    for user in library.users.values():
-        u_el = ET.SubElement(users_el, "user", {"id": user.user_id})
-        ET.SubElement(u_el, "name").text = user.name
+    @name.setter
+    def name(self, value: str) -> None:
+        if not value or not value.strip():
+            raise InvalidLibraryNameError("Название библиотеки обязательно")
+        self._name = value.strip()
+        with self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO meta VALUES ('name', ?)", (self._name,))
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def __enter__(self) -> "SqliteLibrary":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
 
-    indent(root)
-    tree = ET.ElementTree(root)
-    tree.write(filename, encoding="utf-8", xml_declaration=True)
+    def _scalar(self, sql: str, params: Tuple = ()) -> Any:
+        return self._connection.execute(sql, params).fetchone()[0]
+
+    def _exists(self, sql: str, key: str) -> bool:
+        return self._connection.execute(sql, (key,)).fetchone() is not None
+
+    def _ensure_unreferenced(self, column: str, key: str, tables: Tuple[str, ...], description: str) -> None:
+        """Запрещает удаление сущности, на которую еще ссылаются строки таблиц tables"""
+        for table in tables:
+            if self._exists(f"SELECT 1 FROM {table} WHERE {column} = ? LIMIT 1", key):
+                raise LibraryOperationError(f"Нельзя удалить {description}: есть связанные строки в таблице {table}")
+
+    def _select_in(self, sql: str, keys: List[str]) -> Iterator[Tuple]:
+        """Выполняет запрос с условием IN ({keys}) пакетами по BATCH_SIZE ключей"""
+        for start in range(0, len(keys), self.BATCH_SIZE):
+            chunk = keys[start:start + self.BATCH_SIZE]
+            yield from self._connection.execute(sql.format(keys=", ".join("?" * len(chunk))), chunk)
+
+    def _next_id(self, prefix: str, table: str, column: str) -> str:
+        """
+        Свободный ID вида prefix_N. Берется от max(rowid) - без удалений это число строк,
+        как в Library._next_id, но без подсчета всей таблицы.
+        """
+        number = (self._scalar(f"SELECT max(rowid) FROM {table}") or 0) + 1
+        while self._exists(f"SELECT 1 FROM {table} WHERE {column} = ?", f"{prefix}_{number}"):
+            number += 1
+        return f"{prefix}_{number}"
+
+    # --- Запись ---
+
+    @staticmethod
+    def _author_params(author: Author) -> Tuple:
+        return author.author_id, author.name, author.name.lower(), author.birth_year, author.country
+
+    @staticmethod
+    def _genre_params(genre: Genre) -> Tuple:
+        return genre.name, genre.name.lower(), genre.description
+
+    @staticmethod
+    def _publisher_params(publisher: Publisher) -> Tuple:
+        return publisher.publisher_id, publisher.name, publisher.location
+
+    @staticmethod
+    def _record_params(record: BorrowRecord) -> Tuple:
+        return (record.record_id, record.book.isbn, record.user.user_id, to_epoch_micros(record.borrow_date),
+                to_epoch_micros(record.due_date),
+                to_epoch_micros(record.return_date) if record.return_date is not None else None)
+
+    @staticmethod
+    def _fine_params(fine: Fine) -> Tuple:
+        return fine.fine_id, fine.user.user_id, fine.borrow_record.record_id, fine.amount, fine.reason, fine.paid
+
+    @staticmethod
+    def _reservation_params(reservation: Reservation) -> Tuple:
+        return (reservation.reservation_id, reservation.user.user_id, reservation.book.isbn,
+                to_epoch_micros(reservation.reservation_date), to_epoch_micros(reservation.expiry_date),
+                reservation.active)
+
+    @staticmethod
+    def _review_params(review: Review) -> Tuple:
+        return (review.review_id, review.user.user_id, review.book.isbn, review.rating, review.comment,
+                to_epoch_micros(review.review_date))
+
+    def _write_book_references(self, books: Iterable[Book]) -> None:
+        """Записывает авторов, жанры и издателей книг, которых еще нет в базе (вне реестров)"""
+        books = list(books)
+        executemany = self._connection.executemany
+        executemany(self._INSERT_AUTHOR_REF, (self._author_params(a) for book in books for a in book.authors))
+        executemany(self._INSERT_GENRE_REF, (self._genre_params(book.genre) for book in books))
+        executemany(self._INSERT_PUBLISHER_REF, (self._publisher_params(book.publisher) for book in books))
+
+    def _write_book_details(self, books: Dict[str, Book]) -> None:
+        """Записывает авторов книг по порядку и строки полнотекстового индекса"""
+        executemany = self._connection.executemany
+        executemany(self._INSERT_BOOK_AUTHOR, ((isbn, position, author.author_id)
+                                               for isbn, book in books.items()
+                                               for position, author in enumerate(book.authors)))
+        if self._fts:
+            executemany(self._INSERT_BOOK_TEXT, ((isbn, book.title, "\n".join(a.name for a in book.authors),
+                                                  book.genre.name) for isbn, book in books.items()))
+
+    def _write_books(self, books: Dict[str, Book]) -> None:
+        self._write_book_references(books.values())
+        self._connection.executemany(self._INSERT_BOOK, (
+            (isbn, book.title, book.title.lower(), book.genre.name, book.publisher.publisher_id, book.year, book.pages)
+            for isbn, book in books.items()))
+        self._write_book_details(books)
+
+    def _write_users(self, users: Dict[str, User]) -> None:
+        self._connection.executemany(self._INSERT_USER, ((user_id, user.name) for user_id, user in users.items()))
+        self._connection.executemany(self._INSERT_USER_BOOK, ((user_id, book.isbn) for user_id, user in users.items()
+                                                              for book in user.borrowed_books))
+
+    def _insert(self, sql: str, params: Tuple, duplicate_message: str,
+                error: type = LibraryException) -> None:
+        """Вставляет одну строку в отдельной транзакции; повтор ключа - исключение Library"""
+        try:
+            with self._connection:
+                self._connection.execute(sql, params)
+        except sqlite3.IntegrityError:
+            raise error(duplicate_message) from None
+
+    def import_library(self, library: Library) -> None:
+        """Переносит всю библиотеку в базу одной транзакцией пакетными вставками"""
+        executemany = self._connection.executemany
+        try:
+            with self._connection:
+                executemany(self._UPSERT_AUTHOR, map(self._author_params, library.authors.values()))
+                executemany(self._UPSERT_GENRE, map(self._genre_params, library.genres.values()))
+                executemany(self._UPSERT_PUBLISHER, map(self._publisher_params, library.publishers.values()))
+                self._write_books(library.books)
+                self._write_users(library.users)
+                executemany(self._INSERT_RECORD, map(self._record_params, library.borrow_records.values()))
+                executemany(self._INSERT_FINE, map(self._fine_params, library.fines.values()))
+                executemany(self._INSERT_RESERVATION, map(self._reservation_params, library.reservations.values()))
+                executemany(self._INSERT_REVIEW, map(self._review_params, library.reviews.values()))
+        except sqlite3.IntegrityError as error:
+            raise DuplicateItemError(f"В базе уже есть сущности импортируемой библиотеки: {error}") from None
+
+    def add_author(self, author: Author) -> None:
+        """Добавляет автора"""
+        if self._exists("SELECT 1 FROM authors WHERE author_id = ? AND registered = 1", author.author_id):
+            raise LibraryException(f"Автор с ID {author.author_id} уже существует")
+        with self._connection:
+            self._connection.execute(self._UPSERT_AUTHOR, self._author_params(author))
+
+    def add_genre(self, genre: Genre) -> None:
+        """Добавляет жанр"""
+        if self._exists("SELECT 1 FROM genres WHERE name = ? AND registered = 1", genre.name):
+            raise LibraryException(f"Жанр с названием {genre.name} уже существует")
+        with self._connection:
+            self._connection.execute(self._UPSERT_GENRE, self._genre_params(genre))
+
+    def add_publisher(self, publisher: Publisher) -> None:
+        """Добавляет издателя"""
+        if self._exists("SELECT 1 FROM publishers WHERE publisher_id = ? AND registered = 1", publisher.publisher_id):
+            raise LibraryException(f"Издатель с ID {publisher.publisher_id} уже существует")
+        with self._connection:
+            self._connection.execute(self._UPSERT_PUBLISHER, self._publisher_params(publisher))
+
+    def add_book(self, book: Book) -> None:
+        """Добавляет книгу"""
+        try:
+            with self._connection:
+                self._write_books({book.isbn: book})
+        except sqlite3.IntegrityError:
+            raise DuplicateItemError(f"Книга с ISBN {book.isbn} уже существует") from None
+
+    def update_book(self, isbn: str, new_book: Book) -> None:
+        """Обновляет информацию о книге, сохраняя ее место в порядке добавления"""
+        if not self._exists("SELECT 1 FROM books WHERE isbn = ?", isbn):
+            raise ItemNotFoundError(f"Книга с ISBN {isbn} не найдена")
+        with self._connection:
+            self._write_book_references([new_book])
+            self._connection.execute(
+                "UPDATE books SET title = ?, title_lower = ?, genre = ?, publisher_id = ?, year = ?, pages = ? "
+                "WHERE isbn = ?", (new_book.title, new_book.title.lower(), new_book.genre.name,
+                                   new_book.publisher.publisher_id, new_book.year, new_book.pages, isbn))
+            self._delete_book_details(isbn)
+            self._write_book_details({isbn: new_book})
+
+    def _delete_book_details(self, isbn: str) -> None:
+        self._connection.execute("DELETE FROM book_authors WHERE isbn = ?", (isbn,))
+        if self._fts:
+            self._connection.execute("DELETE FROM book_text WHERE rowid = (SELECT seq FROM books WHERE isbn = ?)",
+                                     (isbn,))
+
+    def delete_book(self, isbn: str) -> None:
+        """Удаляет книгу; книгу, у которой есть выдачи, брони или отзывы, удалить нельзя"""
+        if not self._exists("SELECT 1 FROM books WHERE isbn = ?", isbn):
+            raise LibraryException(f"Книга с ISBN {isbn} не найдена")
+        self._ensure_unreferenced("isbn", isbn, self.BOOK_REFERENCES, f"книгу {isbn}")
+        with self._connection:
+            self._delete_book_details(isbn)
+            self._connection.execute("DELETE FROM books WHERE isbn = ?", (isbn,))
+
+    def add_user(self, user: User) -> None:
+        """Добавляет пользователя"""
+        try:
+            with self._connection:
+                self._write_users({user.user_id: user})
+        except sqlite3.IntegrityError:
+            raise LibraryException(f"Пользователь с ID {user.user_id} уже существует") from None
+
+    def update_user(self, user_id: str, new_user: User) -> None:
+        """Обновляет информацию о пользователе"""
+        if not self._exists("SELECT 1 FROM users WHERE user_id = ?", user_id):
+            raise LibraryException(f"Пользователь с ID {user_id} не найден")
+        with self._connection:
+            self._connection.execute("DELETE FROM user_books WHERE user_id = ?", (user_id,))
+            self._connection.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+            self._write_users({user_id: new_user})
+
+    def delete_user(self, user_id: str) -> None:
+        """Удаляет пользователя; пользователя с выдачами, штрафами, бронями или отзывами удалить нельзя"""
+        if not self._exists("SELECT 1 FROM users WHERE user_id = ?", user_id):
+            raise LibraryException(f"Пользователь с ID {user_id} не найден")
+        self._ensure_unreferenced("user_id", user_id, self.USER_REFERENCES, f"пользователя {user_id}")
+        with self._connection:
+            self._connection.execute("DELETE FROM user_books WHERE user_id = ?", (user_id,))
+            self._connection.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+
+    def add_borrow_record(self, record: BorrowRecord) -> None:
+        """Добавляет запись о заимствовании"""
+        self._insert(self._INSERT_RECORD, self._record_params(record),
+                     f"Запись с ID {record.record_id} уже существует")
+
+    def add_fine(self, fine: Fine) -> None:
+        """Добавляет штраф"""
+        self._insert(self._INSERT_FINE, self._fine_params(fine), f"Штраф с ID {fine.fine_id} уже существует")
+
+    def add_reservation(self, reservation: Reservation) -> None:
+        """Добавляет резервирование"""
+        self._insert(self._INSERT_RESERVATION, self._reservation_params(reservation),
+                     f"Резервирование с ID {reservation.reservation_id} уже существует")
+
+    def add_review(self, review: Review) -> None:
+        """Добавляет отзыв"""
+        self._insert(self._INSERT_REVIEW, self._review_params(review), f"Отзыв с ID {review.review_id} уже существует")
+
+    # --- Сборка сущностей из строк ---
+
+    def _load_books(self, isbns: Iterable[str], cache: _RowCache) -> Dict[str, Book]:
+        """Догружает в cache книги с указанными ISBN (отсутствующие в базе пропускаются)"""
+        missing = [isbn for isbn in dict.fromkeys(isbns) if isbn not in cache.books]
+        if not missing:
+            return cache.books
+        identity_map = cache.identity_map
+        authors: Dict[str, List[Author]] = {}
+        for isbn, author_id, name, birth_year, country in self._select_in(self._SELECT_BOOK_AUTHORS, missing):
+            authors.setdefault(isbn, []).append(identity_map.author(author_id, name, birth_year, country))
+        for isbn, title, year, pages, genre, description, publisher_id, publisher, location in \
+                self._select_in(self._SELECT_BOOKS, missing):
+            cache.books[isbn] = _restore_entity(Book, None, isbn, title, authors.get(isbn, []),
+                                                identity_map.genre(genre, description),
+                                                identity_map.publisher(publisher_id, publisher, location),
+                                                year, pages)
+        return cache.books
+
+    def _load_users(self, user_ids: Iterable[str], cache: _RowCache) -> Dict[str, User]:
+        """Догружает в cache пользователей вместе с их взятыми книгами"""
+        missing = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in cache.users]
+        if not missing:
+            return cache.users
+        borrowed: Dict[str, List[str]] = {}
+        for user_id, isbn in self._select_in(self._SELECT_USER_BOOKS, missing):
+            borrowed.setdefault(user_id, []).append(isbn)
+        books = self._load_books((isbn for isbns in borrowed.values() for isbn in isbns), cache)
+        for user_id, name in self._select_in(self._SELECT_USERS, missing):
+            cache.users[user_id] = _restore_entity(User, None, user_id, name,
+                                                   [books[isbn] for isbn in borrowed.get(user_id, ()) if isbn in books])
+        return cache.users
+
+    def _load_records(self, record_ids: Iterable[str], cache: _RowCache) -> Dict[str, BorrowRecord]:
+        """Догружает в cache записи о заимствовании вместе с книгами и пользователями"""
+        missing = [record_id for record_id in dict.fromkeys(record_ids) if record_id not in cache.records]
+        if not missing:
+            return cache.records
+        rows = list(self._select_in(self._SELECT_RECORDS, missing))
+        books = self._load_books((row[1] for row in rows), cache)
+        users = self._load_users((row[2] for row in rows), cache)
+        for record_id, isbn, user_id, borrow_date, due_date, return_date in rows:
+            if isbn not in books or user_id not in users:
+                raise LibraryOperationError(f"Запись {record_id} ссылается на удаленную книгу или пользователя")
+            cache.records[record_id] = _restore_entity(
+                BorrowRecord, None, record_id, books[isbn], users[user_id], from_epoch_micros(borrow_date),
+                from_epoch_micros(due_date), from_epoch_micros(return_date) if return_date is not None else None)
+        return cache.records
+
+    def _fines_from_rows(self, rows: List[Tuple], cache: _RowCache) -> List[Fine]:
+        records = self._load_records((row[2] for row in rows), cache)
+        users = self._load_users((row[1] for row in rows), cache)
+        return [_restore_entity(Fine, None, fine_id, users[user_id], records[record_id], amount, reason, bool(paid))
+                for fine_id, user_id, record_id, amount, reason, paid in rows]
+
+    def _reservations_from_rows(self, rows: List[Tuple], cache: _RowCache) -> List[Reservation]:
+        books = self._load_books((row[2] for row in rows), cache)
+        users = self._load_users((row[1] for row in rows), cache)
+        return [_restore_entity(Reservation, None, reservation_id, users[user_id], books[isbn],
+                                from_epoch_micros(reservation_date), from_epoch_micros(expiry_date), bool(active))
+                for reservation_id, user_id, isbn, reservation_date, expiry_date, active in rows]
+
+    def _reviews_from_rows(self, rows: List[Tuple], cache: _RowCache) -> List[Review]:
+        books = self._load_books((row[2] for row in rows), cache)
+        users = self._load_users((row[1] for row in rows), cache)
+        return [_restore_entity(Review, None, review_id, users[user_id], books[isbn], rating, comment,
+                                from_epoch_micros(review_date))
+                for review_id, user_id, isbn, rating, comment, review_date in rows]
+
+    # --- Чтение ---
+
+    def get_book(self, isbn: str) -> Optional[Book]:
+        """Возвращает книгу по ISBN"""
+        return self._load_books([isbn], _RowCache()).get(isbn)
+
+    def get_user(self, user_id: str) -> Optional[User]:
+        """Возвращает пользователя по ID"""
+        return self._load_users([user_id], _RowCache()).get(user_id)
+
+    def get_author(self, author_id: str) -> Optional[Author]:
+        """Возвращает автора по ID"""
+        row = self._connection.execute("SELECT author_id, name, birth_year, country FROM authors "
+                                       "WHERE author_id = ? AND registered = 1", (author_id,)).fetchone()
+        return Author(*row) if row else None
+
+    def get_genre(self, genre_name: str) -> Optional[Genre]:
+        """Возвращает жанр по названию"""
+        row = self._connection.execute("SELECT name, description FROM genres WHERE name = ? AND registered = 1",
+                                       (genre_name,)).fetchone()
+        return Genre(*row) if row else None
+
+    def get_publisher(self, publisher_id: str) -> Optional[Publisher]:
+        """Возвращает издателя по ID"""
+        row = self._connection.execute("SELECT publisher_id, name, location FROM publishers "
+                                       "WHERE publisher_id = ? AND registered = 1", (publisher_id,)).fetchone()
+        return Publisher(*row) if row else None
+
+    def get_borrow_record(self, record_id: str) -> Optional[BorrowRecord]:
+        """Возвращает запись о заимствовании по ID"""
+        return self._load_records([record_id], _RowCache()).get(record_id)
+
+    def get_fine(self, fine_id: str) -> Optional[Fine]:
+        """Возвращает штраф по ID"""
+        rows = self._connection.execute("SELECT * FROM fines WHERE fine_id = ?", (fine_id,)).fetchall()
+        fines = self._fines_from_rows(rows, _RowCache())
+        return fines[0] if fines else None
+
+    def get_user_fines(self, user_id: str) -> List[Fine]:
+        """Возвращает неоплаченные штрафы пользователя"""
+        rows = self._connection.execute("SELECT * FROM fines WHERE user_id = ? AND paid = 0 ORDER BY rowid",
+                                        (user_id,)).fetchall()
+        return self._fines_from_rows(rows, _RowCache())
+
+    def get_user_borrow_records(self, user_id: str) -> List[BorrowRecord]:
+        """Возвращает все записи о заимствовании пользователя"""
+        record_ids = [row[0] for row in self._connection.execute(
+            "SELECT record_id FROM borrow_records WHERE user_id = ? ORDER BY rowid", (user_id,))]
+        records = self._load_records(record_ids, _RowCache())
+        return [records[record_id] for record_id in record_ids]
+
+    def search_books(self, title: str = "", author: str = "", genre: str = "") -> List[Book]:
+        """
+        Поиск книг по подстрокам без учета регистра, в порядке добавления. Кандидатов
+        отбирает триграммный индекс (фрагменты от трех символов), совпадение подстрок
+        проверяется по столбцам в нижнем регистре.
+        """
+        conditions: List[str] = []
+        params: List[str] = []
+        match = []
+        for column, fragment in (("title", title), ("authors", author), ("genre", genre)):
+            if self._fts and len(fragment) >= 3:
+                match.append('{} : "{}"'.format(column, fragment.replace('"', '""')))
+        if match:
+            conditions.append("b.seq IN (SELECT rowid FROM book_text WHERE book_text MATCH ?)")
+            params.append(" AND ".join(match))
+        if title:
+            conditions.append("instr(b.title_lower, ?) > 0")
+            params.append(title.lower())
+        if author:
+            conditions.append("EXISTS (SELECT 1 FROM book_authors ba JOIN authors a ON a.author_id = ba.author_id "
+                              "WHERE ba.isbn = b.isbn AND instr(a.name_lower, ?) > 0)")
+            params.append(author.lower())
+        if genre:
+            conditions.append("instr(g.name_lower, ?) > 0")
+            params.append(genre.lower())
+
+        sql = "SELECT b.isbn FROM books b JOIN genres g ON g.name = b.genre"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        isbns = [row[0] for row in self._connection.execute(sql + " ORDER BY b.seq", params)]
+        books = self._load_books(isbns, _RowCache())
+        return [books[isbn] for isbn in isbns]
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """Возвращает статистику библиотеки; счетчики берутся из частичных индексов"""
+        now = to_epoch_micros(self._clock())
+        scalar = self._scalar
+        return {
+            "total_books": scalar("SELECT count(*) FROM books"),
+            "total_users": scalar("SELECT count(*) FROM users"),
+            "total_authors": scalar("SELECT count(*) FROM authors WHERE registered = 1"),
+            "active_borrows": scalar("SELECT count(*) FROM borrow_records WHERE return_date IS NULL"),
+            "overdue_books": (scalar("SELECT count(*) FROM borrow_records WHERE return_date > due_date")
+                              + scalar("SELECT count(*) FROM borrow_records "
+                                       "WHERE return_date IS NULL AND due_date < ?", (now,))),
+            "active_reservations": scalar("SELECT count(*) FROM reservations "
+                                          "WHERE active = 1 AND expiry_date >= ?", (now,)),
+            "unpaid_fines": scalar("SELECT count(*) FROM fines WHERE paid = 0"),
+            "total_reviews": scalar("SELECT count(*) FROM reviews"),
+        }
+
+    # --- Операции ---
+
+    def borrow_book(self, user_id: str, isbn: str, due_date: datetime) -> BorrowRecord:
+        """Выдает книгу пользователю"""
+        cache = _RowCache()
+        user = self._load_users([user_id], cache).get(user_id)
+        book = self._load_books([isbn], cache).get(isbn)
+
+        if not user:
+            raise LibraryException(f"Пользователь с ID {user_id} не найден")
+        if not book:
+            raise LibraryException(f"Книга с ISBN {isbn} не найдена")
+
+        record = BorrowRecord(self._next_id("br", "borrow_records", "record_id"), book, user, self._clock(), due_date)
+        with self._connection:
+            self._connection.execute(self._INSERT_RECORD, self._record_params(record))
+            self._connection.execute(self._INSERT_USER_BOOK, (user_id, isbn))
+        user.borrow_book(book)
+        return record
+
+    def return_book(self, record_id: str) -> None:
+        """Возвращает книгу в библиотеку, начисляя штраф за просрочку"""
+        row = self._connection.execute("SELECT isbn, user_id, due_date FROM borrow_records WHERE record_id = ?",
+                                       (record_id,)).fetchone()
+        if row is None:
+            raise LibraryException(f"Запись с ID {record_id} не найдена")
+        isbn, user_id, due_date = row
+        returned = self._clock()
+        with self._connection:
+            self._connection.execute("UPDATE borrow_records SET return_date = ? WHERE record_id = ?",
+                                     (to_epoch_micros(returned), record_id))
+            self._connection.execute("DELETE FROM user_books WHERE user_id = ? AND isbn = ?", (user_id, isbn))
+            if to_epoch_micros(returned) > due_date:
+                self._charge_overdue_fine(record_id, user_id, from_epoch_micros(due_date), returned)
+
+    def _charge_overdue_fine(self, record_id: str, user_id: str, due_date: datetime, as_of: datetime) -> None:
+        """Доводит штраф за просрочку по записи до суммы на момент as_of (см. Library._charge_overdue_fine)"""
+        days_overdue = (as_of - due_date).days
+        fines = self._connection.execute("SELECT fine_id, amount, paid FROM fines WHERE record_id = ? ORDER BY rowid",
+                                         (record_id,)).fetchall()
+        unpaid = next((fine_id for fine_id, _, paid in fines if not paid), None)
+        amount = days_overdue * self.FINE_PER_DAY - sum(amount for _, amount, paid in fines if paid)
+        if amount <= 0:
+            return
+
+        reason = f"Просрочка возврата на {days_overdue} дней"
+        if unpaid is not None:
+            self._connection.execute("UPDATE fines SET amount = ?, reason = ? WHERE fine_id = ?",
+                                     (amount, reason, unpaid))
+        else:
+            self._connection.execute(self._INSERT_FINE, (self._next_id("fine", "fines", "fine_id"), user_id,
+                                                         record_id, amount, reason, False))
+
+    def pay_fine(self, fine_id: str) -> None:
+        """Отмечает штраф оплаченным"""
+        with self._connection:
+            updated = self._connection.execute("UPDATE fines SET paid = 1 WHERE fine_id = ?", (fine_id,)).rowcount
+        if not updated:
+            raise LibraryException(f"Штраф с ID {fine_id} не найден")
+
+    def to_library(self) -> Library:
+        """Загружает всю базу в память как Library"""
+        library = Library(self._name)
+        cache = _RowCache()
+        execute = self._connection.execute
+        for row in execute("SELECT author_id, name, birth_year, country FROM authors WHERE registered = 1"):
+            library.add_author(cache.identity_map.author(*row))
+        for row in execute("SELECT name, description FROM genres WHERE registered = 1"):
+            library.add_genre(cache.identity_map.genre(*row))
+        for row in execute("SELECT publisher_id, name, location FROM publishers WHERE registered = 1"):
+            library.add_publisher(cache.identity_map.publisher(*row))
+
+        isbns = [row[0] for row in execute("SELECT isbn FROM books ORDER BY seq")]
+        books = self._load_books(isbns, cache)
+        for isbn in isbns:
+            library.add_book(books[isbn])
+        user_ids = [row[0] for row in execute("SELECT user_id FROM users ORDER BY rowid")]
+        users = self._load_users(user_ids, cache)
+        for user_id in user_ids:
+            library.add_user(users[user_id])
+        record_ids = [row[0] for row in execute("SELECT record_id FROM borrow_records ORDER BY rowid")]
+        records = self._load_records(record_ids, cache)
+        for record_id in record_ids:
+            library.add_borrow_record(records[record_id])
+        for fine in self._fines_from_rows(execute("SELECT * FROM fines ORDER BY rowid").fetchall(), cache):
+            library.add_fine(fine)
+        for reservation in self._reservations_from_rows(
+                execute("SELECT * FROM reservations ORDER BY rowid").fetchall(), cache):
+            library.add_reservation(reservation)
+        for review in self._reviews_from_rows(execute("SELECT * FROM reviews ORDER BY rowid").fetchall(), cache):
+            library.add_review(review)
+        library.checkpoint()
+        return library
+
+
+def save_library_to_xml(library: Library, filename: str) -> None:
+    """
+    Сохраняет всю библиотеку в XML файл. Разделы идут в порядке Library.SECTIONS,
+    поэтому load_library_from_xml восстанавливает ссылки за один проход.
+    """
+    with XmlStreamWriter(filename, "library", {"name": library.name}) as writer:
+        writer.start("authors")
+        for author in library.authors.values():
+            writer.start("author", {"id": author.author_id})
+            writer.element("name", author.name)
+            if author.birth_year:
+                writer.element("birth_year", str(author.birth_year))
+            if author.country:
+                writer.element("country", author.country)
+            writer.end()
+        writer.end()
+
+        writer.start("genres")
+        for genre in library.genres.values():
+            _write_genre_xml(writer, genre)
+        writer.end()
+
+        writer.start("publishers")
+        for publisher in library.publishers.values():
+            _write_publisher_xml(writer, publisher)
+        writer.end()
+
+        writer.start("books")
+        for book in library.books.values():
+            _write_book_xml(writer, book)
+        writer.end()
+
+        writer.start("users")
+        for user in library.users.values():
+            writer.start("user", {"id": user.user_id})
+            writer.element("name", user.name)
+            writer.start("borrowed_books")
+            for book in user.borrowed_books:
+                writer.element("book_isbn", book.isbn)
+            writer.end()
+            writer.end()
+        writer.end()
+
+        sections = (
+            ("borrow_records", library.borrow_records, _write_borrow_record_xml),
+            ("fines", library.fines, _write_fine_xml),
+            ("reservations", library.reservations, _write_reservation_xml),
+            ("reviews", library.reviews, _write_review_xml),
+        )
+        for tag, items, write_item in sections:
+            writer.start(tag)
+            for item in items.values():
+                write_item(writer, item)
+            writer.end()
+
+
+def _xml_text(el: ET.Element, tag: str) -> Optional[str]:
+    """Текст дочернего элемента или None, если его нет"""
+    child = el.find(tag)
+    return child.text if child is not None else None
+
+
+def _author_dict_from_xml(el: ET.Element) -> Dict[str, Any]:
+    birth_year = _xml_text(el, "birth_year")
+    return {
+        "author_id": el.get("id"),
+        "name": _xml_text(el, "name"),
+        "birth_year": int(birth_year) if birth_year is not None else None,
+        "country": _xml_text(el, "country"),
+    }
+
+
+def _genre_dict_from_xml(el: ET.Element) -> Dict[str, Any]:
+    return {"name": _xml_text(el, "name"), "description": _xml_text(el, "description") or ""}
+
+
+def _publisher_dict_from_xml(el: ET.Element) -> Dict[str, Any]:
+    return {"publisher_id": el.get("id"), "name": _xml_text(el, "name"), "location": _xml_text(el, "location")}
+
+
+def _book_dict_from_xml(el: ET.Element) -> Dict[str, Any]:
+    pages = _xml_text(el, "pages")
+    return {
+        "isbn": el.get("isbn"),
+        "title": _xml_text(el, "title"),
+        "authors": [_author_dict_from_xml(a_el) for a_el in el.find("authors").findall("author")],
+        "genre": _genre_dict_from_xml(el.find("genre")),
+        "publisher": _publisher_dict_from_xml(el.find("publisher")),
+        "year": int(_xml_text(el, "year")),
+        "pages": int(pages) if pages is not None else None,
+    }
+
+
+def _user_dict_from_xml(el: ET.Element) -> Dict[str, Any]:
+    borrowed_el = el.find("borrowed_books")
+    return {
+        "user_id": el.get("id"),
+        "name": _xml_text(el, "name"),
+        "borrowed_books": [isbn_el.text for isbn_el in borrowed_el.findall("book_isbn")]
+                          if borrowed_el is not None else [],
+    }
+
+
+def _borrow_record_dict_from_xml(el: ET.Element) -> Dict[str, Any]:
+    return {
+        "record_id": el.get("id"),
+        "book_isbn": _xml_text(el, "book_isbn"),
+        "user_id": _xml_text(el, "user_id"),
+        "borrow_date": _xml_text(el, "borrow_date"),
+        "due_date": _xml_text(el, "due_date"),
+        "return_date": _xml_text(el, "return_date"),
+    }
+
+
+def _fine_dict_from_xml(el: ET.Element) -> Dict[str, Any]:
+    return {
+        "fine_id": el.get("id"),
+        "user_id": _xml_text(el, "user_id"),
+        "borrow_record_id": _xml_text(el, "borrow_record_id"),
+        "amount": float(_xml_text(el, "amount")),
+        "reason": _xml_text(el, "reason"),
+        "paid": _xml_text(el, "paid").lower() == "true",
+    }
+
+
+def _reservation_dict_from_xml(el: ET.Element) -> Dict[str, Any]:
+    return {
+        "reservation_id": el.get("id"),
+        "user_id": _xml_text(el, "user_id"),
+        "book_isbn": _xml_text(el, "book_isbn"),
+        "reservation_date": _xml_text(el, "reservation_date"),
+        "expiry_date": _xml_text(el, "expiry_date"),
+        "active": _xml_text(el, "active").lower() == "true",
+    }
+
+
+def _review_dict_from_xml(el: ET.Element) -> Dict[str, Any]:
+    return {
+        "review_id": el.get("id"),
+        "user_id": _xml_text(el, "user_id"),
+        "book_isbn": _xml_text(el, "book_isbn"),
+        "rating": int(_xml_text(el, "rating")),
+        "comment": _xml_text(el, "comment") or "",
+        "review_date": _xml_text(el, "review_date"),
+    }
+
+
+# Раздел XML-снимка -> разбор его элемента в словарь формата to_dict
+_XML_SECTION_PARSERS: Dict[str, Callable[[ET.Element], Dict[str, Any]]] = {
+    "authors": _author_dict_from_xml,
+    "genres": _genre_dict_from_xml,
+    "publishers": _publisher_dict_from_xml,
+    "books": _book_dict_from_xml,
+    "users": _user_dict_from_xml,
+    "borrow_records": _borrow_record_dict_from_xml,
+    "fines": _fine_dict_from_xml,
+    "reservations": _reservation_dict_from_xml,
+    "reviews": _review_dict_from_xml,
+}
+
+
+def load_library_from_xml(filename: str) -> Library:
+    """
+    Загружает всю библиотеку из XML, сохраненного save_library_to_xml, за один потоковый
+    проход: каждая сущность создается по закрывающему тегу, ссылки разрешаются через
+    реестры библиотеки и IdentityMap, а разобранный элемент сразу освобождается.
+    """
+    library: Optional[Library] = None
+    identity_map = IdentityMap()
+    path = []
+
+    for event, elem in ET.iterparse(filename, events=("start", "end")):
+        if event == "start":
+            if not path:
+                if elem.tag != "library":
+                    raise LibraryException(f"Ожидался корневой элемент library, найден {elem.tag}")
+                library = Library(elem.get("name"))
+            path.append(elem)
+            continue
+
+        path.pop()
+        if len(path) == 2:
+            parser = _XML_SECTION_PARSERS.get(path[1].tag)
+            if parser is not None:
+                library.add_from_dict(path[1].tag, parser(elem), identity_map)
+            path[-1].remove(elem)
+
+    library.checkpoint()
+    return library
 
 
 def save_librarians_to_json(librarians: List[Librarian], filename: str) -> None:
@@ -2552,32 +6650,25 @@ def load_librarians_from_json(filename: str, books_dict: Dict[str, Book] = None)
 
 def save_librarians_to_xml(librarians: List[Librarian], filename: str) -> None:
     """Сохраняет список библиотекарей в XML файл"""
-    root = ET.Element("librarians")
-
-    for librarian in librarians:
-        l_el = ET.SubElement(root, "librarian", {"id": librarian.user_id})
+    with XmlStreamWriter(filename, "librarians") as writer:
+        for librarian in librarians:
+            writer.start("librarian", {"id": librarian.user_id})
 
-        ET.SubElement(l_el, "name").text = librarian.name
-        ET.SubElement(l_el, "employee_id").text = librarian.employee_id
-        ET.SubElement(l_el, "department").text = librarian.department
-        ET.SubElement(l_el, "admin_rights").text = str(librarian.admin_rights)
+            writer.element("name", librarian.name)
+            writer.element("employee_id", librarian.employee_id)
+            writer.element("department", librarian.department)
+            writer.element("admin_rights", str(librarian.admin_rights))
 
-        borrowed_el = ET.SubElement(l_el, "borrowed_books")
-        for book in librarian.borrowed_books:
-            ET.SubElement(borrowed_el, "book_isbn").text = book.isbn
+            writer.start("borrowed_books")
+            for book in librarian.borrowed_books:
+                writer.element("book_isbn", book.isbn)
+            writer.end()
+            writer.end()
 
-    indent(root)
-    tree = ET.ElementTree(root)
-    tree.write(filename, encoding="utf-8", xml_declaration=True)
-
-
-def load_librarians_from_xml(filename: str, books_dict: Dict[str, Book] = None) -> List[Librarian]:
-    """Загружает список библиотекарей из XML файла"""
-    tree = ET.parse(filename)
-    root = tree.getroot()
 
-    librarians = []
-    for l_el in root.findall("librarian"):
+def iter_librarians_from_xml(filename: str, books_dict: Dict[str, Book] = None) -> Iterator[Librarian]:
+    """Потоково считывает библиотекарей из XML, отдавая объекты по одному по мере разбора"""
+    for l_el in _iter_xml_elements(filename, "librarian"):
         try:
             user_id = l_el.get("id")
             name = l_el.find("name").text
@@ -2594,92 +6685,337 @@ def load_librarians_from_xml(filename: str, books_dict: Dict[str, Book] = None)
                     if isbn in books_dict:
                         librarian.borrow_book(books_dict[isbn])
 
-            librarians.append(librarian)
+            yield librarian
 
         except Exception as e:
             print(f"Ошибка загрузки библиотекаря {l_el.get('id')}: {e}")
 
-    return librarians
+
+def load_librarians_from_xml(filename: str, books_dict: Dict[str, Book] = None) -> List[Librarian]:
+    """Загружает список библиотекарей из XML файла"""
+    return list(iter_librarians_from_xml(filename, books_dict))
+
+
+# БЕНЧМАРКИ
+
+
+def _measure_allocations(factory: Callable[[], Any], count: int) -> float:
+    """Средний объем памяти (байт), выделяемой на один объект фабрики"""
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        items = [factory() for _ in range(count)]
+        total = tracemalloc.get_traced_memory()[0] - start - sys.getsizeof(items)
+    finally:
+        tracemalloc.stop()
+    return total / count
+
+
+def benchmark_entity_memory(count: int = 10000) -> Dict[str, Tuple[float, float]]:
+    """
+    Сравнивает память на один экземпляр сущности: раскладка с __dict__ (как до перехода
+    на __slots__) против текущей раскладки на слотах. Значения полей общие, поэтому
+    учитываются только накладные расходы самого объекта.
+    Возвращает словарь: имя класса -> (байт с __dict__, байт со __slots__).
+    """
+    now = datetime.now()
+    author = Author("A0", "Автор", 1900, "Россия")
+    genre = Genre("Жанр", "Описание")
+    publisher = Publisher("P0", "Издатель", "Москва")
+    book = Book("isbn-0", "Книга", [author], genre, publisher, 2000, 100)
+    user = User("U0", "Читатель")
+    record = BorrowRecord("br_0", book, user, now, now + timedelta(days=14))
+    samples = [
+        author, genre, publisher, book, user, record,
+        Fine("fine_0", user, record, 10, "Просрочка"),
+        Reservation("res_0", user, book, now, now + timedelta(days=3)),
+        Review("rev_0", user, book, 5, "Отлично", now),
+        Librarian("L0", "Библиотекарь", "E0", "Абонемент"),
+    ]
+
+    results = {}
+    for sample in samples:
+        cls = sample.__class__
+        names = _slot_names(cls)
+        values = [getattr(sample, name) for name in names]
+        with_dict = type(f"{cls.__name__}WithDict", (), {})
+
+        def make_dict_based() -> Any:
+            obj = with_dict()
+            for name, value in zip(names, values):
+                setattr(obj, name, value)
+            return obj
+
+        def make_slotted() -> Any:
+            obj = cls.__new__(cls)
+            for name, value in zip(names, values):
+                object.__setattr__(obj, name, value)
+            return obj
+
+        results[cls.__name__] = (_measure_allocations(make_dict_based, count),
+                                 _measure_allocations(make_slotted, count))
+    return results
+
+
+def build_benchmark_library(book_count: int = 5000, thread_safe: bool = False) -> Library:
+    """Синтетическая библиотека для бенчмарков: книги, читатели, выдачи, штрафы, брони и отзывы"""
+    library = Library("Бенчмарк", thread_safe=thread_safe)
+    authors = [Author(f"A{i}", f"Автор {i}", 1800 + i % 200, "Россия") for i in range(max(1, book_count // 20))]
+    genres = [Genre(f"Жанр {i}", "Описание") for i in range(10)]
+    publishers = [Publisher(f"P{i}", f"Издательство {i}", "Москва") for i in range(5)]
+    for author in authors:
+        library.add_author(author)
+    for genre in genres:
+        library.add_genre(genre)
+    for publisher in publishers:
+        library.add_publisher(publisher)
+
+    start = datetime(2024, 1, 1)
+    for i in range(book_count):
+        book = Book(f"978-{i:09d}", f"Книга {i}", [authors[i % len(authors)]], genres[i % len(genres)],
+                    publishers[i % len(publishers)], 1900 + i % 120, 100 + i % 700)
+        library.add_book(book)
+        user = User(f"U{i}", f"Читатель {i}")
+        library.add_user(user)
+        borrowed = start + timedelta(days=i % 300)
+        returned = borrowed + timedelta(days=i % 30) if i % 2 else None
+        record = BorrowRecord(f"br_{i}", book, user, borrowed, borrowed + timedelta(days=14), returned)
+        library.add_borrow_record(record)
+        if i % 10 == 0:
+            library.add_fine(Fine(f"fine_{i}", user, record, 10 * (i % 7 + 1), "Просрочка", i % 20 == 0))
+        if i % 5 == 0:
+            library.add_reservation(Reservation(f"res_{i}", user, book, borrowed, borrowed + timedelta(days=3)))
+        if i % 3 == 0:
+            library.add_review(Review(f"rev_{i}", user, book, i % 5 + 1, "Отзыв", borrowed))
+    return library
+
+
+def _best_time(action: Callable[[], Any], repeat: int) -> float:
+    """Лучшее время (секунды) из repeat запусков"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        action()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def benchmark_snapshot_formats(book_count: int = 5000,
+                               repeat: int = 3) -> Dict[str, Tuple[float, float, float, int]]:
+    """
+    Сравнивает JSON и двоичный снимок на синтетической библиотеке.
+    Возвращает словарь: формат -> (секунд на сохранение, секунд на загрузку, секунд на загрузку
+    с первым поиском, размер файла в байтах). Поисковые индексы строятся при первом поиске,
+    поэтому только третье число показывает полную цену открытия библиотеки.
+    """
+    library = build_benchmark_library(book_count)
+    formats = {
+        "json": (save_library_to_json, load_library_from_json),
+        "binary": (save_library_to_binary, load_library_from_binary),
+    }
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, (save, load) in formats.items():
+            filename = os.path.join(directory, f"library.{name}")
+            save_seconds = _best_time(lambda: save(library, filename), repeat)
+            load_seconds = _best_time(lambda: load(filename), repeat)
+            ready_seconds = _best_time(lambda: load(filename).search_books("Книга"), repeat)
+            results[name] = (save_seconds, load_seconds, ready_seconds, os.path.getsize(filename))
+    return results
+
+
+def benchmark_storage_engines(book_count: int = 5000, repeat: int = 3) -> Dict[str, Tuple[float, float, float]]:
+    """
+    Сравнивает движки хранения на книгах синтетической библиотеки.
+    Возвращает словарь: движок -> (операций в секунду для put, get и scan).
+    get и scan идут через новую коллекцию раздела, то есть с чтением и разбором записей
+    движка; у MemoryStorage коллекция одна и та же, и объекты в ней уже живые.
+    """
+    books = list(build_benchmark_library(book_count).books.values())
+    engines = {
+        "memory": lambda directory: MemoryStorage(),
+        "dbm": lambda directory: DbmStorage(os.path.join(directory, "dbm")),
+        "sqlite": lambda directory: SqliteStorage(os.path.join(directory, "library.sqlite")),
+    }
+    results = {}
+    for name, make_engine in engines.items():
+        with tempfile.TemporaryDirectory() as directory:
+            engine = make_engine(directory)
+            # Пустая библиотека на движке дает коллекциям контекст для сборки книг
+            decode = Library("Бенчмарк", storage=engine)._decoder("books")
+
+            def put() -> None:
+                collection = engine.collection("books", decode)
+                for book in books:
+                    collection[book.isbn] = book
+                engine.flush()
+
+            def get() -> None:
+                collection = engine.collection("books", decode)
+                for book in books:
+                    collection[book.isbn]
+
+            def scan() -> None:
+                for _ in engine.collection("books", decode).values():
+                    pass
+
+            put_seconds = _best_time(put, repeat)
+            get_seconds = _best_time(get, repeat)
+            scan_seconds = _best_time(scan, repeat)
+            engine.close()
+            results[name] = tuple(len(books) / seconds for seconds in (put_seconds, get_seconds, scan_seconds))
+    return results
+
+
+def benchmark_concurrent_library(book_count: int = 2000, operations: int = 20000,
+                                 thread_counts: Iterable[int] = (1, 2, 4, 8),
+                                 seed: int = 0) -> Dict[int, float]:
+    """
+    Нагрузочный тест потокобезопасной библиотеки: потоки делят между собой operations
+    операций - 60% get_book, 20% search_books и 20% выдач с возвратом (borrow_book и
+    return_book считаются двумя операциями). Возвращает словарь: потоков -> операций в
+    секунду. Чистый Python выполняет байт-код под GIL, поэтому рост с числом потоков
+    ограничен; тест показывает, что блокировки разделов не сводят параллельность к нулю.
+    """
+    library = build_benchmark_library(book_count, thread_safe=True)
+    isbns = list(library.books)
+    user_ids = list(library.users)
+    due_date = datetime(2030, 1, 1)
+
+    def worker(worker_seed: int, count: int) -> int:
+        rng = random.Random(worker_seed)
+        done = 0
+        while done < count:
+            roll = rng.random()
+            if roll < 0.6:
+                library.get_book(rng.choice(isbns))
+                done += 1
+            elif roll < 0.8:
+                library.search_books(title=f"Книга {rng.randrange(book_count)}")
+                done += 1
+            else:
+                record = library.borrow_book(rng.choice(user_ids), rng.choice(isbns), due_date)
+                library.return_book(record.record_id)
+                done += 2
+        return done
+
+    results = {}
+    for threads in thread_counts:
+        share = operations // threads
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            futures = [executor.submit(worker, seed * 1000 + index, share) for index in range(threads)]
+            done = sum(future.result() for future in futures)
+        results[threads] = done / (time.perf_counter() - started)
+    return results
+
+
+def print_benchmarks() -> None:
+    """Печатает результаты всех бенчмарков (python main.py --benchmark)"""
+    # Память на одну сущность
+    print("\nПамять на сущность (байт): __dict__ -> __slots__")
+    for class_name, (dict_bytes, slots_bytes) in benchmark_entity_memory(1000).items():
+        print(f"{class_name}: {dict_bytes:.0f} -> {slots_bytes:.0f}")
+
+    # JSON против двоичного снимка
+    print("\nСнимок библиотеки: сохранение, загрузка, загрузка с первым поиском (с), размер (байт)")
+    for format_name, (save_seconds, load_seconds, ready_seconds, size) in benchmark_snapshot_formats(2000).items():
+        print(f"{format_name}: {save_seconds:.3f}, {load_seconds:.3f}, {ready_seconds:.3f}, {size}")
+
+    # Движки хранения
+    print("\nДвижки хранения: put, get, scan (операций в секунду)")
+    for engine_name, (put_rate, get_rate, scan_rate) in benchmark_storage_engines(2000).items():
+        print(f"{engine_name}: {put_rate:.0f}, {get_rate:.0f}, {scan_rate:.0f}")
+
+    # Потокобезопасная библиотека под нагрузкой
+    print("\nПотокобезопасная библиотека: операций в секунду по числу потоков")
+    for threads, rate in benchmark_concurrent_library(1000, 10000).items():
+        print(f"{threads}: {rate:.0f}")
 
 
 # ДЕМОНСТРАЦИЯ РАБОТЫ
 
-library = Library("Главная библиотека")
-
-# Создание авторов
-author1 = Author("A1", "Лев Толстой", 1828, "Россия")
-author2 = Author("A2", "Фёдор Достоевский", 1821, "Россия")
-author3 = Author("A3", "Антон Чехов", 1860, "Россия")
-
-# Создание жанров
-genre1 = Genre("Роман", "Крупное повествовательное произведение")
-genre2 = Genre("Рассказ", "Небольшое прозаическое произведение")
-
-# Создание издателей
-publisher1 = Publisher("P1", "Эксмо", "Москва")
-publisher2 = Publisher("P2", "АСТ", "Москва")
-
-# Создание книг
-book1 = Book("978-5-699-12014-7", "Война и мир", [author1], genre1, publisher1, 1869, 1225)
-book2 = Book("978-5-17-067555-8", "Преступление и наказание", [author2], genre1, publisher2, 1866, 671)
-book3 = Book("978-5-389-08255-5", "Вишневый сад", [author3], genre2, publisher1, 1904, 150)
-
-# Добавление в библиотеку
-library.add_author(author1)
-library.add_author(author2)
-library.add_author(author3)
-library.add_genre(genre1)
-library.add_genre(genre2)
-library.add_publisher(publisher1)
-library.add_publisher(publisher2)
-library.add_book(book1)
-library.add_book(book2)
-library.add_book(book3)
-
-# Создание пользователей
-user1 = User("U1", "Иван Петров")
-user2 = User("U2", "Мария Сидорова")
-library.add_user(user1)
-library.add_user(user2)
-
-
-print("Создана библиотека с книгами:")
-for book in library.books.values():
-    print(f"- {book.title} ({book.authors[0].name})")
-
-print(f"\nВсего книг: {len(library.books)}")
-print(f"Всего пользователей: {len(library.users)}")
-
-# Выдача книги
-due_date = datetime.now() + timedelta(days=14)
-record = library.borrow_book("U1", "978-5-699-12014-7", due_date)
-print(f"\nКнига '{record.book.title}' выдана пользователю {record.user.name}")
-
-# Поиск книг
-print("\nПоиск книг Толстого:")
-found_books = library.search_books(author="Толстой")
-for book in found_books:
-    print(f"- {book.title}")
-
-# Сохранение в JSON
-save_library_to_json(library, "library_demo.json")
-save_books_to_json(list(library.books.values()), "books_demo.json")
-save_authors_to_json(list(library.authors.values()), "authors_demo.json")
-
-# Сохранение в XML
-save_library_to_xml(library, "library_demo.xml")
-save_books_to_xml(list(library.books.values()), "books_demo.xml")
-save_authors_to_xml(list(library.authors.values()), "authors_demo.xml")
-
-print("\nДанные сохранены в файлы JSON и XML")
-
-# Загрузка из JSON для демонстрации
-loaded_library = load_library_from_json("library_demo.json")
-print(f"\nЗагружена библиотека: {loaded_library.name}")
-print(f"Книг загружено: {len(loaded_library.books)}")
-
-# Статистика
-stats = library.get_statistics()
-print("\nСтатистика библиотеки:")
-for key, value in stats.items():
-    print(f"{key}: {value}")
+if __name__ == "__main__":
+    library = Library("Главная библиотека")
+
+    # Создание авторов
+    author1 = Author("A1", "Лев Толстой", 1828, "Россия")
+    author2 = Author("A2", "Фёдор Достоевский", 1821, "Россия")
+    author3 = Author("A3", "Антон Чехов", 1860, "Россия")
+
+    # Создание жанров
+    genre1 = Genre("Роман", "Крупное повествовательное произведение")
+    genre2 = Genre("Рассказ", "Небольшое прозаическое произведение")
+
+    # Создание издателей
+    publisher1 = Publisher("P1", "Эксмо", "Москва")
+    publisher2 = Publisher("P2", "АСТ", "Москва")
+
+    # Создание книг
+    book1 = Book("978-5-699-12014-7", "Война и мир", [author1], genre1, publisher1, 1869, 1225)
+    book2 = Book("978-5-17-067555-8", "Преступление и наказание", [author2], genre1, publisher2, 1866, 671)
+    book3 = Book("978-5-389-08255-5", "Вишневый сад", [author3], genre2, publisher1, 1904, 150)
+
+    # Добавление в библиотеку
+    library.add_author(author1)
+    library.add_author(author2)
+    library.add_author(author3)
+    library.add_genre(genre1)
+    library.add_genre(genre2)
+    library.add_publisher(publisher1)
+    library.add_publisher(publisher2)
+    library.add_book(book1)
+    library.add_book(book2)
+    library.add_book(book3)
+
+    # Создание пользователей
+    user1 = User("U1", "Иван Петров")
+    user2 = User("U2", "Мария Сидорова")
+    library.add_user(user1)
+    library.add_user(user2)
+
+
+    print("Создана библиотека с книгами:")
+    for book in library.books.values():
+        print(f"- {book.title} ({book.authors[0].name})")
+
+    print(f"\nВсего книг: {len(library.books)}")
+    print(f"Всего пользователей: {len(library.users)}")
+
+    # Выдача книги
+    due_date = datetime.now() + timedelta(days=14)
+    record = library.borrow_book("U1", "978-5-699-12014-7", due_date)
+    print(f"\nКнига '{record.book.title}' выдана пользователю {record.user.name}")
+
+    # Поиск книг
+    print("\nПоиск книг Толстого:")
+    found_books = library.search_books(author="Толстой")
+    for book in found_books:
+        print(f"- {book.title}")
+
+    # Сохранение в JSON
+    save_library_to_json(library, "library_demo.json")
+    save_books_to_json(list(library.books.values()), "books_demo.json")
+    save_authors_to_json(list(library.authors.values()), "authors_demo.json")
+
+    # Сохранение в XML
+    save_library_to_xml(library, "library_demo.xml")
+    save_books_to_xml(list(library.books.values()), "books_demo.xml")
+    save_authors_to_xml(list(library.authors.values()), "authors_demo.xml")
+
+    print("\nДанные сохранены в файлы JSON и XML")
+
+    # Загрузка из JSON для демонстрации
+    loaded_library = load_library_from_json("library_demo.json")
+    print(f"\nЗагружена библиотека: {loaded_library.name}")
+    print(f"Книг загружено: {len(loaded_library.books)}")
+
+    # Статистика
+    stats = library.get_statistics()
+    print("\nСтатистика библиотеки:")
+    for key, value in stats.items():
+        print(f"{key}: {value}")
+
+    # Бенчмарки идут несколько секунд и пишут временные базы, поэтому только по флагу
+    if "--benchmark" in sys.argv[1:]:
+        print_benchmarks()
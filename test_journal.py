@@ -0,0 +1,277 @@
+"""Тесты журнала изменений библиотеки (LibraryJournal, WriteAheadLog)"""
+import json
+import os
+import threading
+from datetime import datetime
+
+from main import (Author, Book, Fine, Genre, Librarian, Library, LibraryJournal, MappedCatalog, Publisher,
+                  Reservation, User, save_library_catalog)
+
+
+def make_book(number: int) -> Book:
+    return Book(f"978-{number:09d}", f"Книга {number}", [Author("A1", "Автор", 1900, "Россия")],
+                Genre("Роман", "Описание"), Publisher("P1", "Издательство", "Москва"), 2000, 100)
+
+
+def reopen(directory: str):
+    journal = LibraryJournal(str(directory))
+    return journal, journal.open()
+
+
+def test_replay_restores_operations(tmp_path):
+    journal, library = reopen(tmp_path)
+    library.add_user(User("U1", "Иван"))
+    for number in range(3):
+        library.add_book(make_book(number))
+    record = library.borrow_book("U1", "978-000000000", datetime(2030, 1, 1))
+    library.return_book(record.record_id)
+    library.delete_book("978-000000002")
+    journal.close()
+
+    journal, restored = reopen(tmp_path)
+    assert sorted(restored.books) == ["978-000000000", "978-000000001"]
+    assert restored.get_borrow_record(record.record_id).return_date == record.return_date
+    assert not restored.has_changes()
+    journal.close()
+
+
+def test_compaction_keeps_state_and_drops_old_files(tmp_path):
+    journal, library = reopen(tmp_path)
+    library.add_user(User("U1", "Иван"))
+    library.add_book(make_book(0))
+    journal.compact(background=False)
+    library.add_book(make_book(1))
+    journal.close()
+
+    assert sorted(os.listdir(tmp_path)) == ["snapshot-1.json", "wal-1.log"]
+    journal, restored = reopen(tmp_path)
+    assert sorted(restored.books) == ["978-000000000", "978-000000001"]
+    assert list(restored.users) == ["U1"]
+    journal.close()
+
+
+def test_replay_skips_entries_already_in_snapshot(tmp_path):
+    journal, library = reopen(tmp_path)
+    for number in range(3):
+        library.add_book(make_book(number))
+    journal.sync()
+    # Снимок, в который уже попали записи текущего сегмента (как при гонке с компактацией)
+    journal._write_snapshot(journal._snapshot_data(library.to_dict(), 3), 0)
+    library.add_book(make_book(3))
+    journal.close()
+
+    journal, restored = reopen(tmp_path)
+    assert len(restored.books) == 4
+    journal.close()
+
+
+def test_direct_entity_changes_are_journaled(tmp_path):
+    journal, library = reopen(tmp_path)
+    user = User("U1", "Иван")
+    library.add_user(user)
+    library.add_book(make_book(0))
+    record = library.borrow_book("U1", "978-000000000", datetime(2030, 1, 1))
+    library.add_fine(Fine("F1", user, record, 50, "Порча"))
+    library.add_reservation(Reservation("R1", user, library.get_book("978-000000000"),
+                                        datetime(2029, 1, 1), datetime(2031, 1, 1)))
+    librarian = Librarian("L1", "Мария", "E1")
+    librarian.manage_fine(library.get_fine("F1"))
+    librarian.cancel_reservation(library.get_reservation("R1"))
+    library.get_book("978-000000000").title = "Новое название"
+    journal.close()
+
+    journal, restored = reopen(tmp_path)
+    assert restored.get_fine("F1").paid
+    assert not restored.get_reservation("R1").active
+    assert restored.get_book("978-000000000").title == "Новое название"
+    assert [book.title for book in restored.search_books("Новое")] == ["Новое название"]
+    journal.close()
+
+
+def test_librarian_goes_through_library_operations(tmp_path):
+    journal = LibraryJournal(str(tmp_path))
+    library = journal.open(thread_safe=True)
+    user = User("U1", "Иван")
+    library.add_user(user)
+    library.add_book(make_book(0))
+    record = library.borrow_book("U1", "978-000000000", datetime(2030, 1, 1))
+    library.add_fine(Fine("F1", user, record, 50, "Порча"))
+    library.add_reservation(Reservation("R1", user, library.get_book("978-000000000"),
+                                        datetime(2029, 1, 1), datetime(2031, 1, 1)))
+    librarian = Librarian("L1", "Мария", "E1")
+    librarian.manage_fine(library.get_fine("F1"))
+    librarian.cancel_reservation(library.get_reservation("R1"))
+    journal.close()
+
+    with open(os.path.join(tmp_path, "wal-0.log"), "r", encoding="utf-8") as f:
+        operations = [json.loads(line)["op"] for line in f]
+    assert operations[-2:] == ["pay_fine", "cancel_reservation"]
+    assert library.get_waitlist("978-000000000") == []
+
+
+def test_genre_rename_is_journaled(tmp_path):
+    journal, library = reopen(tmp_path)
+    library.add_genre(Genre("Роман", "Проза"))
+    library.get_genre("Роман").name = "Поэзия"
+    journal.close()
+
+    journal, restored = reopen(tmp_path)
+    assert restored.get_genre("Роман") is None
+    assert restored.get_genre("Поэзия").description == "Проза"
+    journal.close()
+
+
+def journal_entries(directory) -> int:
+    count = 0
+    for name in os.listdir(directory):
+        if name.startswith("wal-"):
+            with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+                count += sum(1 for _ in f)
+    return count
+
+
+def test_reads_do_not_write_to_journal(tmp_path):
+    journal, library = reopen(tmp_path)
+    user = User("U1", "Иван")
+    library.add_user(user)
+    library.add_book(make_book(0))
+    book = library.get_book("978-000000000")
+    library.add_reservation(Reservation("R1", user, book, datetime(2029, 1, 1), datetime(2999, 1, 1)))
+    library.add_reservation(Reservation("R2", user, book, datetime(2020, 1, 1), datetime(2020, 1, 3)))
+    journal.sync()
+    written = journal_entries(tmp_path)
+
+    # Первое чтение снимает истекшее резервирование - это одно изменение
+    assert [r.reservation_id for r in library.get_waitlist(book.isbn)] == ["R1"]
+    journal.sync()
+    assert journal_entries(tmp_path) == written + 1
+    for _ in range(5):
+        library.get_waitlist(book.isbn)
+        library.next_reservation(book.isbn)
+    journal.sync()
+    assert journal_entries(tmp_path) == written + 1
+    journal.close()
+
+    journal, restored = reopen(tmp_path)
+    assert not restored.get_reservation("R2").active
+    assert restored.get_reservation("R1").active
+    journal.close()
+
+
+def test_catalog_faults_are_not_changes(tmp_path):
+    source = Library("Каталог")
+    source.add_user(User("U1", "Иван"))
+    source.add_book(make_book(0))
+    catalog_file = str(tmp_path / "catalog.bin")
+    save_library_catalog(source, catalog_file)
+
+    journal = LibraryJournal(str(tmp_path / "journal"))
+    library = journal.open()
+    library.attach_catalog(MappedCatalog(catalog_file))
+    journal.sync()
+    written = journal_entries(tmp_path / "journal")
+    assert library.get_book("978-000000000").title == "Книга 0"
+    assert library.get_user("U1").name == "Иван"
+    with library.bulk_load():
+        assert library.get_book("978-000000000") is not None
+    journal.sync()
+    assert journal_entries(tmp_path / "journal") == written
+    assert not library.has_changes()
+    assert [book.isbn for book in library.search_books("Книга")] == ["978-000000000"]
+    journal.close()
+
+
+def test_torn_last_line_is_ignored(tmp_path):
+    journal, library = reopen(tmp_path)
+    library.add_book(make_book(0))
+    library.add_book(make_book(1))
+    journal.close()
+    # Сбой посреди записи оставляет строку без перевода строки
+    with open(os.path.join(tmp_path, "wal-0.log"), "a", encoding="utf-8") as f:
+        f.write('{"op": "add_book", "at": "2030-01-0')
+
+    journal, restored = reopen(tmp_path)
+    assert sorted(restored.books) == ["978-000000000", "978-000000001"]
+    restored.add_book(make_book(2))
+    journal.close()
+
+    journal, restored = reopen(tmp_path)
+    assert len(restored.books) == 3
+    journal.close()
+
+
+def test_durable_journal_waits_for_fsync(tmp_path, monkeypatch):
+    synced = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: synced.append(fd) or real_fsync(fd))
+
+    # Фоновая синхронизация и группа по размеру не успеют сработать сами
+    journal = LibraryJournal(str(tmp_path), group_size=1000, group_interval=60, durable=True)
+    library = journal.open()
+    for number in range(3):
+        before = len(synced)
+        library.add_book(make_book(number))
+        assert len(synced) == before + 1
+    journal.close()
+
+    journal = LibraryJournal(str(tmp_path), group_size=1000, group_interval=60)
+    library = journal.open()
+    before = len(synced)
+    library.add_book(make_book(3))
+    assert len(synced) == before
+    journal.sync()
+    assert len(synced) == before + 1
+    journal.close()
+
+
+def test_thread_safe_compaction_under_load(tmp_path):
+    journal = LibraryJournal(str(tmp_path), group_interval=0.01)
+    library = journal.open(thread_safe=True)
+    library.add_user(User("U1", "Иван"))
+    errors = []
+    done = threading.Event()
+
+    def write(offset: int) -> None:
+        try:
+            for number in range(offset, offset + 300):
+                library.add_book(make_book(number))
+                record = library.borrow_book("U1", f"978-{number:09d}", datetime(2030, 1, 1))
+                library.return_book(record.record_id)
+        except Exception as error:
+            errors.append(error)
+
+    def read() -> None:
+        try:
+            while not done.is_set():
+                library.analytics()
+                library.query().year_between(1990, 2010).all()
+                list(library.books_by_year(1990, 2010))
+                list(library.iter_overdue())
+        except Exception as error:
+            errors.append(error)
+
+    def compact() -> None:
+        try:
+            while not done.is_set():
+                journal.compact(background=False)
+        except Exception as error:
+            errors.append(error)
+
+    writers = [threading.Thread(target=write, args=(offset,)) for offset in (0, 1000, 2000)]
+    others = [threading.Thread(target=read), threading.Thread(target=compact)]
+    for thread in writers + others:
+        thread.start()
+    for thread in writers:
+        thread.join(30)
+    done.set()
+    for thread in others:
+        thread.join(30)
+    assert not any(thread.is_alive() for thread in writers + others)
+    assert not errors
+    expected = library.to_dict()
+    journal.close()
+
+    journal, restored = reopen(tmp_path)
+    assert restored.to_dict()["books"] == expected["books"]
+    assert restored.to_dict()["borrow_records"] == expected["borrow_records"]
+    journal.close()
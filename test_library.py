@@ -0,0 +1,268 @@
+"""Тесты индексов, запросов и сохранения библиотеки"""
+from datetime import datetime
+from typing import List
+
+import pytest
+
+from main import (Author, Book, BorrowRecord, Fine, Genre, GenreError, JsonLinesStore, Library, LibraryException,
+                  Publisher, Reservation, Review, SqliteLibrary, User, build_benchmark_library,
+                  load_library_from_binary, load_library_from_json, load_library_from_xml, load_library_with_deltas,
+                  save_delta, save_library_to_binary, save_library_to_json, save_library_to_xml)
+
+
+@pytest.fixture
+def library() -> Library:
+    library = Library("Тест")
+    authors = [Author("A1", "Лев Толстой", 1828, "Россия"), Author("A2", "Антон Чехов", 1860, "Россия")]
+    genres = [Genre("Роман", "Проза"), Genre("Пьеса", "Драматургия")]
+    publisher = Publisher("P1", "Издательство", "Москва")
+    for author in authors:
+        library.add_author(author)
+    for genre in genres:
+        library.add_genre(genre)
+    library.add_publisher(publisher)
+    for user_id, name in (("U1", "Иван"), ("U2", "Мария")):
+        library.add_user(User(user_id, name))
+    for number in range(12):
+        library.add_book(Book(f"978-{number:09d}", f"Книга {number}", [authors[number % 2]],
+                              genres[number % 2], publisher, 1990 + number, 100 + 10 * number))
+    return library
+
+
+def scan_search(library: Library, title: str = "", author: str = "", genre: str = "") -> List[str]:
+    """Поиск полным просмотром, с которым сверяются индексы"""
+    return [book.isbn for book in library.books.values()
+            if title.lower() in book.title.lower()
+            and any(author.lower() in a.name.lower() for a in book.authors)
+            and genre.lower() in book.genre.name.lower()]
+
+
+SEARCHES = [("Книга 1", "", ""), ("книга", "", ""), ("", "Автор 2", ""), ("", "", "Жанр 3"),
+            ("Книга 4", "автор", "жанр"), ("нет такой", "", ""), ("1", "", ""), ("", "втор 1", "")]
+
+
+def test_search_matches_full_scan():
+    library = build_benchmark_library(300)
+    for fragments in SEARCHES:
+        assert [book.isbn for book in library.search_books(*fragments)] == scan_search(library, *fragments)
+
+    library.delete_book("978-000000010")
+    library.get_book("978-000000011").title = "Новое название 1"
+    library.add_book(Book("979-000000001", "Книга 1 снова", [library.get_author("A2")],
+                          library.get_genre("Жанр 3"), library.get_publisher("P1"), 2001, 120))
+    for fragments in SEARCHES + [("Новое", "", "")]:
+        assert [book.isbn for book in library.search_books(*fragments)] == scan_search(library, *fragments)
+
+
+def test_query_plan_and_results():
+    library = build_benchmark_library(300)
+    books = list(library.books.values())
+
+    query = library.query().year_between(1950, 1955).pages_between(None, 500)
+    assert query.explain()["access"] == "index"
+    assert query.all() == [b for b in books if 1950 <= b.year <= 1955 and b.pages <= 500]
+
+    query = library.query().genre("Жанр 2").order_by("year", reverse=True).offset(2).limit(5)
+    plan = query.explain()
+    assert (plan["index"], plan["order_by"], plan["offset"], plan["limit"]) == ("genre = Жанр 2", ("year", "desc"), 2, 5)
+    expected = sorted((b for b in books if b.genre.name == "Жанр 2"), key=lambda b: b.year, reverse=True)
+    assert query.all() == expected[2:7]
+
+    assert library.query().author("A3").title_contains("Книга 6").all() == \
+        [b for b in books if b.authors[0].author_id == "A3" and "Книга 6" in b.title]
+    assert library.query().year_between(3000).explain()["estimated_rows"] == 0
+
+
+def test_title_contains_falls_back_to_scan_for_unselective_text(library):
+    query = library.query().title_contains("Книга")
+    assert query.explain()["access"] == "scan"
+    assert len(query.all()) == 12
+    assert [book.title for book in library.query().title_contains("Книга 1").all()] == \
+        ["Книга 1", "Книга 10", "Книга 11"]
+
+
+def test_reverse_indexes_follow_reassigned_references(library):
+    book0, book1 = library.get_book("978-000000000"), library.get_book("978-000000001")
+    user1, user2 = library.get_user("U1"), library.get_user("U2")
+    record = BorrowRecord("R1", book0, user1, datetime(2024, 1, 1), datetime(2024, 1, 15))
+    library.add_borrow_record(record)
+    library.add_fine(Fine("F1", user1, record, 10, "Просрочка"))
+    library.add_fine(Fine("F2", user1, record, 20, "Порча"))
+    library.add_review(Review("V1", user1, book0, 5, "Отлично", datetime(2024, 2, 1)))
+
+    library.get_fine("F1").amount = 15
+    assert [fine.fine_id for fine in library.get_user_fines("U1")] == ["F1", "F2"]
+    library.get_fine("F1").user = user2
+    assert [fine.fine_id for fine in library.get_user_fines("U2")] == ["F1"]
+    assert [fine.fine_id for fine in library.get_user_fines("U1")] == ["F2"]
+
+    library.get_review("V1").book = book1
+    assert library.get_book_reviews(book0.isbn) == []
+    assert [review.review_id for review in library.get_book_reviews(book1.isbn)] == ["V1"]
+
+    record.user = user2
+    record.book = book1
+    assert library.get_user_borrow_records("U1") == []
+    assert library.get_user_borrow_records("U2") == [record]
+    assert library.get_book_borrow_records(book0.isbn) == []
+    assert library.get_book_borrow_records(book1.isbn) == [record]
+
+    library.delete_fine("F1")
+    library.delete_review("V1")
+    assert library.get_user_fines("U2") == []
+    assert library.get_book_reviews(book1.isbn) == []
+
+
+def test_renamed_author_and_genre_are_reindexed(library):
+    library.get_author("A1").name = "Фёдор Достоевский"
+    assert len(library.search_books(author="Достоевский")) == 6
+    assert library.search_books(author="Толстой") == []
+    assert "Фёдор Достоевский" in library.autocomplete("Фёд")
+    matches = library.fuzzy_search_books("Достоевскй")
+    assert matches and all(book.authors[0].author_id == "A1" for book, _ in matches)
+
+    library.get_genre("Роман").name = "Поэзия"
+    assert len(library.search_books(genre="Поэзия")) == 6
+    assert library.search_books(genre="Роман") == []
+    assert len(library.query().genre("Поэзия").all()) == 6
+
+
+def test_waitlist_follows_reservation_changes(library):
+    book0, book1 = library.get_book("978-000000000"), library.get_book("978-000000001")
+    user1, user2 = library.get_user("U1"), library.get_user("U2")
+    first = Reservation("R1", user1, book0, datetime(2024, 1, 1), datetime(2999, 1, 1))
+    second = Reservation("R2", user2, book0, datetime(2024, 1, 2), datetime(2999, 1, 1))
+    library.add_reservation(first)
+    library.add_reservation(second)
+
+    first.expiry_date = datetime(2998, 1, 1)
+    assert library.get_waitlist(book0.isbn) == [first, second]
+
+    first.book = book1
+    assert library.get_waitlist(book1.isbn) == [first]
+    assert library.next_reservation(book0.isbn) is second
+
+    second.cancel_reservation()
+    assert library.get_waitlist(book0.isbn) == []
+    second.activate_reservation()
+    library.delete_reservation("R1")
+    assert library.get_waitlist(book1.isbn) == []
+    assert library.get_waitlist(book0.isbn) == [second]
+
+
+def test_genre_rename_is_carried_by_delta(library):
+    copy = Library.from_dict(library.to_dict())
+    library.checkpoint()
+    library.get_genre("Роман").name = "Поэзия"
+    delta = library.delta_to_dict()
+    assert delta["deleted"] == {"genres": ["Роман"]}
+    assert len(delta["books"]) == 6
+
+    copy.apply_delta(delta)
+    assert copy.get_genre("Роман") is None
+    assert copy.get_genre("Поэзия").description == "Проза"
+    assert len(copy.search_books(genre="Поэзия")) == 6
+    assert copy.to_dict() == library.to_dict()
+
+    with pytest.raises(LibraryException):
+        library.get_genre("Поэзия").name = "Пьеса"
+    with pytest.raises(GenreError):
+        library.delete_genre("Пьеса")
+
+
+def test_loan_store_is_built_from_current_records(library):
+    book, user = library.get_book("978-000000000"), library.get_user("U1")
+    library.add_borrow_record(BorrowRecord("R1", book, user, datetime(2024, 1, 1), datetime(2024, 1, 11)))
+    library.add_borrow_record(BorrowRecord("R2", book, user, datetime(2024, 2, 1), datetime(2024, 2, 11),
+                                           datetime(2024, 2, 5)))
+    as_of = datetime(2024, 3, 1)
+    assert library.get_overdue_rate(as_of) == 0.5
+    library.get_borrow_record("R1").return_date = datetime(2024, 1, 5)
+    assert library.get_overdue_rate(as_of) == 0.0
+    assert library.get_mean_loan_days_by_genre(as_of) == {"Роман": 4.0}
+    library.delete_borrow_record("R2")
+    assert len(library.loan_store) == 1
+
+
+@pytest.mark.parametrize("save, load", [(save_library_to_json, load_library_from_json),
+                                        (save_library_to_xml, load_library_from_xml),
+                                        (save_library_to_binary, load_library_from_binary)])
+def test_snapshot_round_trip(library, tmp_path, save, load):
+    book, user = library.get_book("978-000000003"), library.get_user("U2")
+    record = BorrowRecord("R1", book, user, datetime(2024, 1, 1), datetime(2024, 1, 15))
+    library.add_borrow_record(record)
+    library.add_fine(Fine("F1", user, record, 12.5, "Просрочка"))
+    library.add_reservation(Reservation("S1", user, book, datetime(2024, 1, 2), datetime(2999, 1, 1)))
+    library.add_review(Review("V1", user, book, 4, "Хорошо", datetime(2024, 2, 1)))
+    filename = str(tmp_path / "library.snapshot")
+    save(library, filename)
+
+    restored = load(filename)
+    assert restored.to_dict() == library.to_dict()
+    assert restored.get_statistics() == library.get_statistics()
+    assert not restored.has_changes()
+    assert [r.reservation_id for r in restored.get_waitlist(book.isbn)] == ["S1"]
+    assert [f.fine_id for f in restored.get_user_fines("U2")] == ["F1"]
+    assert [b.isbn for b in restored.search_books(author="Чехов")] == \
+        [b.isbn for b in library.search_books(author="Чехов")]
+
+
+def test_analytics_reports(library):
+    pytest.importorskip("numpy")
+    book, user = library.get_book("978-000000000"), library.get_user("U1")
+    record = BorrowRecord("R1", book, user, datetime(2024, 1, 1), datetime(2024, 1, 11), datetime(2024, 1, 14))
+    library.add_borrow_record(record)
+    library.add_fine(Fine("F1", user, record, 30, "Просрочка"))
+    library.add_review(Review("V1", user, book, 5, "Отлично", datetime(2024, 2, 1)))
+
+    analytics = library.analytics(datetime(2024, 3, 1))
+    assert analytics.overdue_days_distribution() == {3: 1}
+    assert analytics.fine_totals_by_user() == {"U1": 30.0}
+    assert analytics.loans_per_genre_per_month() == {"Роман": {"2024-01": 1}}
+    assert analytics.rating_histograms() == {book.isbn: [0, 0, 0, 0, 1]}
+
+
+def test_delta_round_trip(library, tmp_path):
+    snapshot, delta = str(tmp_path / "library.json"), str(tmp_path / "delta.json")
+    save_library_to_json(library, snapshot)
+    library.checkpoint()
+    book = library.get_book("978-000000002")
+    book.title = "Новое название"
+    library.delete_book("978-000000005")
+    library.add_borrow_record(BorrowRecord("R1", book, library.get_user("U1"),
+                                           datetime(2024, 1, 1), datetime(2024, 1, 15)))
+    save_delta(library, delta)
+    assert not library.has_changes()
+
+    restored = load_library_with_deltas(snapshot, [delta])
+    assert restored.to_dict() == library.to_dict()
+    assert [b.isbn for b in restored.search_books("Новое")] == ["978-000000002"]
+
+
+def test_json_lines_store_round_trip(library, tmp_path):
+    store = JsonLinesStore(str(tmp_path / "store"))
+    store.save(library)
+    book = library.get_book("978-000000001")
+    book.title = "Другое название"
+    store.append(book)
+    library.delete_book("978-000000003")
+    store.append_delete("books", "978-000000003")
+
+    assert store.load().to_dict() == library.to_dict()
+    store.compact()
+    restored = store.load()
+    assert restored.to_dict() == library.to_dict()
+    assert not restored.has_changes()
+
+
+def test_sqlite_library_matches_library(tmp_path):
+    library = build_benchmark_library(200)
+    with SqliteLibrary(str(tmp_path / "library.db"), library.name) as stored:
+        stored.import_library(library)
+        for fragments in SEARCHES:
+            assert [book.isbn for book in stored.search_books(*fragments)] == \
+                [book.isbn for book in library.search_books(*fragments)]
+        assert stored.get_statistics() == library.get_statistics()
+        assert [r.record_id for r in stored.get_user_borrow_records("U4")] == \
+            [r.record_id for r in library.get_user_borrow_records("U4")]
+        assert stored.to_library().to_dict() == library.to_dict()